@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actions', '0002_action_auto_approve'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='timings',
+            field=jsonfield.fields.JSONField(default={}),
+        ),
+    ]
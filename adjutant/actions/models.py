@@ -18,6 +18,8 @@ from django.conf import settings
 from django.db import models
 from django.utils import timezone
 
+from adjutant.actions import unit_of_work
+
 
 class Action(models.Model):
     """
@@ -41,6 +43,13 @@ class Action(models.Model):
     auto_approve = models.NullBooleanField(default=None)
     order = models.IntegerField()
     created = models.DateTimeField(default=timezone.now)
+    # stage name to the duration, Keystone calls and queries it took:
+    timings = JSONField(default={})
+
+    def save(self, *args, **kwargs):
+        if unit_of_work.defer_save(self, args, kwargs):
+            return
+        super(Action, self).save(*args, **kwargs)
 
     def get_action(self):
         """Returns self as the appropriate action wrapper type."""
@@ -12,6 +12,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from threading import Lock
+from time import time
 
 from django.conf import settings
 
@@ -23,6 +25,8 @@ from cinderclient import client as cinderclient
 from neutronclient.v2_0 import client as neutronclient
 from novaclient import client as novaclient
 
+from adjutant import metrics
+
 # Defined for use locally
 DEFAULT_COMPUTE_VERSION = "2"
 DEFAULT_IDENTITY_VERSION = "3"
@@ -34,48 +38,137 @@ DEFAULT_VOLUME_VERSION = "2"
 
 # Auth session shared by default with all clients
 client_auth_session = None
+auth_session_lock = Lock()
+
+
+class InstrumentedSession(session.Session):
+    """
+    Session which records the time taken by each HTTP request in the
+    OpenStack call metrics, by service type and HTTP method.
+
+    Keystone calls are counted by the identity managers rather than
+    here, see user_store.keystone_call_totals.
+    """
+
+    def request(self, url, method, *args, **kwargs):
+        endpoint_filter = kwargs.get('endpoint_filter') or {}
+        labels = {
+            'service': endpoint_filter.get('service_type', 'auth'),
+            'method': method,
+            'result': 'error',
+        }
+        start = time()
+        try:
+            response = super(InstrumentedSession, self).request(
+                url, method, *args, **kwargs)
+            if response.status_code < 400:
+                labels['result'] = 'ok'
+            return response
+        finally:
+            metrics.openstack_call_duration.observe(time() - start, **labels)
 
 
 def get_auth_session():
     """ Returns a global auth session to be shared by all clients """
     global client_auth_session
-    if not client_auth_session:
-
-        auth = v3.Password(
-            username=settings.KEYSTONE['username'],
-            password=settings.KEYSTONE['password'],
-            project_name=settings.KEYSTONE['project_name'],
-            auth_url=settings.KEYSTONE['auth_url'],
-            user_domain_id=settings.KEYSTONE.get('domain_id', "default"),
-            project_domain_id=settings.KEYSTONE.get('domain_id', "default"),
-        )
-        client_auth_session = session.Session(auth=auth)
+    with auth_session_lock:
+        if not client_auth_session:
+
+            auth = v3.Password(
+                username=settings.KEYSTONE['username'],
+                password=settings.KEYSTONE['password'],
+                project_name=settings.KEYSTONE['project_name'],
+                auth_url=settings.KEYSTONE['auth_url'],
+                user_domain_id=settings.KEYSTONE.get('domain_id', "default"),
+                project_domain_id=settings.KEYSTONE.get(
+                    'domain_id', "default"),
+            )
+            client_auth_session = InstrumentedSession(auth=auth)
 
     return client_auth_session
 
 
+class ClientPool(object):
+    """
+    Thread safe pool of OpenStack clients keyed by service, region
+    and version.
+
+    All the clients are built on the shared auth session, so they reuse
+    its token and its kept-alive HTTP connections. A client is rebuilt
+    once it is older than CLIENT_POOL_MAX_AGE seconds.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._clients = {}
+            self._hits = 0
+            self._misses = 0
+            self._expired = 0
+
+    def get(self, service, region, version, factory):
+        key = (service, region, version)
+        now = time()
+        with self._lock:
+            try:
+                client, created = self._clients[key]
+                if now - created < settings.CLIENT_POOL_MAX_AGE:
+                    self._hits += 1
+                    return client
+                self._expired += 1
+            except KeyError:
+                pass
+            self._misses += 1
+            client = factory()
+            self._clients[key] = (client, now)
+            return client
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._clients),
+                'hits': self._hits,
+                'misses': self._misses,
+                'expired': self._expired,
+            }
+
+
+client_pool = ClientPool()
+
+
 def get_keystoneclient(version=DEFAULT_IDENTITY_VERSION):
-    return ks_client.Client(
-        version,
-        session=get_auth_session())
+    return client_pool.get(
+        'identity', None, version,
+        lambda: ks_client.Client(
+            version,
+            session=get_auth_session()))
 
 
 def get_neutronclient(region):
     # always returns neutron client v2
-    return neutronclient.Client(
-        session=get_auth_session(),
-        region_name=region)
+    return client_pool.get(
+        'network', region, '2',
+        lambda: neutronclient.Client(
+            session=get_auth_session(),
+            region_name=region))
 
 
 def get_novaclient(region, version=DEFAULT_COMPUTE_VERSION):
-    return novaclient.Client(
-        version,
-        session=get_auth_session(),
-        region_name=region)
+    return client_pool.get(
+        'compute', region, version,
+        lambda: novaclient.Client(
+            version,
+            session=get_auth_session(),
+            region_name=region))
 
 
 def get_cinderclient(region, version=DEFAULT_VOLUME_VERSION):
-    return cinderclient.Client(
-        version,
-        session=get_auth_session(),
-        region_name=region)
+    return client_pool.get(
+        'volume', region, version,
+        lambda: cinderclient.Client(
+            version,
+            session=get_auth_session(),
+            region_name=region))
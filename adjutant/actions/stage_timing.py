@@ -0,0 +1,111 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from threading import local
+from time import time
+
+from django.db import connection
+
+from adjutant.actions.user_store import keystone_call_totals
+
+
+# Queries run by the current thread
+_queries = local()
+
+
+def query_count():
+    """
+    Returns the number of queries run by this thread through a
+    connection with the query counter installed. Callers take the
+    difference between two snapshots.
+    """
+    return getattr(_queries, 'count', 0)
+
+
+def _count_query():
+    _queries.count = getattr(_queries, 'count', 0) + 1
+
+
+class QueryCountingCursor(object):
+    """ Cursor wrapper counting the queries run through it. """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cursor.__exit__(exc_type, exc_value, traceback)
+
+    def callproc(self, *args, **kwargs):
+        _count_query()
+        return self.cursor.callproc(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        _count_query()
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        _count_query()
+        return self.cursor.executemany(*args, **kwargs)
+
+
+def install_query_counter(db_connection):
+    """
+    Wraps the cursors of the given connection so their queries are
+    counted in query_count. Unlike Django's query log this keeps no
+    record of the queries, so it is cheap enough to leave on.
+    """
+    if getattr(db_connection, 'query_counter_installed', False):
+        return
+    make_cursor = db_connection.make_cursor
+    make_debug_cursor = db_connection.make_debug_cursor
+    db_connection.make_cursor = (
+        lambda cursor: QueryCountingCursor(make_cursor(cursor)))
+    db_connection.make_debug_cursor = (
+        lambda cursor: QueryCountingCursor(make_debug_cursor(cursor)))
+    db_connection.query_counter_installed = True
+
+
+class StageTimer(object):
+    """
+    Measures the wall time, Keystone calls and database queries
+    of a block of work in the current thread.
+    """
+
+    def __enter__(self):
+        install_query_counter(connection)
+        self._queries = query_count()
+        self._calls = keystone_call_totals()[0]
+        self._start = time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time() - self._start
+        self.keystone_calls = keystone_call_totals()[0] - self._calls
+        self.queries = query_count() - self._queries
+
+    def to_dict(self):
+        return {
+            'duration': round(self.duration, 4),
+            'keystone_calls': self.keystone_calls,
+            'queries': self.queries,
+        }
@@ -0,0 +1,150 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from contextlib import contextmanager
+from logging import getLogger
+from threading import local
+
+from django.db import transaction
+
+
+logger = getLogger('adjutant')
+
+_state = local()
+
+
+class UnitOfWork(object):
+    """
+    Collects model saves so they can be written together.
+
+    Models register themselves instead of saving while a unit of work
+    is active, and each distinct model is written once, in the order
+    first registered, when the unit of work is flushed.
+
+    Saves are kept by nesting level, so a nested block that fails can
+    discard just its own saves.
+    """
+
+    def __init__(self):
+        # the saves registered at each nesting level, outermost first
+        self.levels = [[]]
+
+    @property
+    def pending(self):
+        return [instance for level in self.levels for instance in level]
+
+    def register(self, instance):
+        for pending in self.pending:
+            if pending is instance:
+                return
+        self.levels[-1].append(instance)
+
+    def begin(self):
+        """Starts a nested level."""
+        self.levels.append([])
+
+    def end(self):
+        """Ends the innermost level, keeping its saves."""
+        level = self.levels.pop()
+        self.levels[-1].extend(level)
+
+    def discard(self):
+        """
+        Drops the pending saves of the innermost level, ending it if
+        nested, and returns them.
+        """
+        if len(self.levels) > 1:
+            return self.levels.pop()
+        pending, self.levels[0] = self.levels[0], []
+        return pending
+
+    def flush(self):
+        pending = self.pending
+        if not pending:
+            return
+        self.levels = [[] for level in self.levels]
+        with transaction.atomic():
+            for instance in pending:
+                instance.save(flush=True)
+
+
+def current():
+    """Returns the active unit of work for this thread, or None."""
+    return getattr(_state, 'unit_of_work', None)
+
+
+def flush():
+    """Flushes the active unit of work, if there is one."""
+    unit = current()
+    if unit is not None:
+        unit.flush()
+
+
+def defer_save(instance, args, kwargs):
+    """
+    Registers a save of the instance with the active unit of work.
+
+    Returns False when the save needs to happen now, either because
+    no unit of work is active, the save is the flush itself, or the
+    save has arguments that a deferred save can't honour, such as a
+    create.
+    """
+    if kwargs.pop('flush', False):
+        return False
+    unit = current()
+    if unit is None or args or kwargs or instance._state.adding:
+        return False
+    unit.register(instance)
+    return True
+
+
+def _discard(unit):
+    discarded = unit.discard()
+    if discarded:
+        logger.warning(
+            "Discarding %s unsaved model(s) after an error: %s",
+            len(discarded), ', '.join(repr(i) for i in discarded))
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Defers Action and Task saves until the end of the block.
+
+    Nested blocks join the outermost one, so only it flushes. If a
+    block raises, the saves pending from it are discarded rather than
+    writing partial state, and the error is left to propagate. Saves
+    from an enclosing block are kept, for it to flush if it succeeds.
+    """
+    unit = current()
+    if unit is not None:
+        unit.begin()
+        try:
+            yield unit
+        except BaseException:
+            _discard(unit)
+            raise
+        unit.end()
+        return
+
+    unit = UnitOfWork()
+    _state.unit_of_work = unit
+    try:
+        yield unit
+    except BaseException:
+        _discard(unit)
+        raise
+    finally:
+        _state.unit_of_work = None
+    unit.flush()
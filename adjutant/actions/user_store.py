@@ -13,13 +13,21 @@
 #    under the License.
 
 from collections import defaultdict
+from functools import wraps
+from logging import getLogger
+from threading import Lock, local
+from time import time
 
 from django.conf import settings
 
 from keystoneclient import exceptions as ks_exceptions
 
+from adjutant import metrics
+
 from openstack_clients import get_keystoneclient
 
+logger = getLogger('adjutant')
+
 
 def get_managable_roles(user_roles):
     """
@@ -36,6 +44,119 @@ def get_managable_roles(user_roles):
     return managable_role_names
 
 
+class RoleCatalog(object):
+    """
+    Process wide cache of the Keystone roles.
+
+    Roles almost never change, so rather than listing them for every
+    lookup we keep them for ROLE_CACHE_TTL seconds. Lookups by id that
+    miss trigger a refresh, as an id we haven't seen means the catalog
+    is out of date, while a missing name is just treated as missing.
+    Those refreshes happen at most once every ROLE_CACHE_MIN_REFRESH
+    seconds, so ids of deleted roles don't each list the roles again.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._by_id = {}
+            self._by_name = {}
+            self._expires = 0
+            self._refreshed = 0
+
+    def refresh(self, ks_client=None):
+        if ks_client is None:
+            ks_client = get_keystoneclient()
+        roles = ks_client.roles.list()
+        with self._lock:
+            self._by_id = {role.id: role for role in roles}
+            self._by_name = {role.name: role for role in roles}
+            self._refreshed = time()
+            self._expires = self._refreshed + settings.ROLE_CACHE_TTL
+
+    def _ensure_fresh(self, ks_client):
+        if time() >= self._expires:
+            self.refresh(ks_client)
+
+    def list(self, ks_client=None):
+        self._ensure_fresh(ks_client)
+        return self._by_id.values()
+
+    def get(self, role_id, ks_client=None):
+        self._ensure_fresh(ks_client)
+        role = self._by_id.get(role_id)
+        if (role is None and
+                time() - self._refreshed >= settings.ROLE_CACHE_MIN_REFRESH):
+            self.refresh(ks_client)
+            role = self._by_id.get(role_id)
+        return role
+
+    def find(self, name, ks_client=None):
+        self._ensure_fresh(ks_client)
+        return self._by_name.get(name)
+
+
+role_catalog = RoleCatalog()
+
+
+# Keystone calls made through identity managers by the current thread
+_keystone_calls = local()
+
+
+def keystone_call_totals():
+    """
+    Returns the number of identity manager calls made by this thread,
+    and the seconds spent in them, since the thread started. Callers
+    take the difference between two snapshots, such as for a request.
+
+    This is the one count of Keystone calls, used for the stage timings,
+    the request log and debug header, and the Keystone call metrics.
+    """
+    return (getattr(_keystone_calls, 'calls', 0),
+            getattr(_keystone_calls, 'seconds', 0.0))
+
+
+def _count_call(method):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        depth = getattr(_keystone_calls, 'depth', 0)
+        if depth:
+            # only the outermost call is counted, as manager methods
+            # can be built on each other
+            return method(*args, **kwargs)
+        _keystone_calls.depth = 1
+        result = 'error'
+        start = time()
+        try:
+            value = method(*args, **kwargs)
+            result = 'ok'
+            return value
+        finally:
+            seconds = time() - start
+            _keystone_calls.depth = 0
+            _keystone_calls.calls = getattr(_keystone_calls, 'calls', 0) + 1
+            _keystone_calls.seconds = (
+                getattr(_keystone_calls, 'seconds', 0.0) + seconds)
+            metrics.keystone_call_duration.observe(
+                seconds, call=method.__name__, result=result)
+    return wrapper
+
+
+def count_keystone_calls(manager_class):
+    """
+    Class decorator counting the calls to every public method of an
+    identity manager in keystone_call_totals.
+    """
+    for name, method in vars(manager_class).items():
+        if not name.startswith('_') and callable(method):
+            setattr(manager_class, name, _count_call(method))
+    return manager_class
+
+
+@count_keystone_calls
 class IdentityManager(object):
     """
     A wrapper object for the Keystone Client. Mainly setup as
@@ -46,6 +167,13 @@ class IdentityManager(object):
     def __init__(self):
         self.ks_client = get_keystoneclient()
 
+    def _get_role(self, role_id):
+        role = role_catalog.get(role_id, self.ks_client)
+        if role is None:
+            # most likely deleted since the assignment was listed
+            logger.warning("Skipping assignment of unknown role %s", role_id)
+        return role
+
     def find_user(self, name, domain):
         try:
             users = self.ks_client.users.list(name=name, domain=domain)
@@ -72,26 +200,48 @@ class IdentityManager(object):
         Rather than simply list users, we use the assignments
         endpoint so we can also fetch all the roles for those users
         in the given project. Saves further api calls later on.
+
+        The assignments include the user domains, so for a domain with
+        more than LIST_USERS_DOMAIN_THRESHOLD users on the project we
+        list that domain's users once rather than fetching each of them,
+        which bounds the number of api calls regardless of project size.
+        Smaller sets of users are fetched one at a time, as listing a
+        whole domain is far more expensive than a few single lookups.
         """
         try:
-            roles = self.ks_client.roles.list()
-            role_dict = {role.id: role for role in roles}
-
-            users = {}
+            user_roles = defaultdict(list)
+            domain_users = defaultdict(set)
             user_assignments = self.ks_client.role_assignments.list(
-                project=project)
+                project=project, include_names=True)
             for assignment in user_assignments:
                 try:
-                    user = users.get(assignment.user['id'], None)
-                    if user:
-                        user.roles.append(role_dict[assignment.role['id']])
-                    else:
-                        user = self.ks_client.users.get(assignment.user['id'])
-                        user.roles = [role_dict[assignment.role['id']], ]
-                        users[user.id] = user
+                    user = assignment.user
                 except AttributeError:
                     # Just means the assignment is a group, so ignore it.
-                    pass
+                    continue
+                role = self._get_role(assignment.role['id'])
+                if role is not None:
+                    user_roles[user['id']].append(role)
+                domain_users[user['domain']['id']].add(user['id'])
+
+            users = {}
+            for domain, user_ids in domain_users.items():
+                if len(user_ids) <= settings.LIST_USERS_DOMAIN_THRESHOLD:
+                    continue
+                for user in self.ks_client.users.list(domain=domain):
+                    if user.id in user_ids:
+                        users[user.id] = user
+
+            # Users of small domains, and any changed between the two
+            # listings, are fetched one at a time.
+            for user_id in set(user_roles) - set(users):
+                try:
+                    users[user_id] = self.ks_client.users.get(user_id)
+                except ks_exceptions.NotFound:
+                    del user_roles[user_id]
+
+            for user_id, user in users.items():
+                user.roles = user_roles[user_id]
         except ks_exceptions.NotFound:
             return []
         return users.values()
@@ -120,11 +270,7 @@ class IdentityManager(object):
         self.ks_client.users.update(user, name=name)
 
     def find_role(self, name):
-        try:
-            role = self.ks_client.roles.find(name=name)
-        except ks_exceptions.NotFound:
-            role = None
-        return role
+        return role_catalog.find(name, self.ks_client)
 
     def get_roles(self, user, project):
         return self.ks_client.roles.list(user=user, project=project)
@@ -135,14 +281,13 @@ class IdentityManager(object):
 
         Uses the new v3 assignments api method to quickly do this.
         """
-        roles = self.ks_client.roles.list()
-        role_dict = {role.id: role for role in roles}
-
         user_assignments = self.ks_client.role_assignments.list(user=user)
         projects = defaultdict(list)
         for assignment in user_assignments:
             project = assignment.scope['project']['id']
-            projects[project].append(role_dict[assignment.role['id']])
+            role = self._get_role(assignment.role['id'])
+            if role is not None:
+                projects[project].append(role)
 
         return projects
 
@@ -217,3 +362,66 @@ class IdentityManager(object):
         except ks_exceptions.NotFound:
             region = None
         return region
+
+
+class CachedIdentityManager(object):
+    """
+    A memoizing wrapper around an IdentityManager.
+
+    Read lookups are cached for the lifetime of the wrapper, so repeated
+    validation across actions doesn't go back to Keystone each time.
+    Any write clears the cache, as we can't cheaply know which of the
+    cached lookups it may have made stale.
+    """
+
+    read_methods = {
+        'find_user', 'get_user', 'list_users', 'find_role', 'get_roles',
+        'get_all_roles', 'find_project', 'get_project', 'get_domain',
+        'find_domain', 'get_region',
+    }
+
+    write_methods = {
+        'create_user', 'enable_user', 'disable_user', 'update_user_password',
+        'update_user_email', 'update_user_name', 'add_user_role',
+        'remove_user_role', 'update_project', 'create_project',
+    }
+
+    def __init__(self, manager=None):
+        if manager is None:
+            manager = IdentityManager()
+        self.manager = manager
+        self._cache = {}
+
+    def clear(self):
+        self._cache = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.manager, name)
+        if name in self.read_methods:
+            return self._cached(name, attr)
+        if name in self.write_methods:
+            return self._invalidating(attr)
+        return attr
+
+    def _cached(self, name, method):
+        def wrapper(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            try:
+                return self._cache[key]
+            except KeyError:
+                pass
+            except TypeError:
+                # unhashable arguments, so just don't cache this one.
+                return method(*args, **kwargs)
+            result = method(*args, **kwargs)
+            self._cache[key] = result
+            return result
+        return wrapper
+
+    def _invalidating(self, method):
+        def wrapper(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.clear()
+        return wrapper
@@ -1,10 +1,12 @@
 import six
 from smtplib import SMTPException
 
-from adjutant.api.v1.utils import create_notification
+from adjutant import metrics
+from adjutant.api.v1.utils import (
+    create_email_error_notification, queue_email)
+from adjutant.template_cache import get_template
 
 from django.core.mail import EmailMultiAlternatives
-from django.template import loader
 from django.conf import settings
 
 
@@ -23,13 +25,13 @@ def send_email(to_addresses, context, conf, task):
     elif isinstance(to_addresses, set):
         to_addresses = list(to_addresses)
 
-    text_template = loader.get_template(
+    text_template = get_template(
         conf['template'],
         using='include_etc_templates')
 
     html_template = conf.get('html_template', None)
     if html_template:
-        html_template = loader.get_template(
+        html_template = get_template(
             html_template,
             using='include_etc_templates')
 
@@ -65,7 +67,12 @@ def send_email(to_addresses, context, conf, task):
             email.attach_alternative(
                 html_template.render(context), "text/html")
 
-        email.send(fail_silently=False)
+        if settings.EMAIL_QUEUE:
+            queue_email(task, email, "additional email")
+        else:
+            with metrics.email_send_duration.time(
+                    mode='inline', result='ok'):
+                email.send(fail_silently=False)
         return True
 
     except SMTPException as e:
@@ -74,20 +81,6 @@ def send_email(to_addresses, context, conf, task):
                 ("Error: '%s' while sending additional email for task: %s"
                     % (e, task.uuid))
         }
-
-        errors_conf = settings.TASK_SETTINGS.get(
-            task.task_type, settings.DEFAULT_TASK_SETTINGS).get(
-                'errors', {}).get("SMTPException", {})
-
-        if errors_conf:
-            notification = create_notification(
-                task, notes, error=True,
-                engines=errors_conf.get('engines', True))
-
-            if errors_conf.get('notification') == "acknowledge":
-                notification.acknowledged = True
-                notification.save()
-        else:
-            create_notification(task, notes, error=True)
+        create_email_error_notification(task, notes)
 
         return False
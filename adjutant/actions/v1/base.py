@@ -17,8 +17,11 @@ from logging import getLogger
 from django.conf import settings
 from django.utils import timezone
 
-from adjutant.actions import user_store
+from adjutant import metrics
+from adjutant.actions import unit_of_work, user_store
 from adjutant.actions.models import Action
+from adjutant.actions.stage_timing import StageTimer
+from adjutant.startup.plans import get_plan
 
 
 class BaseAction(object):
@@ -54,10 +57,24 @@ class BaseAction(object):
 
     Other than the task cache, actions should not be altering database
     models other than themselves. This is not enforced, just a guideline.
+
+    Saves of the action and task models made during a stage are deferred
+    and written together in one transaction when the stage ends. Values
+    set with 'set_cache' are written straight away, as they are what lets
+    a failed stage be resumed.
+
+    The time, Keystone calls and queries each stage takes are kept in
+    the action's 'timings', by stage.
+
+    Identity lookups should go through 'id_manager', which is shared by
+    all the actions of a task for the duration of a stage, and caches
+    read lookups so the same Keystone calls aren't repeated.
     """
 
     required = []
 
+    _stage = None
+
     def __init__(self, data, action_model=None, task=None,
                  order=None):
         """
@@ -105,6 +122,9 @@ class BaseAction(object):
     def set_cache(self, key, value):
         self.action.cache[key] = value
         self.action.save()
+        # The cache records what has been done so a stage can be
+        # resumed, so make sure it is written before moving on.
+        unit_of_work.flush()
 
     @property
     def token_fields(self):
@@ -132,28 +152,69 @@ class BaseAction(object):
         self.action.task.add_action_note(
             str(self), note)
 
+    @property
+    def id_manager(self):
+        """
+        The identity manager for the current stage of the task.
+
+        Lives on the in memory task so it is shared between actions,
+        and is replaced whenever the task moves to a new stage.
+        """
+        task = self.action.task
+        stage = getattr(task, 'identity_stage', None)
+        manager = getattr(task, 'identity_manager', None)
+        if manager is None or stage != self._stage:
+            manager = user_store.CachedIdentityManager()
+            task.identity_manager = manager
+            task.identity_stage = self._stage
+        return manager
+
     @property
     def settings(self):
         """Get my settings.
 
         Returns a dict of the settings for this action.
         """
+        plan = get_plan(self.action.task.task_type)
+        return plan.action_settings.get(self.__class__.__name__, {})
+
+    def _run_stage(self, stage, stage_function, *args):
+        """
+        Runs a stage in a unit of work, recording its wall time,
+        Keystone calls and queries on the action and in the metrics.
+
+        The timings are saved along with the stage's deferred saves,
+        so they cover the stage up to those being written. If the stage
+        raises its other saves are discarded, but the timings are still
+        saved on their own.
+        """
+        self._stage = stage
+        timer = StageTimer()
+        result = 'error'
         try:
-            task_conf = settings.TASK_SETTINGS[self.action.task.task_type]
-            return task_conf['action_settings'].get(
-                self.__class__.__name__, {})
-        except KeyError:
-            return settings.DEFAULT_ACTION_SETTINGS.get(
-                self.__class__.__name__, {})
+            with unit_of_work.unit_of_work():
+                with timer:
+                    value = stage_function(*args)
+                self.action.timings[stage] = timer.to_dict()
+                self.action.save()
+            result = 'ok'
+            return value
+        finally:
+            metrics.stage_duration.observe(
+                timer.duration, action=self.__class__.__name__,
+                stage=stage, result=result)
+            if result == 'error':
+                self.action.timings[stage] = timer.to_dict()
+                self.action.save(update_fields=['timings'])
 
     def pre_approve(self):
-        return self._pre_approve()
+        return self._run_stage('pre_approve', self._pre_approve)
 
     def post_approve(self):
-        return self._post_approve()
+        return self._run_stage('post_approve', self._post_approve)
 
     def submit(self, token_data):
-        return self._submit(token_data)
+        return self._run_stage('submit', self._submit, token_data)
 
     def _pre_approve(self):
         raise NotImplementedError
@@ -168,6 +229,18 @@ class BaseAction(object):
         return self.__class__.__name__
 
 
+def share_identity_manager(tasks, stage):
+    """
+    Has the actions of all the given in memory tasks share one
+    identity manager for the given stage, so the lookups they have in
+    common, such as of their project, are made once between them.
+    """
+    manager = user_store.CachedIdentityManager()
+    for task in tasks:
+        task.identity_manager = manager
+        task.identity_stage = stage
+
+
 class ResourceMixin(object):
     """Base Mixin class for dealing with Openstack resources."""
 
@@ -184,8 +257,7 @@ class ResourceMixin(object):
         return True
 
     def _validate_domain_id(self):
-        id_manager = user_store.IdentityManager()
-        domain = id_manager.get_domain(self.domain_id)
+        domain = self.id_manager.get_domain(self.domain_id)
         if not domain:
             self.add_note('Domain does not exist.')
             return False
@@ -200,8 +272,7 @@ class ResourceMixin(object):
             return False
 
         # Now actually check the project exists.
-        id_manager = user_store.IdentityManager()
-        project = id_manager.get_project(self.project_id)
+        project = self.id_manager.get_project(self.project_id)
         if not project:
             self.add_note('Project with id %s does not exist.' %
                           self.project_id)
@@ -210,8 +281,7 @@ class ResourceMixin(object):
         return True
 
     def _validate_domain_name(self):
-        id_manager = user_store.IdentityManager()
-        self.domain = id_manager.find_domain(self.domain_name)
+        self.domain = self.id_manager.find_domain(self.domain_name)
         if not self.domain:
             self.add_note('Domain does not exist.')
             return False
@@ -225,9 +295,7 @@ class UserMixin(ResourceMixin):
 
     # Accessors
     def _validate_username_exists(self):
-        id_manager = user_store.IdentityManager()
-
-        self.user = id_manager.find_user(self.username, self.domain.id)
+        self.user = self.id_manager.find_user(self.username, self.domain.id)
         if not self.user:
             self.add_note('No user present with username')
             return False
@@ -256,8 +324,7 @@ class UserMixin(ResourceMixin):
         return intersection == requested_roles
 
     def find_user(self):
-        id_manager = user_store.IdentityManager()
-        return id_manager.find_user(self.username, self.domain_id)
+        return self.id_manager.find_user(self.username, self.domain_id)
 
     # Mutators
     def grant_roles(self, user, roles, project_id):
@@ -268,17 +335,16 @@ class UserMixin(ResourceMixin):
 
     # Helper function to add or remove roles
     def _user_roles_edit(self, user, roles, project_id, remove=False):
-        id_manager = user_store.IdentityManager()
         if not remove:
-            action_fn = id_manager.add_user_role
+            action_fn = self.id_manager.add_user_role
             action_string = "granting"
         else:
-            action_fn = id_manager.remove_user_role
+            action_fn = self.id_manager.remove_user_role
             action_string = "removing"
         ks_roles = []
         try:
             for role in roles:
-                ks_role = id_manager.find_role(role)
+                ks_role = self.id_manager.find_role(role)
                 if ks_role:
                     ks_roles.append(ks_role)
                 else:
@@ -293,11 +359,10 @@ class UserMixin(ResourceMixin):
             raise
 
     def enable_user(self, user=None):
-        id_manager = user_store.IdentityManager()
         try:
             if not user:
                 user = self.find_user()
-            id_manager.enable_user(user)
+            self.id_manager.enable_user(user)
         except Exception as e:
             self.add_note(
                 "Error: '%s' while re-enabling user: %s with roles: %s" %
@@ -305,9 +370,8 @@ class UserMixin(ResourceMixin):
             raise
 
     def create_user(self, password):
-        id_manager = user_store.IdentityManager()
         try:
-            user = id_manager.create_user(
+            user = self.id_manager.create_user(
                 name=self.username, password=password,
                 email=self.email, domain=self.domain_id,
                 created_on=str(timezone.now()))
@@ -320,11 +384,10 @@ class UserMixin(ResourceMixin):
         return user
 
     def update_password(self, password, user=None):
-        id_manager = user_store.IdentityManager()
         try:
             if not user:
                 user = self.find_user()
-            id_manager.update_user_password(user, password)
+            self.id_manager.update_user_password(user, password)
         except Exception as e:
             self.add_note(
                 "Error: '%s' while changing password for user: %s" %
@@ -332,11 +395,10 @@ class UserMixin(ResourceMixin):
             raise
 
     def update_email(self, email, user=None):
-        id_manager = user_store.IdentityManager()
         try:
             if not user:
                 user = self.find_user()
-            id_manager.update_user_email(user, email)
+            self.id_manager.update_user_email(user, email)
         except Exception as e:
             self.add_note(
                 "Error: '%s' while changing email for user: %s" %
@@ -344,11 +406,10 @@ class UserMixin(ResourceMixin):
             raise
 
     def update_user_name(self, username, user=None):
-        id_manager = user_store.IdentityManager()
         try:
             if not user:
                 user = self.find_user()
-            id_manager.update_user_name(user, username)
+            self.id_manager.update_user_name(user, username)
         except Exception as e:
             self.add_note(
                 "Error: '%s' while changing username for user: %s" %
@@ -360,11 +421,10 @@ class ProjectMixin(ResourceMixin):
     """Mixin with functions for projects."""
 
     def _validate_parent_project(self):
-        id_manager = user_store.IdentityManager()
         # NOTE(adriant): If parent id is None, Keystone defaults to the domain.
         # So we only care to validate if parent_id is not None.
         if self.parent_id:
-            parent = id_manager.get_project(self.parent_id)
+            parent = self.id_manager.get_project(self.parent_id)
             if not parent:
                 self.add_note("Parent id: '%s' does not exist." %
                               self.project_name)
@@ -372,8 +432,7 @@ class ProjectMixin(ResourceMixin):
         return True
 
     def _validate_project_absent(self):
-        id_manager = user_store.IdentityManager()
-        project = id_manager.find_project(
+        project = self.id_manager.find_project(
             self.project_name, self.domain_id)
         if project:
             self.add_note("Existing project with name '%s'." %
@@ -385,9 +444,8 @@ class ProjectMixin(ResourceMixin):
         return True
 
     def _create_project(self):
-        id_manager = user_store.IdentityManager()
         try:
-            project = id_manager.create_project(
+            project = self.id_manager.create_project(
                 self.project_name, created_on=str(timezone.now()),
                 parent=self.parent_id, domain=self.domain_id)
         except Exception as e:
@@ -407,8 +465,7 @@ class UserIdAction(BaseAction):
         """
         Gets the target user by id
         """
-        id_manager = user_store.IdentityManager()
-        user = id_manager.get_user(self.user_id)
+        user = self.id_manager.get_user(self.user_id)
 
         return user
 
@@ -440,7 +497,6 @@ class UserNameAction(BaseAction):
         """
         Gets the target user by their username
         """
-        id_manager = user_store.IdentityManager()
-        user = id_manager.find_user(self.username, self.domain_id)
+        user = self.id_manager.find_user(self.username, self.domain_id)
 
         return user
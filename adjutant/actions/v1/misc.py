@@ -17,7 +17,6 @@ import six
 from django.conf import settings
 
 from adjutant.actions.v1.base import BaseAction
-from adjutant.actions import user_store
 from adjutant.actions.utils import send_email
 
 
@@ -41,8 +40,7 @@ class SendAdditionalEmailAction(BaseAction):
             self.add_note('Adding email addresses for roles %s in project %s'
                           % (roles, project_id))
 
-            id_manager = user_store.IdentityManager()
-            users = id_manager.list_users(project_id)
+            users = self.id_manager.list_users(project_id)
             for user in users:
                 user_roles = [role.name for role in user.roles]
                 if roles.intersection(user_roles):
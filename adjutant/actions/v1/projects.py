@@ -16,7 +16,6 @@ from uuid import uuid4
 
 from django.utils import timezone
 
-from adjutant.actions import user_store
 from adjutant.actions.v1.base import (
     BaseAction, UserNameAction, UserMixin, ProjectMixin)
 
@@ -92,8 +91,7 @@ class NewProjectAction(BaseAction, ProjectMixin, UserMixin):
             keystone_user = self.action.task.keystone_user
 
             try:
-                id_manager = user_store.IdentityManager()
-                user = id_manager.get_user(keystone_user['user_id'])
+                user = self.id_manager.get_user(keystone_user['user_id'])
 
                 self.grant_roles(user, default_roles, project_id)
             except Exception as e:
@@ -144,8 +142,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
         self.action.save()
 
     def _validate_user(self):
-        id_manager = user_store.IdentityManager()
-        user = id_manager.find_user(self.username, self.domain_id)
+        user = self.id_manager.find_user(self.username, self.domain_id)
 
         if not user:
             # add to cache to use in template
@@ -185,10 +182,8 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
         user_id = self.get_cache('user_id')
         project_id = self.get_cache('project_id')
 
-        id_manager = user_store.IdentityManager()
-
-        user = id_manager.get_user(user_id)
-        project = id_manager.get_project(project_id)
+        user = self.id_manager.get_user(user_id)
+        project = self.id_manager.get_project(project_id)
 
         if user and project:
             self.action.valid = True
@@ -243,7 +238,6 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
             self._create_user_for_project()
 
     def _create_user_for_project(self):
-        id_manager = user_store.IdentityManager()
         default_roles = self.settings.get("default_roles", {})
 
         project_id = self.get_cache('project_id')
@@ -255,13 +249,13 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
 
                 user_id = self.get_cache('user_id')
                 if not user_id:
-                    user = id_manager.create_user(
+                    user = self.id_manager.create_user(
                         name=self.username, password=password,
                         email=self.email, domain=self.domain_id,
                         created_on=str(timezone.now()))
                     self.set_cache('user_id', user.id)
                 else:
-                    user = id_manager.get_user(user_id)
+                    user = self.id_manager.get_user(user_id)
                 # put user_id into action cache:
                 self.action.task.cache['user_id'] = user.id
 
@@ -280,11 +274,11 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
             try:
                 user_id = self.get_cache('user_id')
                 if not user_id:
-                    user = id_manager.find_user(
+                    user = self.id_manager.find_user(
                         self.username, self.domain_id)
                     self.set_cache('user_id', user.id)
                 else:
-                    user = id_manager.get_user(user_id)
+                    user = self.id_manager.get_user(user_id)
                 self.action.task.cache['user_id'] = user.id
 
                 self.grant_roles(user, default_roles, project_id)
@@ -304,8 +298,9 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
             if not user_id:
                 # first re-enable user
                 try:
-                    user = id_manager.find_user(self.username, self.domain_id)
-                    id_manager.enable_user(user)
+                    user = self.id_manager.find_user(
+                        self.username, self.domain_id)
+                    self.id_manager.enable_user(user)
                 except Exception as e:
                     self.add_note(
                         "Error: '%s' while re-enabling user: %s" %
@@ -316,7 +311,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
                 # Generate a temporary password:
                 password = uuid4().hex + uuid4().hex
                 try:
-                    id_manager.update_user_password(user, password)
+                    self.id_manager.update_user_password(user, password)
                 except Exception as e:
                     self.add_note(
                         "Error: '%s' while changing password for user: %s" %
@@ -327,7 +322,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
 
                 self.set_cache('user_id', user.id)
             else:
-                user = id_manager.get_user(user_id)
+                user = self.id_manager.get_user(user_id)
             self.action.task.cache['user_id'] = user.id
 
             # now add their roles
@@ -364,12 +359,11 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
         self.action.task.cache['project_id'] = project_id
         user_id = self.get_cache('user_id')
         self.action.task.cache['user_id'] = user_id
-        id_manager = user_store.IdentityManager()
 
         if self.action.state in ["default", "disabled"]:
-            user = id_manager.get_user(user_id)
+            user = self.id_manager.get_user(user_id)
             try:
-                id_manager.update_user_password(
+                self.id_manager.update_user_password(
                     user, token_data['password'])
             except Exception as e:
                 self.add_note(
@@ -403,10 +397,9 @@ class AddDefaultUsersToProjectAction(BaseAction, ProjectMixin, UserMixin):
         self.roles = self.settings.get('default_roles', [])
 
     def _validate_users(self):
-        id_manager = user_store.IdentityManager()
         all_found = True
         for user in self.users:
-            ks_user = id_manager.find_user(user, self.domain_id)
+            ks_user = self.id_manager.find_user(user, self.domain_id)
             if ks_user:
                 self.add_note('User: %s exists.' % user)
             else:
@@ -430,14 +423,13 @@ class AddDefaultUsersToProjectAction(BaseAction, ProjectMixin, UserMixin):
         self._pre_validate()
 
     def _post_approve(self):
-        id_manager = user_store.IdentityManager()
         self.project_id = self.action.task.cache.get('project_id', None)
         self._validate()
 
         if self.valid and not self.action.state == "completed":
             try:
                 for user in self.users:
-                    ks_user = id_manager.find_user(user, self.domain_id)
+                    ks_user = self.id_manager.find_user(user, self.domain_id)
 
                     self.grant_roles(ks_user, self.roles, self.project_id)
                     self.add_note(
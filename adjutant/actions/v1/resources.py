@@ -12,9 +12,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from multiprocessing.pool import ThreadPool
+
 from adjutant.actions.v1.base import BaseAction, ProjectMixin
 from django.conf import settings
-from adjutant.actions import openstack_clients, user_store
+from adjutant.actions import openstack_clients
 import six
 
 
@@ -39,8 +41,7 @@ class NewDefaultNetworkAction(BaseAction, ProjectMixin):
             self.add_note('ERROR: No region given.')
             return False
 
-        id_manager = user_store.IdentityManager()
-        region = id_manager.get_region(self.region)
+        region = self.id_manager.get_region(self.region)
         if not region:
             self.add_note('ERROR: Region does not exist.')
             return False
@@ -220,7 +221,13 @@ class NewProjectDefaultNetworkAction(NewDefaultNetworkAction):
 
 
 class SetProjectQuotaAction(BaseAction):
-    """ Updates quota for a given project to a configured quota level """
+    """
+    Updates quota for a given project to a configured quota level.
+
+    The update for each region and service is applied concurrently, on
+    at most 'max_workers' threads, and recorded so that a retry after a
+    partial failure only applies the updates that failed.
+    """
 
     class ServiceQuotaFunctor(object):
         def __call__(self, project_id, values):
@@ -259,8 +266,7 @@ class SetProjectQuotaAction(BaseAction):
                           'set it.')
             return False
 
-        id_manager = user_store.IdentityManager()
-        project = id_manager.get_project(self.project_id)
+        project = self.id_manager.get_project(self.project_id)
         if not project:
             self.add_note('Project with id %s does not exist.' %
                           self.project_id)
@@ -283,6 +289,20 @@ class SetProjectQuotaAction(BaseAction):
     def _pre_approve(self):
         self._pre_validate()
 
+    def _apply_quota(self, update):
+        """
+        Applies a single region and service quota update.
+
+        Runs in a worker thread, so returns any error rather than
+        raising it, and leaves recording the outcome to the caller.
+        """
+        region_name, service_name, values = update
+        try:
+            service_functor = self._quota_updaters[service_name](region_name)
+            service_functor(self.project_id, values)
+        except Exception as e:
+            return e
+
     def _post_approve(self):
         # Assumption: another action has placed the project_id into the cache.
         self.project_id = self.action.task.cache.get('project_id', None)
@@ -291,7 +311,11 @@ class SetProjectQuotaAction(BaseAction):
         if not self.valid or self.action.state == "completed":
             return
 
-        # update quota for each openstack service
+        # Region and service pairs done by a previous attempt are skipped.
+        applied = self.get_cache('quotas_applied') or []
+
+        # find the quota update for each openstack service
+        updates = []
         regions_dict = self.settings.get('regions', {})
         for region_name, region_settings in six.iteritems(regions_dict):
             quota_size = region_settings.get('quota_size')
@@ -302,17 +326,45 @@ class SetProjectQuotaAction(BaseAction):
                         quota_size, region_name))
                 continue
             for service_name, values in six.iteritems(quota_settings):
-                updater_class = self._quota_updaters.get(service_name)
-                if not updater_class:
+                if service_name not in self._quota_updaters:
                     self.add_note("No quota updater found for %s. Ignoring" %
                                   service_name)
                     continue
-                # functor for the service+region
-                service_functor = updater_class(region_name)
-                service_functor(self.project_id, values)
-            self.add_note(
-                "Project quota for region %s set to %s" % (
-                    region_name, quota_size))
+                if [region_name, service_name] in applied:
+                    self.add_note(
+                        "Project %s quota for region %s already set." % (
+                            service_name, region_name))
+                    continue
+                updates.append((region_name, service_name, values))
+
+        if updates:
+            pool = ThreadPool(
+                min(self.settings.get('max_workers', 8), len(updates)))
+            try:
+                errors = pool.map(self._apply_quota, updates)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            errors = []
+
+        failed = []
+        for (region_name, service_name, values), error in zip(updates, errors):
+            if error is None:
+                applied.append([region_name, service_name])
+                self.add_note(
+                    "Project %s quota for region %s set to %s" % (
+                        service_name, region_name,
+                        regions_dict[region_name].get('quota_size')))
+            else:
+                failed.append(error)
+                self.add_note(
+                    "Error: '%s' while setting %s quota in region %s" % (
+                        error, service_name, region_name))
+        self.set_cache('quotas_applied', applied)
+
+        if failed:
+            raise failed[0]
 
         self.action.state = "completed"
         self.action.save()
@@ -12,8 +12,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+from collections import defaultdict
+
 from django.conf import settings
 
+from keystoneclient import exceptions as ks_exceptions
+
 neutron_cache = {}
 nova_cache = {}
 cinder_cache = {}
@@ -197,6 +202,120 @@ class FakeResource(object):
         self.size = size
 
 
+class FakeKeystoneResource(object):
+    """ Stub class to represent a resource returned by keystoneclient """
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class FakeKeystoneClient(object):
+    """
+    Stub of the parts of the keystoneclient v3 client that the
+    IdentityManager uses. Counts every api call made, and can optionally
+    sleep on each call to emulate network latency.
+    """
+
+    class Manager(object):
+        def __init__(self, client, name):
+            self.client = client
+            self.name = name
+
+        def _call(self):
+            self.client.calls[self.name] += 1
+            if self.client.latency:
+                time.sleep(self.client.latency)
+
+    class Users(Manager):
+        def get(self, user_id):
+            self._call()
+            try:
+                return self.client.user_store[user_id]
+            except KeyError:
+                raise ks_exceptions.NotFound()
+
+        def list(self, domain=None, name=None):
+            self._call()
+            return [user for user in self.client.user_store.values()
+                    if (domain is None or user.domain_id == domain) and
+                    (name is None or user.name == name)]
+
+    class Roles(Manager):
+        def list(self, user=None, project=None):
+            self._call()
+            return list(self.client.role_store.values())
+
+        def find(self, name):
+            self._call()
+            for role in self.client.role_store.values():
+                if role.name == name:
+                    return role
+            raise ks_exceptions.NotFound()
+
+    class RoleAssignments(Manager):
+        def list(self, project=None, user=None, include_names=False):
+            self._call()
+            assignments = []
+            for user_id, project_id, role_id in self.client.assignments:
+                if project is not None and project_id != project:
+                    continue
+                if user is not None and user_id != user:
+                    continue
+                user_ref = {'id': user_id}
+                role_ref = {'id': role_id}
+                if include_names:
+                    ks_user = self.client.user_store[user_id]
+                    user_ref['name'] = ks_user.name
+                    user_ref['domain'] = {'id': ks_user.domain_id}
+                    role_ref['name'] = self.client.role_store[role_id].name
+                assignments.append(FakeKeystoneResource(
+                    user=user_ref, role=role_ref,
+                    scope={'project': {'id': project_id}}))
+            return assignments
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = defaultdict(int)
+        self.user_store = {}
+        self.role_store = {}
+        self.assignments = []
+        self.users = self.Users(self, 'users')
+        self.roles = self.Roles(self, 'roles')
+        self.role_assignments = self.RoleAssignments(
+            self, 'role_assignments')
+
+    @property
+    def call_count(self):
+        return sum(self.calls.values())
+
+    def add_role(self, name):
+        role = FakeKeystoneResource(id='role_id_%s' % name, name=name)
+        self.role_store[role.id] = role
+        return role
+
+    def add_user(self, name, domain_id='default'):
+        user = FakeKeystoneResource(
+            id='user_id_%s' % len(self.user_store), name=name,
+            email=name, enabled=True, domain_id=domain_id)
+        self.user_store[user.id] = user
+        return user
+
+    def grant(self, user, role, project_id):
+        self.assignments.append((user.id, project_id, role.id))
+
+    def setup_project(self, project_id, size, roles=('_member_', )):
+        """ Adds 'size' users with the given roles on the project. """
+        ks_roles = [self.add_role(role) for role in roles]
+        for i in range(size):
+            user = self.add_user('user_%s@example.com' % i)
+            for role in ks_roles:
+                self.grant(user, role, project_id)
+
+
 def setup_neutron_cache(region, project_id):
     global neutron_cache
     if region not in neutron_cache:
@@ -0,0 +1,58 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from adjutant.actions import openstack_clients
+
+
+@mock.patch('adjutant.actions.openstack_clients.get_auth_session',
+            mock.Mock())
+@mock.patch('adjutant.actions.openstack_clients.novaclient.Client',
+            mock.Mock(side_effect=lambda *args, **kwargs: mock.Mock()))
+class ClientPoolTests(TestCase):
+
+    def setUp(self):
+        openstack_clients.client_pool.clear()
+        self.addCleanup(openstack_clients.client_pool.clear)
+
+    def test_clients_reused(self):
+        """
+        Clients are built once per service, region and version.
+        """
+        nova = openstack_clients.get_novaclient('RegionOne')
+        self.assertIs(openstack_clients.get_novaclient('RegionOne'), nova)
+        self.assertIsNot(openstack_clients.get_novaclient('RegionTwo'), nova)
+        self.assertIsNot(
+            openstack_clients.get_novaclient('RegionOne', version="2.1"),
+            nova)
+
+        self.assertEquals(
+            openstack_clients.client_pool.stats(),
+            {'size': 3, 'hits': 1, 'misses': 3, 'expired': 0})
+
+    @override_settings(CLIENT_POOL_MAX_AGE=0)
+    def test_clients_expire(self):
+        """
+        Clients older than the max age are rebuilt.
+        """
+        nova = openstack_clients.get_novaclient('RegionOne')
+        self.assertIsNot(openstack_clients.get_novaclient('RegionOne'), nova)
+
+        self.assertEquals(
+            openstack_clients.client_pool.stats(),
+            {'size': 1, 'hits': 0, 'misses': 2, 'expired': 1})
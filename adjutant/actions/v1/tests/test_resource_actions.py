@@ -460,3 +460,51 @@ class ProjectSetupActionTests(TestCase):
         self.assertEquals(r2_cinderquota['gigabytes'], 73571)
         self.assertEquals(r2_cinderquota['snapshots'], 73572)
         self.assertEquals(r2_cinderquota['volumes'], 73573)
+
+    def test_set_quota_partial_failure(self):
+        """
+        A failed region is retried without reapplying the quotas
+        that were already set.
+        """
+        project = mock.Mock()
+        project.id = 'test_project_id'
+        project.name = 'test_project'
+        project.domain = 'default'
+        project.roles = {}
+
+        setup_temp_cache({'test_project': project}, {})
+        setup_mock_caches('RegionOne', 'test_project_id')
+
+        task = Task.objects.create(
+            ip_address="0.0.0.0", keystone_user={'roles': ['admin']})
+
+        task.cache = {'project_id': "test_project_id"}
+
+        action = SetProjectQuotaAction({}, task=task, order=1)
+
+        action.pre_approve()
+        self.assertEquals(action.valid, True)
+
+        class FailingCinderFunctor(
+                SetProjectQuotaAction.ServiceQuotaCinderFunctor):
+            def __call__(self, project_id, values):
+                raise Exception("cinder is down")
+
+        with mock.patch.dict(SetProjectQuotaAction._quota_updaters,
+                             {'cinder': FailingCinderFunctor}):
+            self.assertRaises(Exception, action.post_approve)
+
+        self.assertEquals(
+            sorted(action.get_cache('quotas_applied')),
+            [['RegionOne', 'neutron'], ['RegionOne', 'nova']])
+
+        nova_updater = mock.Mock()
+        with mock.patch.dict(SetProjectQuotaAction._quota_updaters,
+                             {'nova': nova_updater}):
+            action.post_approve()
+        self.assertEquals(action.valid, True)
+        self.assertEquals(action.action.state, "completed")
+        self.assertFalse(nova_updater.called)
+
+        r2_cinderquota = cinder_cache['RegionTwo']['test_project_id']['quota']
+        self.assertEquals(r2_cinderquota['gigabytes'], 73571)
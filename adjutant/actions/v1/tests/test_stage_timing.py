@@ -0,0 +1,105 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from django.db import connection
+
+from adjutant import metrics
+from adjutant.actions.models import Action
+from adjutant.actions.stage_timing import StageTimer
+from adjutant.actions.v1.users import ResetUserPasswordAction
+from adjutant.api.models import Task
+from adjutant.api.v1.tests import (
+    AdjutantTestCase, FakeManager, setup_temp_cache)
+
+
+@mock.patch('adjutant.actions.user_store.IdentityManager',
+            FakeManager)
+class StageTimingTests(AdjutantTestCase):
+
+    def setUp(self):
+        user = mock.Mock()
+        user.id = 'user_id'
+        user.name = "test@example.com"
+        user.email = "test@example.com"
+        user.domain = 'default'
+        user.password = "test_password"
+        setup_temp_cache({}, {user.id: user})
+
+        self.task = Task.objects.create(
+            ip_address="0.0.0.0", keystone_user={},
+            task_type='reset_password')
+
+    def test_stage_timings(self):
+        """
+        Each stage records its time, Keystone calls and queries on the
+        action, which admins see on the task.
+        """
+        action = ResetUserPasswordAction(
+            {'domain_name': 'Default', 'email': 'test@example.com'},
+            task=self.task, order=0)
+
+        calls = metrics.keystone_call_duration.count(
+            call='find_user', result='ok')
+
+        action.pre_approve()
+        action.post_approve()
+
+        timings = Action.objects.get(id=action.action.id).timings
+        self.assertEqual(
+            sorted(timings.keys()), ['post_approve', 'pre_approve'])
+        # the domain, the user and their roles, looked up again in
+        # each stage, as counted by the identity manager itself
+        self.assertEqual(timings['pre_approve']['keystone_calls'], 3)
+        self.assertEqual(timings['post_approve']['keystone_calls'], 3)
+        self.assertEqual(
+            metrics.keystone_call_duration.count(
+                call='find_user', result='ok'), calls + 2)
+        self.assertTrue(timings['pre_approve']['duration'] >= 0)
+        self.assertTrue(timings['post_approve']['queries'] > 0)
+
+        task = Task.objects.get(uuid=self.task.uuid)
+        self.assertEqual(task._to_dict()['actions'][0]['timings'], timings)
+        self.assertFalse('timings' in task.to_dict()['actions'][0])
+
+    def test_failed_stage_timed(self):
+        """
+        Timings are kept for stages which raise.
+        """
+        action = ResetUserPasswordAction(
+            {'domain_name': 'Default', 'email': 'test@example.com'},
+            task=self.task, order=0)
+
+        with mock.patch.object(
+                action, '_pre_approve', side_effect=ValueError()):
+            self.assertRaises(ValueError, action.pre_approve)
+
+        timings = Action.objects.get(id=action.action.id).timings
+        self.assertEqual(timings.keys(), ['pre_approve'])
+
+    def test_queries_counted_without_query_log(self):
+        """
+        Queries are counted without turning on the debug cursor, and
+        still once Django's query log is full.
+        """
+        connection.queries_log.extend([{}] * connection.queries_limit)
+
+        with StageTimer() as timer:
+            Task.objects.count()
+            Task.objects.filter(uuid=self.task.uuid).exists()
+
+        self.assertEqual(timer.queries, 2)
+        self.assertFalse(connection.force_debug_cursor)
+        connection.queries_log.clear()
@@ -0,0 +1,99 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from adjutant.actions.models import Action
+from adjutant.actions.unit_of_work import UnitOfWork, unit_of_work
+from adjutant.api.models import Task
+from adjutant.api.v1.tests import AdjutantTestCase
+
+
+class UnitOfWorkTests(AdjutantTestCase):
+
+    def setUp(self):
+        self.task = Task.objects.create(
+            ip_address="0.0.0.0",
+            keystone_user={})
+        self.action = Action.objects.create(
+            action_name='NewUserAction', task=self.task, order=1)
+
+    def test_saves_deferred_until_flush(self):
+        """
+        Repeated saves inside a unit of work are written once at the end.
+        """
+        with unit_of_work() as unit:
+            with self.assertNumQueries(0):
+                self.action.valid = True
+                self.action.save()
+                self.action.need_token = True
+                self.action.save()
+                self.task.approved = True
+                self.task.save()
+            self.assertEquals(len(unit.pending), 2)
+            self.assertFalse(Action.objects.get(id=self.action.id).valid)
+
+            # one update per model, inside a single transaction
+            with self.assertNumQueries(4):
+                unit.flush()
+            self.assertEquals(unit.pending, [])
+
+        action = Action.objects.get(id=self.action.id)
+        self.assertTrue(action.valid)
+        self.assertTrue(action.need_token)
+        self.assertTrue(Task.objects.get(uuid=self.task.uuid).approved)
+
+    def test_nested_unit_of_work(self):
+        """
+        A nested unit of work joins the outer one.
+        """
+        with unit_of_work() as outer:
+            with unit_of_work() as inner:
+                self.action.valid = True
+                self.action.save()
+            self.assertIs(outer, inner)
+            self.assertFalse(Action.objects.get(id=self.action.id).valid)
+        self.assertTrue(Action.objects.get(id=self.action.id).valid)
+
+    def test_discarded_on_error(self):
+        """
+        Saves made before an error are discarded, and the error is
+        the one raised by the block.
+        """
+        with mock.patch.object(UnitOfWork, 'flush') as flush:
+            with self.assertRaises(ValueError):
+                with unit_of_work():
+                    self.action.valid = True
+                    self.action.save()
+                    raise ValueError()
+            self.assertFalse(flush.called)
+        self.assertFalse(Action.objects.get(id=self.action.id).valid)
+
+    def test_nested_discarded_on_error(self):
+        """
+        An error in a nested unit of work discards only its own saves,
+        and the outer one still flushes those made outside it.
+        """
+        with unit_of_work() as unit:
+            self.task.approved = True
+            self.task.save()
+            with self.assertRaises(ValueError):
+                with unit_of_work():
+                    self.action.valid = True
+                    self.action.save()
+                    raise ValueError()
+            self.assertEquals(unit.pending, [self.task])
+
+        self.assertTrue(Task.objects.get(uuid=self.task.uuid).approved)
+        self.assertFalse(Action.objects.get(id=self.action.id).valid)
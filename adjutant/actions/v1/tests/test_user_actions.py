@@ -1142,3 +1142,107 @@ class UserActionTests(AdjutantTestCase):
         self.assertEquals(
             tests.temp_cache['users']["user_id_1"].name,
             'test_user')
+
+    def test_identity_lookups_cached_per_stage(self):
+        """
+        Actions on the same task share identity lookups within a stage,
+        and a write or new stage forces a fresh lookup.
+        """
+        project = mock.Mock()
+        project.id = 'test_project_id'
+        project.name = 'test_project'
+        project.domain = 'default'
+        project.roles = {}
+
+        setup_temp_cache({'test_project': project}, {})
+
+        task = Task.objects.create(
+            ip_address="0.0.0.0",
+            keystone_user={
+                'roles': ['admin', 'project_mod'],
+                'project_id': 'test_project_id',
+                'project_domain_id': 'default',
+            })
+
+        data = {
+            'email': 'test@example.com',
+            'project_id': 'test_project_id',
+            'roles': ['_member_'],
+            'domain_id': 'default',
+        }
+
+        action = NewUserAction(data, task=task, order=1)
+        action_two = NewUserAction(data, task=task, order=2)
+
+        with mock.patch.object(
+                FakeManager, 'get_project',
+                wraps=FakeManager().get_project) as get_project:
+            action.pre_approve()
+            action_two.pre_approve()
+            self.assertEquals(get_project.call_count, 1)
+
+            action.post_approve()
+            self.assertEquals(get_project.call_count, 2)
+
+            action.id_manager.enable_user(mock.Mock())
+            action_two.post_approve()
+            self.assertEquals(get_project.call_count, 3)
+
+    def test_action_notes_appended(self):
+        """
+        Adding notes inserts rows without rewriting the task, and the
+        notes are still grouped by action in order.
+        """
+        project = mock.Mock()
+        project.id = 'test_project_id'
+        project.name = 'test_project'
+        project.domain = 'default'
+        project.roles = {}
+
+        setup_temp_cache({'test_project': project}, {})
+
+        task = Task.objects.create(
+            ip_address="0.0.0.0",
+            keystone_user={
+                'roles': ['admin', 'project_mod'],
+                'project_id': 'test_project_id',
+                'project_domain_id': 'default',
+            })
+
+        data = {
+            'email': 'test@example.com',
+            'project_id': 'test_project_id',
+            'roles': ['_member_'],
+            'domain_id': 'default',
+        }
+
+        action = NewUserAction(data, task=task, order=1)
+
+        with mock.patch.object(Task, 'save') as task_save:
+            action.add_note('first')
+            action.add_note('second')
+            self.assertEquals(task_save.call_count, 0)
+
+        notes = task.action_notes[str(action)]
+        self.assertEquals(len(notes), 2)
+        self.assertTrue(notes[0].startswith('first'))
+        self.assertTrue(notes[1].startswith('second'))
+
+    def test_action_note_leaves_task(self):
+        """
+        Adding a note only inserts it, so it doesn't write back a task
+        that may have been changed elsewhere since it was loaded.
+        """
+        task = Task.objects.create(
+            ip_address="0.0.0.0", keystone_user={})
+        stale_task = Task.objects.get(uuid=task.uuid)
+
+        task.cancelled = True
+        task.save()
+
+        with self.assertNumQueries(1):
+            stale_task.add_action_note('NewProjectAction', 'note')
+
+        task = Task.objects.get(uuid=task.uuid)
+        self.assertTrue(task.cancelled)
+        self.assertEquals(task.action_notes, {'NewProjectAction': ['note']})
@@ -0,0 +1,194 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from adjutant.actions import user_store
+from adjutant.actions.v1.tests import (
+    FakeKeystoneClient, FakeKeystoneResource)
+
+
+class IdentityManagerTests(TestCase):
+
+    def setUp(self):
+        self.ks_client = FakeKeystoneClient()
+        patcher = mock.patch(
+            'adjutant.actions.user_store.get_keystoneclient',
+            lambda: self.ks_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user_store.role_catalog.clear()
+
+    @override_settings(LIST_USERS_DOMAIN_THRESHOLD=20)
+    def test_list_users_constant_calls(self):
+        """
+        Listing users costs the same number of calls regardless of
+        how many users are on the project, once there are more than
+        the threshold.
+        """
+        call_counts = []
+        for size in [21, 100, 500]:
+            self.ks_client = FakeKeystoneClient()
+            user_store.role_catalog.clear()
+            self.ks_client.setup_project(
+                'test_project_id', size, roles=['_member_', 'project_mod'])
+
+            id_manager = user_store.IdentityManager()
+            users = id_manager.list_users('test_project_id')
+
+            self.assertEquals(len(users), size)
+            for user in users:
+                self.assertEquals(
+                    sorted(role.name for role in user.roles),
+                    ['_member_', 'project_mod'])
+            self.assertEquals(self.ks_client.calls['users'], 1)
+            call_counts.append(self.ks_client.call_count)
+
+        self.assertEquals(len(set(call_counts)), 1)
+
+    @override_settings(LIST_USERS_DOMAIN_THRESHOLD=20)
+    def test_list_users_small_project(self):
+        """
+        The users of a small project are fetched singly, rather than
+        listing every user in their domain.
+        """
+        self.ks_client.setup_project('test_project_id', 2)
+        self.ks_client.add_user('other@example.com')
+
+        users = user_store.IdentityManager().list_users('test_project_id')
+
+        self.assertEquals(
+            sorted(user.name for user in users),
+            ['user_0@example.com', 'user_1@example.com'])
+        self.assertEquals(self.ks_client.calls['users'], 2)
+
+    def test_list_users_ignores_groups(self):
+        """
+        Group assignments are skipped, and users only on other projects
+        aren't included.
+        """
+        member = self.ks_client.add_role('_member_')
+        user = self.ks_client.add_user('test@example.com')
+        other_user = self.ks_client.add_user('other@example.com')
+        self.ks_client.grant(user, member, 'test_project_id')
+        self.ks_client.grant(other_user, member, 'other_project_id')
+
+        group_assignment = FakeKeystoneResource(
+            group={'id': 'group_id'}, role={'id': member.id},
+            scope={'project': {'id': 'test_project_id'}})
+
+        original_list = self.ks_client.role_assignments.list
+        with mock.patch.object(
+                self.ks_client.role_assignments, 'list',
+                lambda **kwargs: original_list(**kwargs) + [
+                    group_assignment]):
+            users = user_store.IdentityManager().list_users(
+                'test_project_id')
+
+        self.assertEquals([u.id for u in users], [user.id])
+
+    def test_unknown_roles_skipped(self):
+        """
+        Assignments of roles missing from the catalog, such as deleted
+        ones, are left out rather than returned as None.
+        """
+        member = self.ks_client.add_role('_member_')
+        user = self.ks_client.add_user('test@example.com')
+        self.ks_client.grant(user, member, 'test_project_id')
+        self.ks_client.assignments.append(
+            (user.id, 'test_project_id', 'deleted_role_id'))
+
+        manager = user_store.IdentityManager()
+        with mock.patch.object(
+                self.ks_client.role_assignments, 'list',
+                lambda **kwargs: [FakeKeystoneResource(
+                    user={'id': user.id, 'domain': {'id': 'default'}},
+                    role={'id': role_id},
+                    scope={'project': {'id': project_id}})
+                    for _, project_id, role_id in self.ks_client.assignments]):
+            users = manager.list_users('test_project_id')
+            projects = manager.get_all_roles(user.id)
+
+        self.assertEquals([r.name for r in list(users)[0].roles], ['_member_'])
+        self.assertEquals(
+            [r.name for r in projects['test_project_id']], ['_member_'])
+
+
+class RoleCatalogTests(TestCase):
+
+    def setUp(self):
+        self.ks_client = FakeKeystoneClient()
+        self.ks_client.add_role('_member_')
+        self.ks_client.add_role('project_mod')
+        self.catalog = user_store.RoleCatalog()
+
+    def test_lookups_cached(self):
+        """
+        Lookups by name and id share the one roles listing.
+        """
+        self.assertEquals(
+            self.catalog.find('_member_', self.ks_client).id,
+            'role_id__member_')
+        self.assertEquals(
+            self.catalog.get('role_id_project_mod', self.ks_client).name,
+            'project_mod')
+        self.assertEquals(self.catalog.find('admin', self.ks_client), None)
+        self.assertEquals(len(self.catalog.list(self.ks_client)), 2)
+
+        self.assertEquals(self.ks_client.calls['roles'], 1)
+
+    @override_settings(ROLE_CACHE_TTL=0)
+    def test_ttl_expiry(self):
+        """
+        Once the ttl has passed the roles are listed again.
+        """
+        self.catalog.find('_member_', self.ks_client)
+        self.catalog.find('_member_', self.ks_client)
+
+        self.assertEquals(self.ks_client.calls['roles'], 2)
+
+    @override_settings(ROLE_CACHE_MIN_REFRESH=0)
+    def test_unknown_id_refreshes(self):
+        """
+        A role id we haven't seen means the catalog is stale.
+        """
+        self.catalog.list(self.ks_client)
+        self.ks_client.add_role('admin')
+
+        self.assertEquals(self.catalog.find('admin', self.ks_client), None)
+        self.assertEquals(
+            self.catalog.get('role_id_admin', self.ks_client).name, 'admin')
+        self.assertEquals(self.ks_client.calls['roles'], 2)
+
+    def test_unknown_id_refresh_limited(self):
+        """
+        Unknown ids only refresh the catalog once per interval, and
+        are returned as None.
+        """
+        self.catalog.list(self.ks_client)
+
+        self.assertEquals(self.catalog.get('deleted_1', self.ks_client), None)
+        self.assertEquals(self.catalog.get('deleted_2', self.ks_client), None)
+        self.assertEquals(self.ks_client.calls['roles'], 1)
+
+    def test_refresh(self):
+        self.catalog.list(self.ks_client)
+        self.ks_client.add_role('admin')
+        self.catalog.refresh(self.ks_client)
+
+        self.assertEquals(
+            self.catalog.find('admin', self.ks_client).name, 'admin')
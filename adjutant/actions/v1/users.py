@@ -37,8 +37,6 @@ class NewUserAction(UserNameAction, ProjectMixin, UserMixin):
     ]
 
     def _validate_target_user(self):
-        id_manager = user_store.IdentityManager()
-
         # check if user exists and is valid
         # this may mean we need a token.
         user = self._get_target_user()
@@ -68,7 +66,7 @@ class NewUserAction(UserNameAction, ProjectMixin, UserMixin):
             return True
 
         # role_validation
-        roles = id_manager.get_roles(user, self.project_id)
+        roles = self.id_manager.get_roles(user, self.project_id)
         role_names = {role.name for role in roles}
         missing = set(self.roles) - role_names
         if not missing:
@@ -169,10 +167,8 @@ class ResetUserPasswordAction(UserNameAction, UserMixin):
         self.blacklist = self.settings.get("blacklisted_roles", {})
 
     def _validate_user_roles(self):
-        id_manager = user_store.IdentityManager()
-
-        self.user = id_manager.find_user(self.username, self.domain.id)
-        roles = id_manager.get_all_roles(self.user)
+        self.user = self.id_manager.find_user(self.username, self.domain.id)
+        roles = self.id_manager.get_all_roles(self.user)
 
         user_roles = []
         for roles in roles.itervalues():
@@ -240,11 +236,10 @@ class EditUserRolesAction(UserIdAction, ProjectMixin, UserMixin):
         return True
 
     def _validate_user_roles(self):
-        id_manager = user_store.IdentityManager()
         user = self._get_target_user()
-        project = id_manager.get_project(self.project_id)
+        project = self.id_manager.get_project(self.project_id)
         # user roles
-        current_roles = id_manager.get_roles(user, project)
+        current_roles = self.id_manager.get_roles(user, project)
         current_role_names = {role.name for role in current_roles}
 
         # NOTE(adriant): Only allow someone to edit roles if all roles from
@@ -358,9 +353,7 @@ class UpdateUserEmailAction(UserIdAction, UserMixin):
             self.domain_id = self.action.task.keystone_user[
                 'project_domain_id']
 
-            id_manager = user_store.IdentityManager()
-
-            if id_manager.find_user(self.new_email, self.domain_id):
+            if self.id_manager.find_user(self.new_email, self.domain_id):
                 self.add_note("User with same username already exists")
                 return False
             self.add_note("No user with same username")
@@ -0,0 +1,77 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import getpass
+
+from django.core.exceptions import FieldError, ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from adjutant.api.v1 import approvals
+from adjutant.api.v1.utils import clean_filters
+
+
+class Command(BaseCommand):
+    help = ("Approves the given tasks, or every task matching the filters "
+            "that is waiting for approval, as approving them through the "
+            "API would.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'tasks', nargs='*', metavar='TASK',
+            help="Uuid of a task to approve.")
+        parser.add_argument(
+            '--filters',
+            help=("Approve every pending task matching these filters, "
+                  "given as json: {'fieldname': {'operation': 'value'}}"))
+        parser.add_argument(
+            '--concurrency', type=int,
+            help="Tasks to approve at once. Defaults to "
+                 "BULK_APPROVE_CONCURRENCY.")
+        parser.add_argument(
+            '--rate', type=float,
+            help="Most tasks to start a second, 0 for no limit. Defaults "
+                 "to BULK_APPROVE_RATE.")
+        parser.add_argument(
+            '--approver', default=getpass.getuser(),
+            help="Username recorded as having approved the tasks.")
+
+    def handle(self, *args, **options):
+        if bool(options['tasks']) == bool(options['filters']):
+            raise CommandError("Give either task uuids or --filters.")
+
+        task_uuids = options['tasks']
+        if options['filters']:
+            try:
+                task_uuids = list(approvals.pending_tasks(
+                    clean_filters(options['filters'])))
+            except (ValueError, FieldError) as e:
+                raise CommandError(str(e))
+            except ValidationError as e:
+                raise CommandError('; '.join(e.messages))
+
+        results = approvals.approve_tasks(
+            task_uuids, {'username': options['approver']},
+            concurrency=options['concurrency'], rate=options['rate'])
+
+        failed = 0
+        for result in results:
+            if result['status'] >= 400:
+                failed += 1
+                outcome = result['errors']
+            else:
+                outcome = result['notes']
+            self.stdout.write("%s %s %s" % (
+                result['task'], result['status'], '; '.join(outcome)))
+        self.stdout.write("Approved %s tasks, %s failed." % (
+            len(results) - failed, failed))
@@ -0,0 +1,62 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from adjutant.api.v1 import jobs
+
+
+class Command(BaseCommand):
+    help = "Runs queued task stages. Any number of workers can be run."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once there are no more queued jobs.")
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help="Seconds to wait between checks of an empty queue.")
+        parser.add_argument(
+            '--worker-name',
+            default="%s:%s" % (socket.gethostname(), os.getpid()),
+            help="Name recorded on the jobs this worker runs.")
+
+    def handle(self, *args, **options):
+        worker = options['worker_name']
+        processed = 0
+        try:
+            while True:
+                close_old_connections()
+                job = jobs.claim_job(worker)
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                try:
+                    job = jobs.run_job(job)
+                except Exception as e:
+                    job = jobs.fail_job(job, e)
+                processed += 1
+                self.stdout.write("Job %s (%s for task %s): %s" % (
+                    job.uuid, job.stage, job.task_id, job.state))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("Processed %s jobs." % processed)
@@ -0,0 +1,57 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from adjutant.api.v1.token_reaper import reap_expired_tokens
+
+
+class Command(BaseCommand):
+    help = ("Periodically deletes expired tokens. Can be run on several "
+            "nodes, as only one reaper runs at a time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Delete the expired tokens once and exit.")
+        parser.add_argument(
+            '--interval', type=float, default=300.0,
+            help="Seconds to wait between deleting expired tokens.")
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Tokens to delete at a time.")
+        parser.add_argument(
+            '--batch-pause', type=float, default=0.0,
+            help="Seconds to wait between batches.")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                close_old_connections()
+                reaped = reap_expired_tokens(
+                    options['batch_size'], options['batch_pause'])
+                if reaped is None:
+                    self.stdout.write(
+                        "Another reaper is deleting expired tokens.")
+                else:
+                    self.stdout.write(
+                        "Deleted %s expired tokens in %.2fs." % reaped)
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,63 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from adjutant.api.v1.email_queue import EmailSender
+
+
+class Command(BaseCommand):
+    help = "Sends queued task emails. Any number of senders can be run."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once there are no more emails due.")
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help="Seconds to wait between checks when nothing is due.")
+        parser.add_argument(
+            '--batch-size', type=int, default=50,
+            help="Emails to claim at a time.")
+        parser.add_argument(
+            '--sender-name',
+            default="%s:%s" % (socket.gethostname(), os.getpid()),
+            help="Name recorded on the emails this sender claims.")
+
+    def handle(self, *args, **options):
+        email_sender = EmailSender(options['sender_name'])
+        sent = failed = 0
+        try:
+            while True:
+                close_old_connections()
+                batch_sent, batch_failed = email_sender.send_batch(
+                    options['batch_size'])
+                sent += batch_sent
+                failed += batch_failed
+                if not (batch_sent or batch_failed):
+                    if options['once']:
+                        break
+                    # don't hold the SMTP connection open while idle
+                    email_sender.close()
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            email_sender.close()
+        self.stdout.write("Sent %s emails, %s failed." % (sent, failed))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def copy_action_notes(apps, schema_editor):
+    Task = apps.get_model('api', 'Task')
+    ActionNote = apps.get_model('api', 'ActionNote')
+    notes = []
+    for task in Task.objects.iterator():
+        for action, action_notes in task.action_notes.items():
+            for note in action_notes:
+                notes.append(ActionNote(
+                    task=task, action=action, note=note,
+                    created_on=task.created_on))
+    ActionNote.objects.bulk_create(notes)
+
+
+def restore_action_notes(apps, schema_editor):
+    Task = apps.get_model('api', 'Task')
+    ActionNote = apps.get_model('api', 'ActionNote')
+    action_notes = {}
+    for note in ActionNote.objects.order_by('id').iterator():
+        task_notes = action_notes.setdefault(note.task_id, {})
+        task_notes.setdefault(note.action, []).append(note.note)
+    for uuid, task_notes in action_notes.items():
+        Task.objects.filter(uuid=uuid).update(action_notes=task_notes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_auto_20160929_0317'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActionNote',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=200)),
+                ('note', models.TextField()),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.Task')),
+            ],
+        ),
+        migrations.RunPython(copy_action_notes, restore_action_notes),
+        migrations.RemoveField(
+            model_name='task',
+            name='action_notes',
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_actionnote'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['created_on', 'token'], name='api_token_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['error', 'acknowledged'], name='api_notification_error_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['created_on', 'uuid'], name='api_notification_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['hash_key', 'completed', 'cancelled'], name='api_task_duplicate_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['project_id', 'task_type', 'completed', 'cancelled'], name='api_task_project_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['created_on', 'uuid'], name='api_task_created_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import adjutant.api.models
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('uuid', models.CharField(default=adjutant.api.models.hex_uuid, max_length=32, primary_key=True, serialize=False)),
+                ('stage', models.CharField(max_length=20)),
+                ('data', jsonfield.fields.JSONField(default={})),
+                ('state', models.CharField(default='queued', max_length=20)),
+                ('result', jsonfield.fields.JSONField(default={})),
+                ('status_code', models.IntegerField(null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('worker', models.CharField(max_length=200, null=True)),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_on', models.DateTimeField(null=True)),
+                ('finished_on', models.DateTimeField(null=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.Task')),
+                ('token', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.Token')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['state', 'created_on'], name='api_job_state_idx'),
+        ),
+    ]
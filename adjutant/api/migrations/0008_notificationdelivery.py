@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import adjutant.api.models
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationDelivery',
+            fields=[
+                ('uuid', models.CharField(default=adjutant.api.models.hex_uuid, max_length=32, primary_key=True, serialize=False)),
+                ('engine', models.CharField(max_length=200)),
+                ('state', models.CharField(default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('dispatcher', models.CharField(max_length=200, null=True)),
+                ('claimed_on', models.DateTimeField(null=True)),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('delivered_on', models.DateTimeField(null=True)),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.Notification')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='notificationdelivery',
+            index=models.Index(fields=['state', 'next_attempt_on'], name='api_delivery_state_idx'),
+        ),
+    ]
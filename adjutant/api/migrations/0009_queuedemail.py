@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import adjutant.api.models
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_notificationdelivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedEmail',
+            fields=[
+                ('uuid', models.CharField(default=adjutant.api.models.hex_uuid, max_length=32, primary_key=True, serialize=False)),
+                ('description', models.CharField(max_length=200)),
+                ('subject', models.TextField()),
+                ('body', models.TextField()),
+                ('html_body', models.TextField(blank=True, default='')),
+                ('from_email', models.CharField(max_length=200)),
+                ('to', jsonfield.fields.JSONField(default=[])),
+                ('headers', jsonfield.fields.JSONField(default={})),
+                ('state', models.CharField(default='queued', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('sender', models.CharField(max_length=200, null=True)),
+                ('claimed_on', models.DateTimeField(null=True)),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_on', models.DateTimeField(null=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.Task')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='queuedemail',
+            index=models.Index(fields=['state', 'next_attempt_on'], name='api_email_state_idx'),
+        ),
+    ]
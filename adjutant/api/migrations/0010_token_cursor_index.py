@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_queuedemail'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='token',
+            name='api_token_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['created_on', 'task'], name='api_token_created_idx'),
+        ),
+    ]
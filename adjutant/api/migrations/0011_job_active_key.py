@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_token_cursor_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='active_key',
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -17,6 +17,8 @@ from uuid import uuid4
 from django.utils import timezone
 from jsonfield import JSONField
 
+from adjutant.actions import unit_of_work
+
 
 def hex_uuid():
     return uuid4().hex
@@ -43,9 +45,6 @@ class Task(models.Model):
     # type of the task, for easy grouping
     task_type = models.CharField(max_length=100, db_index=True)
 
-    # Effectively a log of what the actions are doing.
-    action_notes = JSONField(default={})
-
     cancelled = models.BooleanField(default=False, db_index=True)
     approved = models.BooleanField(default=False, db_index=True)
     completed = models.BooleanField(default=False, db_index=True)
@@ -54,13 +53,35 @@ class Task(models.Model):
     approved_on = models.DateTimeField(null=True)
     completed_on = models.DateTimeField(null=True)
 
+    class Meta:
+        indexes = [
+            # duplicate checks on new tasks
+            models.Index(fields=['hash_key', 'completed', 'cancelled'],
+                         name='api_task_duplicate_idx'),
+            # pending tasks of a type for a project, such as invites
+            models.Index(fields=['project_id', 'task_type', 'completed',
+                                 'cancelled'],
+                         name='api_task_project_type_idx'),
+            # list ordering and cursor pagination
+            models.Index(fields=['created_on', 'uuid'],
+                         name='api_task_created_idx'),
+        ]
+
     def __init__(self, *args, **kwargs):
         super(Task, self).__init__(*args, **kwargs)
         # in memory dict to be used for passing data between actions:
         self.cache = {}
 
+    def save(self, *args, **kwargs):
+        if unit_of_work.defer_save(self, args, kwargs):
+            return
+        super(Task, self).save(*args, **kwargs)
+
     @property
     def actions(self):
+        # Deferred saves are written first so actions read back
+        # from the database reflect any changes made so far.
+        unit_of_work.flush()
         return self.action_set.order_by('order')
 
     @property
@@ -71,13 +92,31 @@ class Task(models.Model):
     def notifications(self):
         return self.notification_set.all()
 
+    @property
+    def action_notes(self):
+        """
+        Effectively a log of what the actions are doing.
+
+        Assembled from the ActionNote rows as a dict of
+        action name to the list of its notes.
+        """
+        action_notes = {}
+        # Sorted here rather than in the query so that notes
+        # prefetched for a list of tasks are used as is.
+        notes = sorted(self.actionnote_set.all(), key=lambda n: n.id)
+        for note in notes:
+            action_notes.setdefault(note.action, []).append(note.note)
+        return action_notes
+
     def _to_dict(self):
         actions = []
-        for action in self.actions:
+        task_actions = sorted(self.action_set.all(), key=lambda a: a.order)
+        for action in task_actions:
             actions.append({
                 "action_name": action.action_name,
                 "data": action.action_data,
-                "valid": action.valid
+                "valid": action.valid,
+                "timings": action.timings,
             })
 
         return {
@@ -103,14 +142,30 @@ class Task(models.Model):
         """
         task_dict = self._to_dict()
         task_dict.pop("ip_address")
+        for action in task_dict["actions"]:
+            action.pop("timings")
         return task_dict
 
     def add_action_note(self, action, note):
-        if action in self.action_notes:
-            self.action_notes[action].append(note)
-        else:
-            self.action_notes[action] = [note]
-        self.save()
+        """
+        Appends a note as its own row. The task itself isn't saved, so
+        callers that have also changed the task must save it.
+        """
+        ActionNote.objects.create(task=self, action=action, note=note)
+
+
+class ActionNote(models.Model):
+    """
+    A note added to a task by one of its actions.
+
+    Notes are only ever appended, so each is its own row rather
+    than part of the task, making adding a note a single insert.
+    """
+
+    task = models.ForeignKey(Task)
+    action = models.CharField(max_length=200)
+    note = models.TextField()
+    created_on = models.DateTimeField(default=timezone.now)
 
 
 class Token(models.Model):
@@ -123,9 +178,17 @@ class Token(models.Model):
     created_on = models.DateTimeField(default=timezone.now)
     expires = models.DateTimeField(db_index=True)
 
+    class Meta:
+        indexes = [
+            # list ordering and cursor pagination, which is keyed on
+            # the task as the token itself is secret
+            models.Index(fields=['created_on', 'task'],
+                         name='api_token_created_idx'),
+        ]
+
     def to_dict(self):
         return {
-            "task": self.task.uuid,
+            "task": self.task_id,
             "token": self.token,
             "created_on": self.created_on,
             "expires": self.expires
@@ -149,12 +212,143 @@ class Notification(models.Model):
     created_on = models.DateTimeField(default=timezone.now)
     acknowledged = models.BooleanField(default=False, db_index=True)
 
+    class Meta:
+        indexes = [
+            # unacknowledged errors for the status view
+            models.Index(fields=['error', 'acknowledged'],
+                         name='api_notification_error_idx'),
+            models.Index(fields=['created_on', 'uuid'],
+                         name='api_notification_created_idx'),
+        ]
+
     def to_dict(self):
         return {
             "uuid": self.uuid,
             "notes": self.notes,
-            "task": self.task.uuid,
+            "task": self.task_id,
             "error": self.error,
             "acknowledged": self.acknowledged,
             "created_on": self.created_on
         }
+
+
+class NotificationDelivery(models.Model):
+    """
+    Outbox entry for delivering a notification with one engine.
+
+    Written in the same transaction as the notification, and delivered
+    later by the notification dispatcher so engine latency and outages
+    don't hold up the request. The engine conf is looked up again from
+    the task settings on delivery, so no credentials are stored here.
+    """
+
+    uuid = models.CharField(max_length=32, default=hex_uuid,
+                            primary_key=True)
+    notification = models.ForeignKey(Notification)
+    engine = models.CharField(max_length=200)
+    # 'pending', 'sending', 'delivered' or 'failed':
+    state = models.CharField(max_length=20, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_on = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    dispatcher = models.CharField(max_length=200, null=True)
+    claimed_on = models.DateTimeField(null=True)
+    created_on = models.DateTimeField(default=timezone.now)
+    delivered_on = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'next_attempt_on'],
+                         name='api_delivery_state_idx'),
+        ]
+
+
+class QueuedEmail(models.Model):
+    """
+    A rendered email waiting to be sent by the email sender.
+
+    Lets requests return without waiting on SMTP, while failed sends
+    are retried rather than lost.
+    """
+
+    uuid = models.CharField(max_length=32, default=hex_uuid,
+                            primary_key=True)
+    task = models.ForeignKey(Task)
+    # what the email is for, used in notes and error notifications:
+    description = models.CharField(max_length=200)
+    subject = models.TextField()
+    body = models.TextField()
+    html_body = models.TextField(blank=True, default='')
+    from_email = models.CharField(max_length=200)
+    to = JSONField(default=[])
+    headers = JSONField(default={})
+    # 'queued', 'sending', 'sent' or 'failed':
+    state = models.CharField(max_length=20, default='queued')
+    attempts = models.IntegerField(default=0)
+    next_attempt_on = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    sender = models.CharField(max_length=200, null=True)
+    claimed_on = models.DateTimeField(null=True)
+    created_on = models.DateTimeField(default=timezone.now)
+    sent_on = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'next_attempt_on'],
+                         name='api_email_state_idx'),
+        ]
+
+
+class Job(models.Model):
+    """
+    A task stage queued to be run by a job worker rather than
+    in the request that triggered it.
+
+    Data for the submit stage can contain secrets such as passwords,
+    so it is cleared once the job has finished.
+    """
+
+    uuid = models.CharField(max_length=32, default=hex_uuid,
+                            primary_key=True)
+    task = models.ForeignKey(Task)
+    # the token the stage was submitted with, removed on completion:
+    token = models.ForeignKey(Token, null=True, on_delete=models.SET_NULL)
+    # 'post_approve' or 'submit':
+    stage = models.CharField(max_length=20)
+    data = JSONField(default={})
+    # 'queued', 'running', 'completed' or 'failed':
+    state = models.CharField(max_length=20, default='queued')
+    result = JSONField(default={})
+    status_code = models.IntegerField(null=True)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=200, null=True)
+    # '<task>:<stage>' while queued or running, and null once finished,
+    # so a task can only have one active job per stage:
+    active_key = models.CharField(max_length=64, null=True, unique=True)
+    created_on = models.DateTimeField(default=timezone.now)
+    started_on = models.DateTimeField(null=True)
+    finished_on = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'created_on'],
+                         name='api_job_state_idx'),
+        ]
+
+    @property
+    def finished(self):
+        return self.state in ('completed', 'failed')
+
+    def to_dict(self):
+        return {
+            "uuid": self.uuid,
+            "task": self.task_id,
+            "stage": self.stage,
+            "state": self.state,
+            "result": self.result,
+            "status_code": self.status_code,
+            "attempts": self.attempts,
+            "created_on": self.created_on,
+            "started_on": self.started_on,
+            "finished_on": self.finished_on,
+        }
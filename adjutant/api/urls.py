@@ -17,8 +17,11 @@ from django.conf import settings
 
 from rest_framework_swagger.views import get_swagger_view
 
+from adjutant.api.views import metrics_view
+
 urlpatterns = [
     url(r'^v1/', include('adjutant.api.v1.urls')),
+    url(r'^metrics/?$', metrics_view),
 ]
 
 if settings.DEBUG:
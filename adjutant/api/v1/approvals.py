@@ -0,0 +1,156 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+from logging import getLogger
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from adjutant.api.models import Task
+from adjutant.api.v1 import jobs
+
+
+logger = getLogger('adjutant')
+
+
+def pending_tasks(filters):
+    """
+    The uuids of the tasks matching the filters which are still waiting
+    for approval, oldest first.
+    """
+    return Task.objects.filter(**filters).filter(
+        approved=False, completed=False, cancelled=False
+    ).order_by('created_on').values_list('uuid', flat=True)
+
+
+class Pacer(object):
+    """
+    Spaces out the callers of wait() so that, across all threads, no
+    more than 'rate' of them go ahead a second. A rate of 0 is unpaced.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_start = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def approve_task(uuid, approved_by, pacer):
+    """
+    Approves a task and runs its post_approve, as TaskDetail.post does,
+    returning the result and status.
+
+    Only tasks not yet approved are approved, and the approval is made
+    by a conditional update, so overlapping bulk approvals never run a
+    task's post_approve twice. Tasks that were approved and failed can
+    be approved again through TaskDetail.
+    """
+    try:
+        task = Task.objects.get(uuid=uuid)
+    except Task.DoesNotExist:
+        return {'errors': ['No task with this id.']}, 404
+
+    if task.completed:
+        return {'errors': ['This task has already been completed.']}, 400
+    if task.cancelled:
+        return {'errors': ['This task has been cancelled.']}, 400
+    if task.approved:
+        return {'errors': ['This task has already been approved.']}, 409
+    if not all([action.valid for action in task.actions]):
+        return {'errors': ['Cannot approve an invalid task. ' +
+                           'Update data and rerun pre_approve.']}, 400
+
+    # paced here, so tasks that are turned away don't use up the rate
+    pacer.wait()
+
+    now = timezone.now()
+    approved = Task.objects.filter(
+        uuid=uuid, approved=False, completed=False, cancelled=False
+    ).update(approved=True, approved_by=approved_by, approved_on=now)
+    if not approved:
+        return {'errors': ['This task has already been approved.']}, 409
+    task.approved = True
+    task.approved_by = approved_by
+    task.approved_on = now
+
+    if settings.ASYNC_STAGES:
+        return jobs.queued_response(
+            jobs.active_job(task) or jobs.enqueue(task, 'post_approve'))
+
+    try:
+        return jobs.post_approve_task(task)
+    except Exception as e:
+        return jobs.stage_error(task, e, "approving")
+
+
+def _pooled_approve(args):
+    # pool threads get their own database connection, which would
+    # otherwise be left open
+    try:
+        return approve_task(*args)
+    finally:
+        connection.close()
+
+
+def approve_tasks(uuids, approved_by, concurrency=None, rate=None):
+    """
+    Approves each of the tasks, with at most 'concurrency' being
+    approved at once and no more than 'rate' started a second.
+
+    Returns a result for each task, in order, with its uuid and the
+    status approving it through TaskDetail would have given.
+    """
+    if concurrency is None:
+        concurrency = settings.BULK_APPROVE_CONCURRENCY
+    if rate is None:
+        rate = settings.BULK_APPROVE_RATE
+    pacer = Pacer(rate)
+    work = [(task_uuid, approved_by, pacer) for task_uuid in uuids]
+
+    started = time.time()
+    if concurrency > 1 and len(work) > 1:
+        pool = ThreadPool(min(concurrency, len(work)))
+        try:
+            processed = pool.map(_pooled_approve, work, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        processed = [approve_task(*args) for args in work]
+
+    results = []
+    failed = 0
+    for uuid, (result, status) in zip(uuids, processed):
+        results.append(dict(result, task=uuid, status=status))
+        if status >= 400:
+            failed += 1
+
+    logger.info("(%s) - Bulk approved %s tasks, %s failed, in %.2fs." % (
+        timezone.now(), len(results) - failed, failed,
+        time.time() - started))
+    return results
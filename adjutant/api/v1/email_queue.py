@@ -0,0 +1,147 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+from logging import getLogger
+from smtplib import SMTPException
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils import timezone
+
+from adjutant import metrics
+from adjutant.api.models import QueuedEmail
+from adjutant.api.v1.utils import create_email_error_notification
+from adjutant.queues import ClaimQueue
+
+
+logger = getLogger('adjutant')
+
+# errors which mean the email may well send if tried again later:
+SEND_ERRORS = (SMTPException, socket.error)
+
+
+email_queue = ClaimQueue(
+    QueuedEmail, 'queued', 'sending', 'sent',
+    owner_field='sender',
+    timeout='EMAIL_SEND_TIMEOUT',
+    max_attempts='EMAIL_MAX_ATTEMPTS',
+    retry_delay='EMAIL_RETRY_DELAY',
+    done_on_field='sent_on',
+    select_related=('task', ))
+
+
+def claim_emails(sender, limit):
+    """
+    Claims up to 'limit' queued emails that are due, oldest first.
+
+    An email left 'sending' for longer than EMAIL_SEND_TIMEOUT is
+    assumed lost and claimed again.
+    """
+    return email_queue.claim(sender, limit)
+
+
+def build_message(queued):
+    email = EmailMultiAlternatives(
+        queued.subject,
+        queued.body,
+        queued.from_email,
+        queued.to,
+        headers=queued.headers,
+    )
+    if queued.html_body:
+        email.attach_alternative(queued.html_body, "text/html")
+    return email
+
+
+class EmailSender(object):
+    """
+    Sends queued emails in batches.
+
+    A single SMTP connection is opened on first use and kept open for
+    every following email and batch, rather than connecting for each
+    email. It is closed and reopened if sending fails.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.connection = None
+
+    def get_connection(self):
+        if self.connection is None:
+            connection = get_connection(fail_silently=False)
+            connection.open()
+            self.connection = connection
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except SEND_ERRORS:
+                pass
+            self.connection = None
+
+    def send_batch(self, limit=50):
+        """
+        Sends a batch of due emails. Returns the number sent and failed.
+        """
+        sent = failed = 0
+        for queued in claim_emails(self.name, limit):
+            try:
+                with metrics.email_send_duration.time(
+                        mode='queued', result='ok'):
+                    self.get_connection().send_messages(
+                        [build_message(queued)])
+            except SEND_ERRORS as e:
+                self.close()
+                self._failed(queued, e)
+                failed += 1
+            else:
+                self._sent(queued)
+                sent += 1
+        return sent, failed
+
+    def _sent(self, queued):
+        email_queue.succeeded(queued)
+        queued.task.add_action_note(
+            'QueuedEmail', "Sent %s to %s." % (
+                queued.description, ', '.join(queued.to)))
+
+    def _failed(self, queued, error):
+        now = timezone.now()
+        if email_queue.failed(queued, error):
+            logger.error("(%s) - Giving up on email %s: %s" % (
+                now, queued.uuid, error))
+            queued.task.add_action_note(
+                'QueuedEmail', "Failed to send %s to %s: %s" % (
+                    queued.description, ', '.join(queued.to), error))
+            notes = {
+                'errors':
+                    ("Error: '%s' while sending %s for task: %s" %
+                        (error, queued.description, queued.task.uuid))
+            }
+            create_email_error_notification(queued.task, notes)
+        else:
+            logger.warning("(%s) - Email %s failed, attempt %s: %s" % (
+                now, queued.uuid, queued.attempts, error))
+
+
+def email_queue_metrics():
+    """
+    Returns the number of emails by state, other than those sent, and
+    the age in seconds of the oldest email still waiting to be sent.
+    """
+    metrics = email_queue.metrics()
+    metrics['send_lag'] = metrics.pop('lag')
+    return metrics
@@ -0,0 +1,246 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import traceback
+from logging import getLogger
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from adjutant.api.models import Job, Task
+from adjutant.api.v1.utils import (
+    create_notification, create_token, send_stage_email)
+from adjutant.queues import ClaimQueue
+from adjutant.startup.plans import get_plan
+
+
+ACTIVE_STATES = ('queued', 'running')
+
+logger = getLogger('adjutant')
+
+# failed jobs aren't retried, but a job whose worker was lost is run
+# again, so attempts are counted as jobs are claimed
+job_queue = ClaimQueue(
+    Job, 'queued', 'running', 'completed',
+    owner_field='worker',
+    timeout='JOB_TIMEOUT',
+    max_attempts='JOB_MAX_ATTEMPTS',
+    claimed_on_field='started_on',
+    order_by='created_on',
+    count_claims=True)
+
+
+def enqueue(task, stage, data=None, token=None):
+    """
+    Queues a stage of the task to be run by a job worker, or returns
+    the job already queued or running for that stage of the task.
+
+    The job's unique active_key means concurrent requests, such as
+    two approvals, can't both queue the stage.
+    """
+    active_key = "%s:%s" % (task.uuid, stage)
+    while True:
+        try:
+            with transaction.atomic():
+                return Job.objects.create(
+                    task=task, stage=stage, data=data or {}, token=token,
+                    active_key=active_key)
+        except IntegrityError:
+            pass
+        try:
+            return Job.objects.get(active_key=active_key)
+        except Job.DoesNotExist:
+            # finished in between, so try queueing it again
+            continue
+
+
+def active_job(task):
+    """Returns the queued or running job for the task, if any."""
+    return Job.objects.filter(
+        task=task, state__in=ACTIVE_STATES).order_by('created_on').first()
+
+
+def queued_response(job):
+    return {'notes': ['Task queued.'], 'job': job.uuid}, 202
+
+
+def claim_job(worker):
+    """
+    Claims the oldest runnable job for the worker, or returns None.
+
+    A job that has been running for longer than JOB_TIMEOUT is assumed
+    to have lost its worker and is claimed again, as actions can resume
+    a stage from their cache, unless it has run out of attempts.
+    """
+    claimed = job_queue.claim(worker, 1, abandon=_abandon)
+    return claimed[0] if claimed else None
+
+
+def _finish(job, result, status, now=None):
+    job.result = result
+    job.status_code = status
+    job.state = 'completed' if status < 400 else 'failed'
+    job.data = {}
+    job.active_key = None
+    job.finished_on = now or timezone.now()
+    job.save()
+
+
+def _abandon(job, now):
+    _finish(job, {'errors': ['Job abandoned by its worker.']}, 500, now)
+    create_notification(job.task, {
+        'errors': ["Job for stage '%s' abandoned after %s attempts."
+                   % (job.stage, job.attempts)],
+        'job': job.uuid}, error=True)
+
+
+def fail_job(job, e):
+    """
+    Fails a job whose run raised, such as when notifying of a stage's
+    error itself errors, so it isn't left running until JOB_TIMEOUT.
+    """
+    logger.critical("(%s) - Job %s failed! %s\nTrace: \n%s" % (
+        timezone.now(), job.uuid, e, traceback.format_exc()))
+    _finish(job, {'errors': ["Error: '%s' while running job." % e]}, 500)
+    return job
+
+
+def run_job(job):
+    """
+    Runs the stage of the task the job is for, and stores the result.
+
+    The task is read again first, as it may have been cancelled or
+    completed while the job was queued, in which case the job fails.
+    """
+    task = Task.objects.get(uuid=job.task_id)
+    job.task = task
+    try:
+        if task.cancelled:
+            result, status = (
+                {'errors': ['This task has been cancelled.']}, 400)
+        elif task.completed:
+            result, status = (
+                {'errors': ['This task has already been completed.']}, 400)
+        elif job.stage == 'post_approve':
+            result, status = post_approve_task(task)
+        elif job.stage == 'submit':
+            result, status = submit_token(task, job.token, job.data)
+        else:
+            result, status = (
+                {'errors': ["Unknown stage '%s'." % job.stage]}, 400)
+    except Exception as e:
+        result, status = stage_error(task, e, "running job for")
+
+    if status < 400:
+        # deleted along with the token on submit
+        job.token = None
+
+    _finish(job, result, status)
+    return job
+
+
+def post_approve_task(task, actions=None, connection=None):
+    """
+    Runs post_approve on all actions of an approved task, then either
+    issues a token or submits the task.
+
+    This is the post_approve stage for both the api and the job
+    workers. 'connection' is an open email connection to send the
+    task's emails over, if there is one.
+    """
+    if actions is None:
+        actions = [action.get_action() for action in task.actions]
+
+    for action in actions:
+        try:
+            action.post_approve()
+        except Exception as e:
+            return stage_error(task, e, "approving")
+
+    if not all([act.valid for act in actions]):
+        return {'errors': ['actions invalid']}, 400
+
+    if any([act.need_token for act in actions]):
+        token = create_token(task)
+        try:
+            # will throw a key error if the token template has not
+            # been specified
+            email_conf = get_plan(task.task_type).emails['token']
+        except KeyError as e:
+            return stage_error(task, e, "sending token for")
+        send_stage_email(
+            task, email_conf, token, connection=connection, stage='token')
+        return {'notes': ['created token']}, 200
+
+    return submit_task(task, {}, actions, connection=connection)
+
+
+def submit_task(task, data, actions=None, connection=None):
+    """
+    Runs submit on all actions of a task, and marks it completed.
+    """
+    if actions is None:
+        actions = [action.get_action() for action in task.actions]
+
+    for action in actions:
+        try:
+            action.submit(data)
+        except Exception as e:
+            return stage_error(task, e, "submitting")
+
+    task.completed = True
+    task.completed_on = timezone.now()
+    task.save()
+
+    # Sending confirmation email:
+    email_conf = get_plan(task.task_type).emails.get('completed', None)
+    send_stage_email(task, email_conf, connection=connection,
+                     stage='completed')
+
+    return {'notes': ["Task completed successfully."]}, 200
+
+
+def submit_token(task, token, data, actions=None):
+    """
+    Submits the task with the data given with its token, deleting the
+    token once the task is completed.
+    """
+    result, status = submit_task(task, data, actions)
+    if status >= 400:
+        return result, status
+    if token is not None:
+        token.delete()
+    return {'notes': ["Token submitted successfully."]}, 200
+
+
+def stage_error(task, e, doing):
+    """
+    Logs an error that escaped a stage of the task and notifies the
+    admins, returning the response for the stage.
+    """
+    trace = traceback.format_exc()
+    logger.critical(("(%s) - Exception escaped! %s\nTrace: \n%s") % (
+        timezone.now(), e, trace))
+    notes = {
+        'errors':
+            [("Error: '%s' while %s task. " +
+              "See task itself for details.") % (e, doing)],
+        'task': task.uuid
+    }
+    create_notification(task, notes, error=True)
+    return {
+        'errors':
+            ["Error: Something went wrong on the server. " +
+             "It will be looked into shortly."]
+    }, 500
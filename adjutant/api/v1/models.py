@@ -35,6 +35,8 @@ register_taskview_class(r'^actions/UpdateEmail/?$', tasks.UpdateEmail)
 
 register_taskview_class(
     r'^openstack/users/?$', openstack.UserList)
+register_taskview_class(
+    r'^openstack/users/bulk-invite/?$', openstack.UserBulkInvite)
 register_taskview_class(
     r'^openstack/users/(?P<user_id>\w+)/?$', openstack.UserDetail)
 register_taskview_class(
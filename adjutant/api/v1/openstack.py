@@ -22,6 +22,7 @@ from adjutant.api import models
 from adjutant.api import utils
 from adjutant.api.v1 import tasks
 from adjutant.api.v1.utils import add_task_id_for_roles
+from adjutant.startup.plans import get_plan
 
 
 class UserList(tasks.InviteUser):
@@ -29,9 +30,7 @@ class UserList(tasks.InviteUser):
     @utils.mod_or_admin
     def get(self, request):
         """Get a list of all users who have been added to a project"""
-        class_conf = settings.TASK_SETTINGS.get(
-            'edit_user', settings.DEFAULT_TASK_SETTINGS)
-        role_blacklist = class_conf.get('role_blacklist', [])
+        role_blacklist = get_plan('edit_user').conf.get('role_blacklist', [])
         user_list = []
         id_manager = user_store.IdentityManager()
         project_id = request.keystone_user['project_id']
@@ -71,7 +70,8 @@ class UserList(tasks.InviteUser):
             project_id=project_id,
             task_type="invite_user",
             completed=0,
-            cancelled=0)
+            cancelled=0).prefetch_related(
+                'token_set', 'notification_set', 'action_set')
 
         registrations = []
         for task in project_tasks:
@@ -85,7 +85,8 @@ class UserList(tasks.InviteUser):
                     status = "Failed"
 
             task_data = {}
-            for action in task.actions:
+            for action in sorted(task.action_set.all(),
+                                 key=lambda a: a.order):
                 task_data.update(action.action_data)
 
             registrations.append(
@@ -110,6 +111,60 @@ class UserList(tasks.InviteUser):
         return Response({'users': user_list})
 
 
+class UserBulkInvite(tasks.InviteUser):
+    """
+    The openstack endpoint to invite many users to a project at once.
+    ---
+    """
+
+    @utils.mod_or_admin
+    def post(self, request, format=None):
+        """
+        Invites a list of users to the current project.
+
+        Takes 'invitees', a list of what InviteUser takes for each user,
+        up to BULK_INVITE_MAX_USERS of them. Each invitee becomes an
+        invite_user task as with InviteUser, and the result for each is
+        returned in order, with the status InviteUser would have given.
+        """
+        invitees = request.data.get('invitees', None)
+        if (not isinstance(invitees, list) or not invitees or
+                not all(isinstance(invitee, dict) for invitee in invitees)):
+            return Response(
+                {'errors': ["'invitees' must be a list of users to invite."]},
+                status=400)
+        if len(invitees) > settings.BULK_INVITE_MAX_USERS:
+            return Response(
+                {'errors': ["At most %s users can be invited at once." %
+                            settings.BULK_INVITE_MAX_USERS]},
+                status=400)
+
+        self.logger.info("(%s) - New bulk AttachUser request for %s users." %
+                         (timezone.now(), len(invitees)))
+
+        data_list = []
+        for invitee in invitees:
+            data = dict(invitee)
+            # Default project_id to the keystone user's project
+            if data.get('project_id', None) is None:
+                data['project_id'] = request.keystone_user['project_id']
+            data_list.append(data)
+
+        results = []
+        for invitee, (processed, status) in zip(
+                invitees, self.process_actions_batch(request, data_list)):
+            result = {'email': invitee.get('email'), 'status': status}
+            errors = processed.get('errors', None)
+            if errors:
+                result['errors'] = errors
+            else:
+                result['notes'] = processed.get('notes', [])
+                add_task_id_for_roles(request, processed, result, ['admin'])
+            results.append(result)
+
+        return Response({'invitees': results}, status=200)
+
+
 class UserDetail(tasks.TaskView):
     task_type = 'edit_user'
 
@@ -127,9 +182,7 @@ class UserDetail(tasks.TaskView):
         if not user:
             return Response(no_user, status=404)
 
-        class_conf = settings.TASK_SETTINGS.get(
-            self.task_type, settings.DEFAULT_TASK_SETTINGS)
-        role_blacklist = class_conf.get('role_blacklist', [])
+        role_blacklist = self.plan.conf.get('role_blacklist', [])
         project_id = request.keystone_user['project_id']
         project = id_manager.get_project(project_id)
 
@@ -168,7 +221,7 @@ class UserDetail(tasks.TaskView):
             if task.uuid == user_id:
                 task.add_action_note(self.__class__.__name__, 'Cancelled.')
                 task.cancelled = True
-                task.save()
+                task.save(update_fields=['cancelled'])
                 return Response('Cancelled pending invite task!', status=200)
         return Response('Not found.', status=404)
 
@@ -12,16 +12,24 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import traceback
+from collections import defaultdict
+
 from rest_framework.response import Response
+from adjutant.actions import unit_of_work
+from adjutant.actions.models import Action
 from adjutant.actions.user_store import IdentityManager
+from adjutant.actions.v1.base import share_identity_manager
 from adjutant.api.models import Task
 from django.utils import timezone
 from adjutant.api import utils
+from adjutant.api.v1 import jobs
 from adjutant.api.v1.views import APIViewWithLogger
 from adjutant.api.v1.utils import (
-    send_stage_email, create_notification, create_token, create_task_hash,
-    add_task_id_for_roles)
+    send_stage_email, create_notification, create_task_hash,
+    add_task_id_for_roles, open_email_connection)
 from adjutant.exceptions import SerializerMissingException
+from adjutant.startup.plans import get_plan
 
 
 from django.conf import settings
@@ -43,50 +51,35 @@ class TaskView(APIViewWithLogger):
 
     default_actions = []
 
+    # an open connection to send the task emails over, if there is one
+    email_connection = None
+
+    @property
+    def plan(self):
+        """The precompiled settings for this view's task type."""
+        return get_plan(self.task_type, self.default_actions)
+
     def get(self, request):
         """
         The get method will return a json listing the actions this
         view will run, and the data fields that those actions require.
         """
-        class_conf = settings.TASK_SETTINGS.get(
-            self.task_type, settings.DEFAULT_TASK_SETTINGS)
-
-        actions = (
-            class_conf.get('default_actions', []) or
-            self.default_actions[:])
-
-        actions += class_conf.get('additional_actions', [])
-
-        required_fields = []
-
-        for action in actions:
-            action_class, action_serializer = settings.ACTION_CLASSES[action]
-            for field in action_class.required:
-                if field not in required_fields:
-                    required_fields.append(field)
-
-        return Response({'actions': actions,
-                         'required_fields': required_fields})
+        plan = self.plan
+        return Response({'actions': list(plan.action_names),
+                         'required_fields': list(plan.required_fields)})
 
-    def _instantiate_action_serializers(self, request, class_conf):
+    def _instantiate_action_serializers(self, data, plan):
         action_serializer_list = []
 
-        action_names = (
-            class_conf.get('default_actions', []) or
-            self.default_actions[:])
-        action_names += class_conf.get('additional_actions', [])
-
         # instantiate all action serializers and check validity
         valid = True
-        for action_name in action_names:
-            action_class, serializer_class = \
-                settings.ACTION_CLASSES[action_name]
+        for action_name, action_class, serializer_class in plan.actions:
 
             # instantiate serializer class
             if not serializer_class:
                 raise SerializerMissingException(
                     "No serializer defined for action %s" % action_name)
-            serializer = serializer_class(data=request.data)
+            serializer = serializer_class(data=data)
 
             action_serializer_list.append({
                 'name': action_name,
@@ -131,6 +124,29 @@ class TaskView(APIViewWithLogger):
             {'errors': ['Task is a duplicate of an existing task']},
             409)
 
+    def _pre_approve_error(self, task, e):
+        """
+        Logs an error that escaped an action's pre_approve and notifies
+        the admins, returning the response for the request.
+        """
+        trace = traceback.format_exc()
+        self.logger.critical((
+            "(%s) - Exception escaped! %s\nTrace: \n%s") % (
+                timezone.now(), e, trace))
+        notes = {
+            'errors':
+                [("Error: '%s' while setting up task. " +
+                  "See task itself for details.") % e]
+        }
+        create_notification(task, notes, error=True)
+
+        response_dict = {
+            'errors':
+                ["Error: Something went wrong on the server. " +
+                 "It will be looked into shortly."]
+        }
+        return response_dict, 200
+
     def process_actions(self, request):
         """
         Will ensure the request data contains the required data
@@ -143,12 +159,11 @@ class TaskView(APIViewWithLogger):
         sets auto_approve to True, and none of them set it to False
         the approval steps will also be run.
         """
-        class_conf = settings.TASK_SETTINGS.get(
-            self.task_type, settings.DEFAULT_TASK_SETTINGS)
+        plan = self.plan
 
         # Action serializers
         action_serializer_list = self._instantiate_action_serializers(
-            request, class_conf)
+            request.data, plan)
 
         if isinstance(action_serializer_list, tuple):
             return action_serializer_list
@@ -156,7 +171,7 @@ class TaskView(APIViewWithLogger):
         hash_key = create_task_hash(self.task_type, action_serializer_list)
 
         # Handle duplicates
-        duplicate_error = self._handle_duplicates(class_conf, hash_key)
+        duplicate_error = self._handle_duplicates(plan.conf, hash_key)
         if duplicate_error:
             return duplicate_error
 
@@ -192,28 +207,12 @@ class TaskView(APIViewWithLogger):
             try:
                 action_instance.pre_approve()
             except Exception as e:
-                import traceback
-                trace = traceback.format_exc()
-                self.logger.critical((
-                    "(%s) - Exception escaped! %s\nTrace: \n%s") % (
-                        timezone.now(), e, trace))
-                notes = {
-                    'errors':
-                        [("Error: '%s' while setting up task. " +
-                          "See task itself for details.") % e]
-                }
-                create_notification(task, notes, error=True)
-
-                response_dict = {
-                    'errors':
-                        ["Error: Something went wrong on the server. " +
-                         "It will be looked into shortly."]
-                }
-                return response_dict, 200
+                return self._pre_approve_error(task, e)
 
         # send initial confirmation email:
-        email_conf = class_conf.get('emails', {}).get('initial', None)
-        send_stage_email(task, email_conf)
+        email_conf = plan.emails.get('initial', None)
+        send_stage_email(task, email_conf, connection=self.email_connection,
+                         stage='initial')
 
         action_models = task.actions
         approve_list = [act.get_action().auto_approve for act in action_models]
@@ -240,37 +239,143 @@ class TaskView(APIViewWithLogger):
 
         return {'task': task}, 200
 
-    def _create_token(self, task):
-        token = create_token(task)
+    def _handle_batch_duplicates(self, class_conf, pending, results):
+        """
+        Checks a batch of new tasks for duplicates in one query,
+        setting the duplicate error as the result of any that are.
+
+        Tasks repeated within the batch are duplicates of the first.
+        Returns the items of 'pending' which aren't duplicates.
+        """
+        hash_keys = set(hash_key for __, __, hash_key in pending)
+        duplicate_tasks = Task.objects.filter(
+            hash_key__in=hash_keys, completed=0, cancelled=0)
+        duplicates = set(duplicate_tasks.values_list('hash_key', flat=True))
+
+        if duplicates and class_conf.get("duplicate_policy", "") == "cancel":
+            self.logger.info(
+                "(%s) - %s tasks are duplicates - Cancelling old tasks." %
+                (timezone.now(), len(duplicates)))
+            duplicate_tasks.update(cancelled=True)
+            duplicates = set()
+
+        unique = []
+        for index, action_serializer_list, hash_key in pending:
+            if hash_key in duplicates:
+                results[index] = (
+                    {'errors': ['Task is a duplicate of an existing task']},
+                    409)
+                continue
+            duplicates.add(hash_key)
+            unique.append((index, action_serializer_list, hash_key))
+        return unique
+
+    def process_actions_batch(self, request, data_list):
+        """
+        The equivalent of process_actions for a list of request data,
+        returning the (processed, status) of each in order.
+
+        All the data is validated first, duplicates are found in one
+        query, and the tasks and their actions are created with bulk
+        inserts. The actions of all the tasks share an identity manager
+        for pre_approve, and again for post_approve if auto approved,
+        so lookups they have in common are made once for the batch.
+        Emails are sent over one connection.
+        """
+        plan = self.plan
+        results = [None] * len(data_list)
+
+        pending = []
+        for index, data in enumerate(data_list):
+            action_serializer_list = self._instantiate_action_serializers(
+                data, plan)
+            if isinstance(action_serializer_list, tuple):
+                results[index] = action_serializer_list
+                continue
+            hash_key = create_task_hash(self.task_type, action_serializer_list)
+            pending.append((index, action_serializer_list, hash_key))
+
+        pending = self._handle_batch_duplicates(plan.conf, pending, results)
+        if not pending:
+            return results
+
+        keystone_user = request.keystone_user
+        tasks = [
+            Task(ip_address=request.META['REMOTE_ADDR'],
+                 keystone_user=keystone_user,
+                 project_id=keystone_user.get('project_id'),
+                 task_type=self.task_type,
+                 hash_key=task_hash)
+            for __, __, task_hash in pending]
+        Task.objects.bulk_create(tasks)
+        for task in tasks:
+            # bulk_create only marks models with database assigned
+            # keys as saved, and the task uuid is assigned by us.
+            task._state.adding = False
+            task._state.db = Task.objects.db
+
+        Action.objects.bulk_create([
+            Action(action_name=action['name'],
+                   action_data=action['serializer'].validated_data,
+                   task=task, order=order)
+            for task, (__, serializers, __) in zip(tasks, pending)
+            for order, action in enumerate(serializers)])
+        # read back, as not every database returns the ids of bulk inserts
+        tasks_by_uuid = dict((task.uuid, task) for task in tasks)
+        task_actions = defaultdict(list)
+        for action_model in Action.objects.filter(
+                task__in=tasks).order_by('order'):
+            action_model.task = tasks_by_uuid[action_model.task_id]
+            task_actions[action_model.task_id].append(
+                action_model.get_action())
+
+        self.email_connection = open_email_connection()
         try:
-            class_conf = settings.TASK_SETTINGS.get(
-                self.task_type, settings.DEFAULT_TASK_SETTINGS)
-
-            # will throw a key error if the token template has not
-            # been specified
-            email_conf = class_conf['emails']['token']
-            send_stage_email(task, email_conf, token)
-            return {'notes': ['created token']}, 200
-        except KeyError as e:
-            import traceback
-            trace = traceback.format_exc()
-            self.logger.critical((
-                "(%s) - Exception escaped! %s\nTrace: \n%s") % (
-                    timezone.now(), e, trace))
-            notes = {
-                'errors':
-                    [("Error: '%s' while sending " +
-                      "token. See task " +
-                      "itself for details.") % e]
-            }
-            create_notification(task, notes, error=True)
-
-            response_dict = {
-                'errors':
-                    ["Error: Something went wrong on the " +
-                     "server. It will be looked into shortly."]
-            }
-            return response_dict, 500
+            approve_tasks = []
+            share_identity_manager(tasks, 'pre_approve')
+            for task, (index, __, __) in zip(tasks, pending):
+                # a unit of work per task, so each task's saves are
+                # written on their own, as with process_actions
+                with unit_of_work.unit_of_work():
+                    results[index] = self._pre_approve_batch_task(
+                        task, task_actions[task.uuid])
+                if results[index] is None:
+                    approve_tasks.append((task, index))
+
+            share_identity_manager(
+                [task for task, __ in approve_tasks], 'post_approve')
+            for task, index in approve_tasks:
+                self.logger.info("(%s) - AutoApproving %s request."
+                                 % (timezone.now(), self.__class__.__name__))
+                approval_data, status = self.approve(request, task)
+                approval_data['task'] = task
+                approval_data['auto_approved'] = True
+                results[index] = (approval_data, status)
+        finally:
+            if self.email_connection is not None:
+                self.email_connection.close()
+                self.email_connection = None
+        return results
+
+    def _pre_approve_batch_task(self, task, actions):
+        """
+        Runs pre_approve for a task of a batch, returning its result,
+        or None if it can be auto approved.
+        """
+        for action in actions:
+            try:
+                action.pre_approve()
+            except Exception as e:
+                return self._pre_approve_error(task, e)
+
+        email_conf = self.plan.emails.get('initial', None)
+        send_stage_email(task, email_conf, connection=self.email_connection,
+                         stage='initial')
+
+        approve_list = [action.auto_approve for action in actions]
+        if False in approve_list or True not in approve_list:
+            return {'task': task}, 200
+        return None
 
     def approve(self, request, task):
         """
@@ -289,80 +394,17 @@ class TaskView(APIViewWithLogger):
 
         action_models = task.actions
         actions = [act.get_action() for act in action_models]
-        need_token = False
 
         valid = all([act.valid for act in actions])
         if not valid:
             return {'errors': ['actions invalid']}, 400
 
-        # post_approve all actions
-        for action in actions:
-            try:
-                action.post_approve()
-            except Exception as e:
-                import traceback
-                trace = traceback.format_exc()
-                self.logger.critical((
-                    "(%s) - Exception escaped! %s\nTrace: \n%s") % (
-                        timezone.now(), e, trace))
-                notes = {
-                    'errors':
-                        [("Error: '%s' while approving task. " +
-                          "See task itself for details.") % e]
-                }
-                create_notification(task, notes, error=True)
-
-                response_dict = {
-                    'errors':
-                        ["Error: Something went wrong on the server. " +
-                         "It will be looked into shortly."]
-                }
-                return response_dict, 500
+        if settings.ASYNC_STAGES:
+            job = jobs.active_job(task) or jobs.enqueue(task, 'post_approve')
+            return jobs.queued_response(job)
 
-        valid = all([act.valid for act in actions])
-        if not valid:
-            return {'errors': ['actions invalid']}, 400
-
-        need_token = any([act.need_token for act in actions])
-        if need_token:
-            return self._create_token(task)
-
-        # submit all actions
-        for action in actions:
-            try:
-                action.submit({})
-            except Exception as e:
-                import traceback
-                trace = traceback.format_exc()
-                self.logger.critical((
-                    "(%s) - Exception escaped! %s\nTrace: \n%s") % (
-                        timezone.now(), e, trace))
-                notes = {
-                    'errors':
-                        [("Error: '%s' while submitting " +
-                          "task. See task " +
-                          "itself for details.") % e]
-                }
-                create_notification(task, notes, error=True)
-
-                response_dict = {
-                    'errors':
-                        ["Error: Something went wrong on the " +
-                         "server. It will be looked into shortly."]
-                }
-                return response_dict, 500
-
-        task.completed = True
-        task.completed_on = timezone.now()
-        task.save()
-
-        # Sending confirmation email:
-        class_conf = settings.TASK_SETTINGS.get(
-            self.task_type, settings.DEFAULT_TASK_SETTINGS)
-        email_conf = class_conf.get(
-            'emails', {}).get('completed', None)
-        send_stage_email(task, email_conf)
-        return {'notes': ["Task completed successfully."]}, 200
+        return jobs.post_approve_task(
+            task, actions, connection=self.email_connection)
 
 
 # NOTE(adriant): We should deprecate these TaskViews properly and switch tests
@@ -521,22 +563,9 @@ class EditUser(TaskView):
 
     @utils.mod_or_admin
     def get(self, request):
-        class_conf = settings.TASK_SETTINGS.get(
-            self.task_type, settings.DEFAULT_TASK_SETTINGS)
-
-        action_names = (
-            class_conf.get('default_actions', []) or
-            self.default_actions[:])
-
-        action_names += class_conf.get('additional_actions', [])
-        role_blacklist = class_conf.get('role_blacklist', [])
-
-        required_fields = set()
-
-        for action_name in action_names:
-            action_class, action_serializer = \
-                settings.ACTION_CLASSES[action_name]
-            required_fields |= action_class.required
+        plan = self.plan
+        role_blacklist = plan.conf.get('role_blacklist', [])
+        required_fields = set(plan.required_fields)
 
         user_list = []
         id_manager = IdentityManager()
@@ -558,7 +587,7 @@ class EditUser(TaskView):
                               "email": user.username,
                               "roles": roles})
 
-        return Response({'actions': action_names,
+        return Response({'actions': list(plan.action_names),
                          'required_fields': list(required_fields),
                          'users': user_list})
 
@@ -22,6 +22,8 @@ from django.test.utils import override_settings
 from django.test import TestCase
 from rest_framework.test import APITestCase
 
+from adjutant.actions.user_store import count_keystone_calls
+
 temp_cache = {}
 
 
@@ -66,6 +68,14 @@ def setup_temp_cache(projects, users):
     }
 
 
+def fake_role(name):
+    role = mock.Mock()
+    role.name = name
+    role.to_dict.return_value = {'name': name}
+    return role
+
+
+@count_keystone_calls
 class FakeManager(object):
 
     def _project_from_id(self, project):
@@ -162,21 +172,14 @@ class FakeManager(object):
     def find_role(self, name):
         global temp_cache
         if temp_cache['roles'].get(name, None):
-            role = mock.Mock()
-            role.name = name
-            return role
+            return fake_role(name)
         return None
 
     def get_roles(self, user, project):
         user = self._user_from_id(user)
         project = self._project_from_id(project)
         try:
-            roles = []
-            for role in project.roles[user.id]:
-                r = mock.Mock()
-                r.name = role
-                roles.append(r)
-            return roles
+            return [fake_role(role) for role in project.roles[user.id]]
         except KeyError:
             return []
 
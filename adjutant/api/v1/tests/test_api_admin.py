@@ -12,12 +12,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
 import json
 
 from datetime import timedelta
 
 from unittest import skip
+from uuid import uuid4
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 import mock
@@ -25,7 +29,8 @@ import mock
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from adjutant.api.models import Task, Token
+from adjutant.actions.models import Action
+from adjutant.api.models import Notification, Task, Token
 from adjutant.api.v1.tests import (FakeManager, setup_temp_cache,
                                    modify_dict_settings)
 
@@ -363,6 +368,73 @@ class AdminAPITests(APITestCase):
         )
         self.assertEqual(response.data, {'notifications': []})
 
+    def test_notification_acknowledge_filters(self):
+        """
+        Every notification matching the filters is acknowledged, in one
+        update without loading them.
+        """
+        setup_temp_cache({}, {})
+
+        url = "/v1/actions/CreateProject"
+        for name in ["test_project", "test_project2", "test_project3"]:
+            data = {'project_name': name, 'email': "test@example.com"}
+            response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "admin,_member_",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+
+        tasks = Task.objects.order_by('created_on')
+        old = timezone.now() - timedelta(days=1)
+        Notification.objects.filter(task=tasks[0]).update(
+            error=True, created_on=old)
+        Notification.objects.filter(task=tasks[1]).update(error=True)
+
+        url = "/v1/notifications"
+        data = {'filters': {
+            'task__task_type': {'exact': "create_project"},
+            'error': {'exact': True},
+            'created_on': {'lt': str(timezone.now() - timedelta(hours=1))},
+        }}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                url, data, format='json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data,
+                         {'notes': ['1 notifications acknowledged.']})
+        notification_queries = [
+            query['sql'] for query in queries
+            if 'api_notification' in query['sql']]
+        self.assertEqual(len(notification_queries), 1)
+        self.assertTrue(notification_queries[0].startswith('UPDATE'))
+
+        self.assertEqual(
+            list(Notification.objects.filter(acknowledged=True).values_list(
+                'task', flat=True)),
+            [tasks[0].uuid])
+
+        # acknowledged notifications aren't counted again
+        response = self.client.post(
+            url, {'filters': {'error': {'exact': True}}}, format='json',
+            headers=headers)
+        self.assertEqual(response.data,
+                         {'notes': ['1 notifications acknowledged.']})
+
+        for filters in [{}, ["error"], {'not_a_field': {'exact': True}},
+                        {'created_on': {'lt': "not a date"}}]:
+            response = self.client.post(
+                url, {'filters': filters}, format='json', headers=headers)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST, filters)
+        self.assertEqual(
+            Notification.objects.filter(acknowledged=False).count(), 1)
+
     def test_token_expired_delete(self):
         """
         test deleting of expired tokens.
@@ -1058,3 +1130,217 @@ class AdminAPITests(APITestCase):
             response.data['notes'],
             ['If user with email exists, reset token will be issued.'])
         self.assertEqual(0, Token.objects.count())
+
+
+class AdminAPIQueryTests(APITestCase):
+    """
+    Tests to ensure the admin list endpoints use a constant number
+    of queries regardless of how many items are returned.
+    """
+
+    headers = {
+        'project_name': "test_project",
+        'project_id': "test_project_id",
+        'roles': "admin,_member_",
+        'username': "test@example.com",
+        'user_id': "test_user_id",
+        'authenticated': True
+    }
+
+    def add_tasks(self, count):
+        for i in range(count):
+            task = Task.objects.create(
+                ip_address="0.0.0.0",
+                keystone_user={},
+                project_id='test_project_id',
+                task_type='invite_user')
+            for order in range(2):
+                Action.objects.create(
+                    action_name='NewUserAction', task=task, order=order)
+            task.add_action_note('NewUserAction', 'note %s' % i)
+            Token.objects.create(
+                task=task, token=task.uuid,
+                expires=timezone.now() + timedelta(hours=1))
+            Notification.objects.create(task=task, notes={'notes': []})
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                url, format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response
+
+    def assert_constant_queries(self, url, key, expected):
+        self.add_tasks(2)
+        small_count, response = self.count_queries(url)
+        self.assertEqual(len(response.data[key]), 2)
+
+        self.add_tasks(10)
+        large_count, response = self.count_queries(url)
+        self.assertEqual(len(response.data[key]), 12)
+
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(large_count, expected)
+        return response
+
+    def test_task_list_queries(self):
+        """
+        Tasks, their actions and their notes are fetched in a query each.
+        """
+        response = self.assert_constant_queries("/v1/tasks", 'tasks', 3)
+        task = response.data['tasks'][0]
+        self.assertEqual(len(task['actions']), 2)
+        self.assertEqual(
+            [action['action_name'] for action in task['actions']],
+            ['NewUserAction', 'NewUserAction'])
+        self.assertEqual(len(task['action_notes']['NewUserAction']), 1)
+
+    def test_task_list_paginated_queries(self):
+        """
+        A page of tasks adds only the count query.
+        """
+        self.assert_constant_queries(
+            "/v1/tasks?tasks_per_page=20", 'tasks', 4)
+
+    def test_token_list_queries(self):
+        """
+        Token lists don't load each token's task.
+        """
+        response = self.assert_constant_queries("/v1/tokens", 'tokens', 1)
+        task_uuids = set(Task.objects.values_list('uuid', flat=True))
+        for token in response.data['tokens']:
+            self.assertIn(token['task'], task_uuids)
+
+    def test_notification_list_queries(self):
+        """
+        Notification lists don't load each notification's task.
+        """
+        response = self.assert_constant_queries(
+            "/v1/notifications", 'notifications', 1)
+        task_uuids = set(Task.objects.values_list('uuid', flat=True))
+        for notification in response.data['notifications']:
+            self.assertIn(notification['task'], task_uuids)
+
+
+class AdminAPIPaginationTests(APITestCase):
+    """
+    Tests for cursor pagination of the admin list endpoints.
+    """
+
+    headers = {
+        'project_name': "test_project",
+        'project_id': "test_project_id",
+        'roles': "admin,_member_",
+        'username': "test@example.com",
+        'user_id': "test_user_id",
+        'authenticated': True
+    }
+
+    def setUp(self):
+        # half the tasks share a created_on, to check the
+        # ordering is stable for equal timestamps
+        now = timezone.now()
+        for i in range(12):
+            created_on = now - timedelta(minutes=min(i, 6))
+            task = Task.objects.create(
+                ip_address="0.0.0.0",
+                keystone_user={},
+                project_id='test_project_id',
+                task_type='invite_user',
+                created_on=created_on)
+            Token.objects.create(
+                task=task, token=uuid4().hex, created_on=created_on,
+                expires=timezone.now() + timedelta(hours=1))
+            Notification.objects.create(
+                task=task, notes={'notes': []}, created_on=created_on)
+
+    def get(self, url):
+        response = self.client.get(url, format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def walk(self, url, key, id_key, model, order_key='pk'):
+        expected = [
+            obj.pk for obj in model.objects.order_by(
+                '-created_on', '-' + order_key)]
+
+        data = self.get(url + "?limit=5")
+        self.assertIsNone(data['previous'])
+        pages = [[item[id_key] for item in data[key]]]
+        seen = list(pages[0])
+        while data['next']:
+            data = self.get(url + "?limit=5&cursor=%s" % data['next'])
+            ids = [item[id_key] for item in data[key]]
+            pages.append(ids)
+            seen.extend(ids)
+        self.assertEqual(seen, expected)
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+
+        # and back again from the last page
+        previous = []
+        while data['previous']:
+            data = self.get(url + "?limit=5&cursor=%s" % data['previous'])
+            previous.append([item[id_key] for item in data[key]])
+        self.assertEqual(previous, [pages[1], pages[0]])
+
+    def test_task_list_cursor(self):
+        self.walk("/v1/tasks", 'tasks', 'uuid', Task)
+
+    def test_token_list_cursor(self):
+        self.walk("/v1/tokens", 'tokens', 'token', Token, 'task_id')
+
+    def test_token_cursor_hides_token(self):
+        """
+        Token cursors don't contain the secret token values.
+        """
+        data = self.get("/v1/tokens?limit=5")
+        data = self.get("/v1/tokens?limit=5&cursor=%s" % data['next'])
+        cursors = [base64.urlsafe_b64decode(str(data[cursor]))
+                   for cursor in ('next', 'previous')]
+        for token in Token.objects.all():
+            for cursor in cursors:
+                self.assertNotIn(token.token, cursor)
+
+    def test_notification_list_cursor(self):
+        self.walk(
+            "/v1/notifications", 'notifications', 'uuid', Notification)
+
+    def test_cursor_count(self):
+        """
+        The total is only counted when asked for.
+        """
+        data = self.get("/v1/tasks?limit=5")
+        self.assertNotIn('count', data)
+        data = self.get("/v1/tasks?limit=5&with_count=true")
+        self.assertEqual(data['count'], 12)
+
+    def test_cursor_with_filters(self):
+        Task.objects.filter(
+            uuid__in=Task.objects.values_list('uuid', flat=True)[:4]
+        ).update(task_type='create_project')
+        data = self.get(
+            '/v1/tasks?limit=3&with_count=true&filters=%s' %
+            json.dumps({'task_type': {'exact': 'create_project'}}))
+        self.assertEqual(data['count'], 4)
+        self.assertEqual(len(data['tasks']), 3)
+        data = self.get('/v1/tasks?limit=3&cursor=%s&filters=%s' % (
+            data['next'],
+            json.dumps({'task_type': {'exact': 'create_project'}})))
+        self.assertEqual(len(data['tasks']), 1)
+        self.assertIsNone(data['next'])
+
+    def test_page_number_mode_kept(self):
+        """
+        tasks_per_page still gives the page number response.
+        """
+        data = self.get("/v1/tasks?tasks_per_page=5&page=2")
+        self.assertEqual(data['pages'], 3)
+        self.assertEqual(len(data['tasks']), 5)
+        self.assertNotIn('next', data)
+
+    def test_invalid_cursor(self):
+        for query in ["?cursor=notacursor", "?limit=none", "?limit=0"]:
+            response = self.client.get(
+                "/v1/tokens" + query, format='json', headers=self.headers)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
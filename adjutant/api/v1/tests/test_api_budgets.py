@@ -0,0 +1,210 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework import status
+
+from adjutant.actions.user_store import keystone_call_totals
+from adjutant.api.models import Task, Token
+from adjutant.api.v1.tests import (FakeManager, setup_temp_cache,
+                                   AdjutantAPITestCase)
+
+
+# The most database queries and Keystone calls each endpoint may make,
+# against the fixture in QueryBudgetTests.setUp, which has several
+# project users and pending invites so per item lookups show up.
+# Lower these when an endpoint gets cheaper, and only raise them
+# knowing why the endpoint needs more.
+BUDGETS = {
+    # endpoint: (queries, keystone calls)
+    'SignUp': (16, 3),
+    'InviteUser': (22, 6),
+    'UserList': (4, 2),
+    'UserDetail': (0, 3),
+    # the task lookup, the note insert and saving only 'cancelled'
+    'UserDetail DELETE': (3, 1),
+    'UserRoles': (0, 3),
+    'RoleList': (0, 4),
+    'TaskList': (3, 0),
+    'TaskDetail GET': (3, 0),
+    'TaskDetail approve': (23, 13),
+    'TokenDetail GET': (3, 0),
+    'TokenDetail submit': (13, 6),
+}
+
+USERS = 5
+INVITES = 5
+
+
+class QueryBudgetTests(AdjutantAPITestCase):
+    """
+    Checks each endpoint keeps within its budget of database queries
+    and Keystone calls, so an added per item lookup fails here rather
+    than showing up as latency in production.
+    """
+
+    admin_headers = {
+        'project_name': "admin_project",
+        'project_id': "admin_project_id",
+        'roles': "admin,_member_",
+        'username': "admin",
+        'user_id': "admin_id",
+        'authenticated': True
+    }
+
+    project_headers = {
+        'project_name': "test_project",
+        'project_id': "test_project_id",
+        'roles': "project_admin,_member_,project_mod",
+        'username': "test@example.com",
+        'user_id': "user_id_1",
+        'authenticated': True
+    }
+
+    def setUp(self):
+        # patched here rather than on the class, as setUp uses it too
+        patcher = mock.patch(
+            'adjutant.actions.user_store.IdentityManager', FakeManager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        project = mock.Mock()
+        project.id = 'test_project_id'
+        project.name = 'test_project'
+        project.domain = 'default'
+        project.roles = {}
+
+        users = {}
+        for i in range(1, USERS + 1):
+            user = mock.Mock()
+            user.id = 'user_id_%s' % i
+            user.name = "test%s@example.com" % i
+            user.email = "test%s@example.com" % i
+            user.domain = 'default'
+            users[user.id] = user
+            project.roles[user.id] = ['_member_']
+        project.roles['user_id_1'].append('project_admin')
+
+        setup_temp_cache({'test_project': project}, users)
+
+        for i in range(INVITES):
+            response = self.client.post(
+                "/v1/actions/InviteUser",
+                {'email': "invite%s@example.com" % i, 'roles': ["_member_"]},
+                format='json', headers=self.project_headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def assert_within_budget(self, endpoint, method, url, data=None,
+                             headers=None):
+        query_budget, call_budget = BUDGETS[endpoint]
+        calls_before = keystone_call_totals()[0]
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(
+                url, data, format='json', headers=headers or {})
+        calls = keystone_call_totals()[0] - calls_before
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK,
+                         response.data)
+        self.assertLessEqual(
+            len(queries), query_budget,
+            "%s made %s queries, over its budget of %s:\n%s" % (
+                endpoint, len(queries), query_budget,
+                '\n'.join(query['sql'] for query in queries)))
+        self.assertLessEqual(
+            calls, call_budget,
+            "%s made %s Keystone calls, over its budget of %s" % (
+                endpoint, calls, call_budget))
+        return response
+
+    def test_sign_up(self):
+        self.assert_within_budget(
+            'SignUp', 'post', "/v1/openstack/sign-up",
+            {'project_name': "new_project", 'email': "new@example.com"})
+
+    def test_invite_user(self):
+        self.assert_within_budget(
+            'InviteUser', 'post', "/v1/actions/InviteUser",
+            {'email': "new@example.com", 'roles': ["_member_"]},
+            self.project_headers)
+
+    def test_user_list(self):
+        response = self.assert_within_budget(
+            'UserList', 'get', "/v1/openstack/users",
+            headers=self.project_headers)
+        self.assertEqual(len(response.data['users']), USERS + INVITES)
+
+    def test_user_detail(self):
+        self.assert_within_budget(
+            'UserDetail', 'get', "/v1/openstack/users/user_id_2",
+            headers=self.project_headers)
+
+    def test_cancel_invite(self):
+        """
+        The note on the cancelled invite is only an insert, rather than
+        also rewriting the task.
+        """
+        task = Task.objects.filter(task_type="invite_user")[0]
+        self.assert_within_budget(
+            'UserDetail DELETE', 'delete',
+            "/v1/openstack/users/%s" % task.uuid,
+            headers=self.project_headers)
+        self.assertTrue(Task.objects.get(uuid=task.uuid).cancelled)
+
+    def test_user_roles(self):
+        self.assert_within_budget(
+            'UserRoles', 'get', "/v1/openstack/users/user_id_2/roles",
+            headers=self.project_headers)
+
+    def test_role_list(self):
+        self.assert_within_budget(
+            'RoleList', 'get', "/v1/openstack/roles",
+            headers=self.project_headers)
+
+    def test_task_list(self):
+        response = self.assert_within_budget(
+            'TaskList', 'get', "/v1/tasks", headers=self.admin_headers)
+        self.assertEqual(len(response.data['tasks']), INVITES)
+
+    def test_task_detail(self):
+        task = Task.objects.all()[0]
+        self.assert_within_budget(
+            'TaskDetail GET', 'get', "/v1/tasks/%s" % task.uuid,
+            headers=self.admin_headers)
+
+    def test_task_approve(self):
+        response = self.client.post(
+            "/v1/openstack/sign-up",
+            {'project_name': "new_project", 'email': "new@example.com"},
+            format='json', headers=self.admin_headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assert_within_budget(
+            'TaskDetail approve', 'post',
+            "/v1/tasks/%s" % response.data['task'], {'approved': True},
+            self.admin_headers)
+
+    def test_token_detail(self):
+        token = Token.objects.all()[0]
+        self.assert_within_budget(
+            'TokenDetail GET', 'get', "/v1/tokens/%s" % token.token)
+
+    def test_token_submit(self):
+        token = Token.objects.all()[0]
+        self.assert_within_budget(
+            'TokenDetail submit', 'post', "/v1/tokens/%s" % token.token,
+            {'password': "new_password"})
@@ -0,0 +1,458 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+from StringIO import StringIO
+
+import mock
+
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test.utils import override_settings
+
+from rest_framework import status
+
+from adjutant.actions.user_store import keystone_call_totals
+from adjutant.api.models import Job, Task, Token
+from adjutant.api.v1 import approvals
+from adjutant.api.v1.tests import (FakeManager, setup_temp_cache,
+                                   AdjutantAPITestCase, AdjutantTestCase)
+from adjutant.api.v1 import tests
+
+
+@mock.patch('adjutant.actions.user_store.IdentityManager',
+            FakeManager)
+class BulkInviteTests(AdjutantAPITestCase):
+
+    url = "/v1/openstack/users/bulk-invite"
+
+    headers = {
+        'project_name': "test_project",
+        'project_id': "test_project_id",
+        'roles': "project_admin,_member_,project_mod",
+        'username': "test@example.com",
+        'user_id': "test_user_id",
+        'authenticated': True
+    }
+
+    def setup_project(self):
+        project = mock.Mock()
+        project.id = 'test_project_id'
+        project.name = 'test_project'
+        project.domain = 'default'
+        project.roles = {}
+
+        setup_temp_cache({'test_project': project}, {})
+        return project
+
+    def invitees(self, count, start=0):
+        return [{'email': "test%s@example.com" % i, 'roles': ["_member_"]}
+                for i in range(start, start + count)]
+
+    def test_bulk_invite(self):
+        """
+        Each invitee gets an invite_user task, actions and token,
+        and their token email.
+        """
+        self.setup_project()
+
+        response = self.client.post(
+            self.url, {'invitees': self.invitees(3)}, format='json',
+            headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'invitees': [
+            {'email': "test%s@example.com" % i, 'status': 200,
+             'notes': ['created token']}
+            for i in range(3)]})
+
+        tasks = Task.objects.filter(task_type='invite_user')
+        self.assertEqual(tasks.count(), 3)
+        for task in tasks:
+            self.assertTrue(task.approved)
+            self.assertEqual(task.project_id, 'test_project_id')
+            self.assertEqual(
+                [action.action_name for action in task.actions],
+                ['NewUserAction'])
+            self.assertTrue(task.actions[0].valid)
+        self.assertEqual(Token.objects.count(), 3)
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            sorted(email.to[0] for email in mail.outbox),
+            ["test%s@example.com" % i for i in range(3)])
+
+        # tokens work as for single invites
+        token = Token.objects.all()[0]
+        response = self.client.post(
+            "/v1/tokens/" + token.token, {'password': 'testpassword'},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(tests.temp_cache['users']), 2)
+
+    def test_bulk_invite_admin_task_ids(self):
+        """
+        As with InviteUser, admins are given the task of each invitee.
+        """
+        self.setup_project()
+
+        headers = dict(self.headers, roles="admin,_member_")
+        response = self.client.post(
+            self.url, {'invitees': self.invitees(2)}, format='json',
+            headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        task_ids = [result['task'] for result in response.data['invitees']]
+        self.assertEqual(
+            sorted(task_ids),
+            sorted(Task.objects.values_list('uuid', flat=True)))
+
+    def test_bulk_invite_errors(self):
+        """
+        Invalid and duplicate invitees fail on their own.
+        """
+        self.setup_project()
+
+        response = self.client.post(
+            "/v1/openstack/users", self.invitees(1)[0], format='json',
+            headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        invitees = self.invitees(3)
+        invitees[1] = {'email': "not_an_email", 'roles': ["_member_"]}
+        invitees.append(self.invitees(1, start=2)[0])
+        response = self.client.post(
+            self.url, {'invitees': invitees}, format='json',
+            headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        results = response.data['invitees']
+        self.assertEqual([result['status'] for result in results],
+                         [409, 400, 200, 409])
+        self.assertEqual(
+            results[0]['errors'], ['Task is a duplicate of an existing task'])
+        self.assertEqual(
+            results[1]['errors'], {'email': ['Enter a valid email address.']})
+        self.assertEqual(Task.objects.count(), 2)
+        self.assertEqual(Token.objects.count(), 2)
+
+    def test_bulk_invite_role_permissions(self):
+        """
+        An invitee with roles the inviter can't manage isn't invited.
+        """
+        self.setup_project()
+
+        invitees = self.invitees(2)
+        invitees[0]['roles'] = ["project_admin"]
+        headers = dict(self.headers, roles="project_mod,_member_")
+        response = self.client.post(
+            self.url, {'invitees': invitees}, format='json',
+            headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        results = response.data['invitees']
+        self.assertEqual([result['status'] for result in results],
+                         [400, 200])
+        self.assertEqual(results[0]['errors'], ['actions invalid'])
+        self.assertEqual(Token.objects.count(), 1)
+
+    def test_bulk_invite_shares_lookups(self):
+        """
+        Lookups the invites have in common are made once for the batch.
+        """
+        self.setup_project()
+
+        def keystone_calls(invitees):
+            calls = keystone_call_totals()[0]
+            response = self.client.post(
+                self.url, {'invitees': invitees}, format='json',
+                headers=self.headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return keystone_call_totals()[0] - calls
+
+        single = keystone_calls(self.invitees(1))
+        batch = keystone_calls(self.invitees(10, start=1))
+        self.assertTrue(batch < 10 * single, (single, batch))
+
+    def test_bulk_invite_bad_request(self):
+        self.setup_project()
+
+        for data in [{}, {'invitees': []}, {'invitees': "test@example.com"},
+                     {'invitees': ["test@example.com"]}]:
+            response = self.client.post(
+                self.url, data, format='json', headers=self.headers)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with override_settings(BULK_INVITE_MAX_USERS=2):
+            response = self.client.post(
+                self.url, {'invitees': self.invitees(3)}, format='json',
+                headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data,
+            {'errors': ["At most 2 users can be invited at once."]})
+        self.assertEqual(Task.objects.count(), 0)
+
+    def test_bulk_invite_requires_project_admin(self):
+        self.setup_project()
+
+        headers = dict(self.headers, roles="_member_")
+        response = self.client.post(
+            self.url, {'invitees': self.invitees(1)}, format='json',
+            headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@mock.patch('adjutant.actions.user_store.IdentityManager',
+            FakeManager)
+@override_settings(BULK_APPROVE_CONCURRENCY=1, BULK_APPROVE_RATE=0)
+class BulkApproveTests(AdjutantAPITestCase):
+
+    url = "/v1/tasks/bulk-approve"
+
+    headers = {
+        'project_name': "test_project",
+        'project_id': "test_project_id",
+        'roles': "admin,_member_",
+        'username': "test@example.com",
+        'user_id': "test_user_id",
+        'authenticated': True
+    }
+
+    def create_projects(self, count, start=0):
+        setup_temp_cache({}, {})
+        for i in range(start, start + count):
+            response = self.client.post(
+                "/v1/actions/CreateProject",
+                {'project_name': "test_project_%s" % i,
+                 'email': "test%s@example.com" % i},
+                format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return list(Task.objects.order_by('created_on').values_list(
+            'uuid', flat=True))
+
+    def test_bulk_approve(self):
+        """
+        Each task is approved and issues its token, as when approved
+        on its own.
+        """
+        task_uuids = self.create_projects(3)
+
+        response = self.client.post(
+            self.url, {'approved': True, 'tasks': task_uuids},
+            format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'tasks': [
+            {'task': uuid, 'status': 200, 'notes': ['created token']}
+            for uuid in task_uuids]})
+
+        for task in Task.objects.all():
+            self.assertTrue(task.approved)
+            self.assertEqual(task.approved_by['username'],
+                             "test@example.com")
+        self.assertEqual(Token.objects.count(), 3)
+        # an initial and a token email for each
+        self.assertEqual(len(mail.outbox), 6)
+
+    def test_bulk_approve_errors(self):
+        """
+        Tasks that can't be approved fail on their own, in order.
+        """
+        task_uuids = self.create_projects(4)
+        Task.objects.filter(uuid=task_uuids[0]).update(completed=True)
+        Task.objects.filter(uuid=task_uuids[1]).update(cancelled=True)
+        response = self.client.post(
+            "/v1/tasks/" + task_uuids[2], {'approved': True},
+            format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(
+            self.url, {'approved': True, 'tasks': task_uuids + ["missing"]},
+            format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['tasks']
+        self.assertEqual([result['task'] for result in results],
+                         task_uuids + ["missing"])
+        self.assertEqual([result['status'] for result in results],
+                         [400, 400, 409, 200, 404])
+        self.assertEqual(
+            results[2]['errors'], ['This task has already been approved.'])
+        self.assertEqual(Token.objects.count(), 2)
+
+    def test_bulk_approve_filters(self):
+        """
+        Filters approve every matching task still waiting for approval.
+        """
+        task_uuids = self.create_projects(3)
+        response = self.client.post(
+            "/v1/tasks/" + task_uuids[0], {'approved': True},
+            format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(
+            self.url,
+            {'approved': True,
+             'filters': {'task_type': {'exact': "create_project"}}},
+            format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result['task'] for result in response.data['tasks']],
+            task_uuids[1:])
+        self.assertEqual(Token.objects.count(), 3)
+
+        with override_settings(BULK_APPROVE_MAX_TASKS=1):
+            self.create_projects(2, start=3)
+            response = self.client.post(
+                self.url,
+                {'approved': True,
+                 'filters': {'task_type': {'exact': "create_project"}}},
+                format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data,
+            {'errors': ["At most 1 tasks can be approved at once."]})
+
+    @override_settings(BULK_APPROVE_MAX_SYNC_TASKS=2)
+    def test_bulk_approve_sync_limit(self):
+        """
+        Without ASYNC_STAGES fewer tasks can be approved a request, as
+        each post_approve is run in the request.
+        """
+        task_uuids = self.create_projects(3)
+
+        response = self.client.post(
+            self.url, {'approved': True, 'tasks': task_uuids},
+            format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data,
+            {'errors': ["At most 2 tasks can be approved at once."]})
+        self.assertEqual(Task.objects.filter(approved=True).count(), 0)
+
+        with override_settings(ASYNC_STAGES=True):
+            response = self.client.post(
+                self.url, {'approved': True, 'tasks': task_uuids},
+                format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in
+                          response.data['tasks']], [202, 202, 202])
+
+    @override_settings(ASYNC_STAGES=True)
+    def test_bulk_approve_async(self):
+        """
+        With ASYNC_STAGES each task's post_approve is queued as a job.
+        """
+        task_uuids = self.create_projects(2)
+
+        response = self.client.post(
+            self.url, {'approved': True, 'tasks': task_uuids},
+            format='json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in
+                          response.data['tasks']], [202, 202])
+        self.assertEqual(Job.objects.filter(stage='post_approve').count(), 2)
+        self.assertEqual(Token.objects.count(), 0)
+
+    def test_bulk_approve_bad_request(self):
+        task_uuids = self.create_projects(1)
+
+        for data in [{'tasks': task_uuids},
+                     {'approved': True},
+                     {'approved': True, 'tasks': task_uuids, 'filters': {}},
+                     {'approved': True, 'tasks': task_uuids[0]},
+                     {'approved': True, 'filters': ["task_type"]},
+                     {'approved': True,
+                      'filters': {'not_a_field': {'exact': "value"}}},
+                     {'approved': True,
+                      'filters': {'created_on': {'lt': "notadate"}}}]:
+            response = self.client.post(
+                self.url, data, format='json', headers=self.headers)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST, data)
+        self.assertFalse(Task.objects.get(uuid=task_uuids[0]).approved)
+
+        headers = dict(self.headers, roles="project_admin,_member_")
+        response = self.client.post(
+            self.url, {'approved': True, 'tasks': task_uuids},
+            format='json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_approve_tasks_command(self):
+        task_uuids = self.create_projects(2)
+
+        out = StringIO()
+        call_command(
+            'approve_tasks',
+            filters='{"task_type": {"exact": "create_project"}}',
+            approver="operator", stdout=out)
+        self.assertIn("Approved 2 tasks, 0 failed.", out.getvalue())
+        for task in Task.objects.filter(uuid__in=task_uuids):
+            self.assertEqual(task.approved_by, {'username': "operator"})
+        self.assertEqual(Token.objects.count(), 2)
+
+        out = StringIO()
+        call_command('approve_tasks', task_uuids[0], stdout=out)
+        self.assertIn("%s 409" % task_uuids[0], out.getvalue())
+        self.assertIn("Approved 0 tasks, 1 failed.", out.getvalue())
+
+        self.assertRaises(
+            CommandError, call_command, 'approve_tasks',
+            filters='{"created_on": {"lt": "notadate"}}')
+
+
+class ApprovalPoolTests(AdjutantTestCase):
+
+    def test_approve_tasks_pool(self):
+        """
+        Tasks are approved on at most 'concurrency' threads at once,
+        with their results kept in order.
+        """
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def fake_approve(uuid, approved_by, pacer):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return {'notes': [uuid]}, 200
+
+        task_uuids = ["task%s" % i for i in range(12)]
+        with mock.patch('adjutant.api.v1.approvals.approve_task',
+                        fake_approve):
+            results = approvals.approve_tasks(
+                task_uuids, {}, concurrency=3, rate=0)
+        self.assertEqual([result['notes'] for result in results],
+                         [[uuid] for uuid in task_uuids])
+        self.assertTrue(1 < running[1] <= 3, running[1])
+
+    def test_pacer(self):
+        """
+        Callers are spaced out to the rate, however many there are.
+        """
+        with mock.patch('adjutant.api.v1.approvals.time') as fake_time:
+            fake_time.time.return_value = 100.0
+            pacer = approvals.Pacer(4)
+            for i in range(3):
+                pacer.wait()
+            self.assertEqual(
+                fake_time.sleep.call_args_list,
+                [mock.call(0.25), mock.call(0.5)])
+
+            fake_time.sleep.reset_mock()
+            approvals.Pacer(0).wait()
+            self.assertFalse(fake_time.sleep.called)
@@ -0,0 +1,286 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from datetime import timedelta
+from StringIO import StringIO
+
+import mock
+
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from rest_framework import status
+
+from adjutant.api.models import Job, Notification, Task, Token
+from adjutant.api.v1 import jobs
+from adjutant.api.v1.tests import (FakeManager, setup_temp_cache,
+                                   AdjutantAPITestCase)
+from adjutant.api.v1 import tests
+
+
+@mock.patch('adjutant.actions.user_store.IdentityManager',
+            FakeManager)
+@override_settings(ASYNC_STAGES=True)
+class JobTests(AdjutantAPITestCase):
+    """
+    Tests for running the post_approve and submit stages in a job worker.
+    """
+
+    admin_headers = {
+        'project_name': "test_project",
+        'project_id': "test_project_id",
+        'roles': "admin,_member_",
+        'username': "test@example.com",
+        'user_id': "test_user_id",
+        'authenticated': True
+    }
+
+    def run_worker(self):
+        out = StringIO()
+        call_command('process_jobs', once=True, stdout=out)
+        return out.getvalue()
+
+    def test_new_project_async(self):
+        """
+        Approval and token submission are queued, and only run when
+        the worker processes them.
+        """
+        setup_temp_cache({}, {})
+
+        url = "/v1/actions/CreateProject"
+        data = {'project_name': "test_project", 'email': "test@example.com"}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        new_task = Task.objects.all()[0]
+        url = "/v1/tasks/" + new_task.uuid
+        response = self.client.post(url, {'approved': True}, format='json',
+                                    headers=self.admin_headers)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['notes'], ['Task queued.'])
+        job_id = response.data['job']
+
+        # nothing has been done yet
+        self.assertEqual(Token.objects.count(), 0)
+        self.assertNotIn('test_project', tests.temp_cache['projects'])
+
+        response = self.client.get(
+            "/v1/jobs/" + job_id, headers=self.admin_headers)
+        self.assertEqual(response.data['state'], 'queued')
+
+        self.assertIn("Processed 1 jobs.", self.run_worker())
+
+        self.assertIn('test_project', tests.temp_cache['projects'])
+        response = self.client.get(
+            "/v1/jobs/" + job_id, headers=self.admin_headers)
+        self.assertEqual(response.data['state'], 'completed')
+        self.assertEqual(response.data['status_code'], 200)
+        self.assertEqual(response.data['result'],
+                         {'notes': ['created token']})
+
+        new_token = Token.objects.all()[0]
+        url = "/v1/tokens/" + new_token.token
+        response = self.client.post(
+            url, {'password': 'testpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = response.data['job']
+
+        # password isn't stored once the job has been run
+        self.assertEqual(
+            Job.objects.get(uuid=job_id).data, {'password': 'testpassword'})
+
+        # resubmitting while queued is rejected
+        response = self.client.post(
+            url, {'password': 'testpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.run_worker()
+
+        job = Job.objects.get(uuid=job_id)
+        self.assertEqual(job.state, 'completed')
+        self.assertEqual(job.data, {})
+        self.assertTrue(Task.objects.get(uuid=new_task.uuid).completed)
+        self.assertEqual(Token.objects.count(), 0)
+
+    def test_auto_approved_async(self):
+        """
+        Auto approved tasks queue their approval, and return the job id
+        to admins.
+        """
+        project = mock.Mock()
+        project.id = 'test_project_id'
+        project.name = 'test_project'
+        project.domain = 'default'
+        project.roles = {}
+
+        setup_temp_cache({'test_project': project}, {})
+
+        url = "/v1/actions/InviteUser"
+        data = {'email': "test@example.com", 'roles': ["_member_"],
+                'project_id': 'test_project_id'}
+        response = self.client.post(url, data, format='json',
+                                    headers=self.admin_headers)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['notes'], ['Task queued.'])
+        self.assertIn('job', response.data)
+        self.assertEqual(Token.objects.count(), 0)
+
+        self.run_worker()
+        self.assertEqual(Token.objects.count(), 1)
+
+    def test_job_failure(self):
+        """
+        A stage that errors fails its job and raises a notification.
+        """
+        setup_temp_cache({}, {})
+
+        url = "/v1/actions/CreateProject"
+        data = {'project_name': "test_project", 'email': "test@example.com"}
+        response = self.client.post(url, data, format='json')
+
+        new_task = Task.objects.all()[0]
+        url = "/v1/tasks/" + new_task.uuid
+        response = self.client.post(url, {'approved': True}, format='json',
+                                    headers=self.admin_headers)
+        job_id = response.data['job']
+
+        with mock.patch(
+                'adjutant.actions.v1.projects.'
+                'NewProjectWithUserAction._post_approve',
+                side_effect=Exception("Boom")):
+            self.run_worker()
+
+        job = Job.objects.get(uuid=job_id)
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(job.status_code, 500)
+        self.assertEqual(
+            Notification.objects.filter(task=new_task, error=True).count(),
+            1)
+
+    def test_claim_abandoned_job(self):
+        """
+        Jobs that have been running too long are claimed again, until
+        they run out of attempts.
+        """
+        task = Task.objects.create(ip_address="0.0.0.0", keystone_user={})
+        job = jobs.enqueue(task, 'post_approve')
+
+        claimed = jobs.claim_job('worker_1')
+        self.assertEqual(claimed.uuid, job.uuid)
+        self.assertEqual(claimed.attempts, 1)
+        # no one else can claim it while it's running
+        self.assertIsNone(jobs.claim_job('worker_2'))
+
+        with override_settings(JOB_TIMEOUT=0, JOB_MAX_ATTEMPTS=2):
+            Job.objects.filter(uuid=job.uuid).update(
+                started_on=timezone.now() - timedelta(seconds=1))
+            claimed = jobs.claim_job('worker_2')
+            self.assertEqual(claimed.worker, 'worker_2')
+            self.assertEqual(claimed.attempts, 2)
+
+            Job.objects.filter(uuid=job.uuid).update(
+                started_on=timezone.now() - timedelta(seconds=1))
+            self.assertIsNone(jobs.claim_job('worker_3'))
+
+        job = Job.objects.get(uuid=job.uuid)
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(job.data, {})
+
+    def test_unknown_job(self):
+        response = self.client.get(
+            "/v1/jobs/notajob", headers=self.admin_headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_job_requires_auth(self):
+        """
+        Jobs can't be read without authenticating, and project mods
+        only see the jobs of their own project's tasks.
+        """
+        task = Task.objects.create(
+            ip_address="0.0.0.0", keystone_user={},
+            project_id='other_project_id')
+        job = jobs.enqueue(task, 'post_approve')
+
+        response = self.client.get("/v1/jobs/" + job.uuid)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        headers = dict(self.admin_headers, roles="project_mod,_member_")
+        response = self.client.get("/v1/jobs/" + job.uuid, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        headers['project_id'] = 'other_project_id'
+        response = self.client.get("/v1/jobs/" + job.uuid, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_one_active_job_per_stage(self):
+        """
+        Queueing a stage that already has an active job returns that
+        job, and the stage can be queued again once it has finished.
+        """
+        task = Task.objects.create(ip_address="0.0.0.0", keystone_user={})
+        job = jobs.enqueue(task, 'post_approve')
+
+        self.assertEqual(jobs.enqueue(task, 'post_approve').uuid, job.uuid)
+        self.assertEqual(Job.objects.filter(task=task).count(), 1)
+
+        Job.objects.filter(uuid=job.uuid).update(
+            state='completed', active_key=None)
+        self.assertNotEqual(
+            jobs.enqueue(task, 'post_approve').uuid, job.uuid)
+        self.assertEqual(Job.objects.filter(task=task).count(), 2)
+
+    def test_cancelled_while_queued(self):
+        """
+        A task cancelled while its job is queued isn't run.
+        """
+        task = Task.objects.create(
+            ip_address="0.0.0.0", keystone_user={}, approved=True)
+        job = jobs.enqueue(task, 'post_approve')
+        Task.objects.filter(uuid=task.uuid).update(cancelled=True)
+
+        with mock.patch.object(jobs, 'post_approve_task') as post_approve:
+            self.run_worker()
+            self.assertFalse(post_approve.called)
+
+        job = Job.objects.get(uuid=job.uuid)
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(
+            job.result, {'errors': ['This task has been cancelled.']})
+
+    def test_job_error_escapes_stage(self):
+        """
+        A job whose error handling itself errors is failed, and the
+        worker carries on with the next job.
+        """
+        first = Task.objects.create(
+            ip_address="0.0.0.0", keystone_user={}, approved=True)
+        second = Task.objects.create(
+            ip_address="0.0.0.0", keystone_user={}, approved=True)
+        first_job = jobs.enqueue(first, 'post_approve')
+        second_job = jobs.enqueue(second, 'post_approve')
+
+        with mock.patch.object(
+                jobs, 'post_approve_task', side_effect=Exception("Boom")):
+            with mock.patch.object(
+                    jobs, 'create_notification',
+                    side_effect=Exception("Notification failed")):
+                out = self.run_worker()
+
+        self.assertIn("Processed 2 jobs.", out)
+        for job in (first_job, second_job):
+            job = Job.objects.get(uuid=job.uuid)
+            self.assertEqual(job.state, 'failed')
+            self.assertEqual(job.status_code, 500)
+            self.assertIsNone(job.active_key)
@@ -111,6 +111,45 @@ class OpenstackAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['users']), 2)
 
+    def test_keystone_calls_header(self):
+        """
+        With DEBUG on, the Keystone calls made by a request are returned
+        in a header.
+        """
+        project = mock.Mock()
+        project.id = 'test_project_id'
+        project.name = 'test_project'
+        project.domain = 'default'
+        project.roles = {'user_id': ['_member_']}
+
+        user = mock.Mock()
+        user.id = 'user_id'
+        user.name = "test@example.com"
+        user.email = "test@example.com"
+        user.domain = 'default'
+
+        setup_temp_cache({'test_project': project}, {user.id: user})
+
+        url = "/v1/openstack/users"
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "project_admin,_member_,project_mod",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('X-Adjutant-Keystone-Calls'))
+
+        with override_settings(DEBUG=True):
+            response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        calls, duration = response['X-Adjutant-Keystone-Calls'].split('; ')
+        self.assertTrue(int(calls) > 0)
+        self.assertTrue(duration.endswith('ms'))
+
     def test_user_list_managable(self):
         """
         Confirm that the manageable value is set correctly.
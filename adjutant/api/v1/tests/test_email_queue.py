@@ -0,0 +1,179 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from datetime import timedelta
+from smtplib import SMTPException
+
+import mock
+
+from django.core import mail
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from rest_framework import status
+
+from adjutant.api.models import Notification, QueuedEmail, Task, Token
+from adjutant.api.v1.email_queue import (
+    EmailSender, claim_emails, email_queue_metrics)
+from adjutant.api.v1.tests import (
+    AdjutantAPITestCase, FakeManager, setup_temp_cache)
+
+
+@override_settings(EMAIL_QUEUE=True)
+@mock.patch('adjutant.actions.user_store.IdentityManager',
+            FakeManager)
+class EmailQueueTests(AdjutantAPITestCase):
+
+    def setUp(self):
+        user = mock.Mock()
+        user.id = 'user_id'
+        user.name = "test@example.com"
+        user.email = "test@example.com"
+        user.domain = 'default'
+        user.password = "test_password"
+        self.user = user
+        setup_temp_cache({}, {user.id: user})
+
+    def reset_password(self):
+        url = "/v1/actions/ResetPassword"
+        data = {'email': "test@example.com"}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_email_queued(self):
+        """
+        Token emails are queued by the request, and only sent
+        by the email sender.
+        """
+        self.reset_password()
+
+        self.assertEqual(len(mail.outbox), 0)
+        queued = QueuedEmail.objects.get()
+        self.assertEqual(queued.state, 'queued')
+        self.assertEqual(queued.to, ["test@example.com"])
+        self.assertEqual(queued.description, "token email")
+        self.assertEqual(email_queue_metrics()['queue_depth'], 1)
+
+        self.assertEqual(EmailSender('test').send_batch(), (1, 0))
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, queued.subject)
+        self.assertEqual(mail.outbox[0].to, ["test@example.com"])
+        self.assertTrue(Token.objects.get().token in mail.outbox[0].body)
+
+        queued = QueuedEmail.objects.get()
+        self.assertEqual(queued.state, 'sent')
+        self.assertEqual(queued.attempts, 1)
+        self.assertEqual(
+            queued.task.action_notes['QueuedEmail'],
+            ["Sent token email to test@example.com."])
+        self.assertEqual(email_queue_metrics()['queue_depth'], 0)
+
+        # nothing left to send
+        self.assertEqual(EmailSender('test').send_batch(), (0, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_sent_note_keeps_task(self):
+        """
+        Noting a sent email doesn't write back the task as it was when
+        the email was claimed, undoing changes made since.
+        """
+        self.reset_password()
+
+        claimed = claim_emails('test', 1)
+        Task.objects.filter(uuid=claimed[0].task.uuid).update(cancelled=True)
+
+        with mock.patch('adjutant.api.v1.email_queue.claim_emails',
+                        return_value=claimed):
+            self.assertEqual(EmailSender('test').send_batch(), (1, 0))
+
+        task = Task.objects.get(uuid=claimed[0].task.uuid)
+        self.assertTrue(task.cancelled)
+        self.assertEqual(
+            task.action_notes['QueuedEmail'],
+            ["Sent token email to test@example.com."])
+
+    def test_connection_reused(self):
+        """
+        A sender uses one connection for all the emails it sends.
+        """
+        self.reset_password()
+        Token.objects.all().delete()
+        self.reset_password()
+
+        email_sender = EmailSender('test')
+        with mock.patch('adjutant.api.v1.email_queue.get_connection',
+                        wraps=mail.get_connection) as get_connection:
+            self.assertEqual(email_sender.send_batch(), (2, 0))
+            self.assertEqual(email_sender.send_batch(), (0, 0))
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    @override_settings(EMAIL_MAX_ATTEMPTS=2, EMAIL_RETRY_DELAY=30)
+    def test_retry_then_fail(self):
+        """
+        Failed sends are retried later, then given up on with an
+        error notification once out of attempts.
+        """
+        self.reset_password()
+
+        connection = mock.Mock()
+        connection.send_messages.side_effect = SMTPException("Down")
+        email_sender = EmailSender('test')
+        with mock.patch('adjutant.api.v1.email_queue.get_connection',
+                        return_value=connection):
+            self.assertEqual(email_sender.send_batch(), (0, 1))
+
+            queued = QueuedEmail.objects.get()
+            self.assertEqual(queued.state, 'queued')
+            self.assertEqual(queued.attempts, 1)
+            self.assertEqual(queued.last_error, "Down")
+            self.assertTrue(queued.next_attempt_on > timezone.now())
+            # the failed connection isn't reused
+            self.assertTrue(connection.close.called)
+            self.assertEqual(email_sender.connection, None)
+
+            # not due yet
+            self.assertEqual(email_sender.send_batch(), (0, 0))
+
+            QueuedEmail.objects.update(next_attempt_on=timezone.now())
+            self.assertEqual(email_sender.send_batch(), (0, 1))
+
+        queued = QueuedEmail.objects.get()
+        self.assertEqual(queued.state, 'failed')
+        self.assertEqual(queued.attempts, 2)
+        self.assertEqual(email_queue_metrics()['failed'], 1)
+
+        notification = Notification.objects.get(error=True)
+        self.assertEqual(
+            notification.notes['errors'],
+            "Error: 'Down' while sending token email for task: %s"
+            % queued.task.uuid)
+        self.assertEqual(len(queued.task.action_notes['QueuedEmail']), 1)
+
+    def test_lost_email_reclaimed(self):
+        """
+        Emails left sending by a sender which died are claimed again
+        once EMAIL_SEND_TIMEOUT has passed.
+        """
+        self.reset_password()
+
+        self.assertEqual(len(claim_emails('first', 10)), 1)
+        self.assertEqual(claim_emails('second', 10), [])
+
+        QueuedEmail.objects.update(
+            claimed_on=timezone.now() - timedelta(hours=1))
+        claimed = claim_emails('second', 10)
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claimed[0].sender, 'second')
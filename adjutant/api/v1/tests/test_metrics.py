@@ -0,0 +1,139 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from keystoneauth1 import session
+
+from rest_framework import status
+
+from adjutant import metrics
+from adjutant.actions.openstack_clients import InstrumentedSession
+from adjutant.api.v1.tests import (
+    AdjutantAPITestCase, FakeManager, setup_temp_cache)
+
+
+@mock.patch('adjutant.actions.user_store.IdentityManager',
+            FakeManager)
+class MetricsViewTests(AdjutantAPITestCase):
+
+    def setUp(self):
+        user = mock.Mock()
+        user.id = 'user_id'
+        user.name = "test@example.com"
+        user.email = "test@example.com"
+        user.domain = 'default'
+        user.password = "test_password"
+        setup_temp_cache({}, {user.id: user})
+
+    def test_disabled(self):
+        """
+        Metrics aren't served unless enabled.
+        """
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(METRICS_ENABLED=True, METRICS_REFRESH_INTERVAL=0)
+    def test_metrics(self):
+        """
+        Requests, action stages, emails and tasks show up in the metrics.
+        """
+        request_labels = {
+            'view': 'ResetPassword', 'method': 'POST', 'status': 200}
+        stage_labels = {
+            'action': 'ResetUserPasswordAction', 'stage': 'pre_approve',
+            'result': 'ok'}
+        email_labels = {'mode': 'inline', 'result': 'ok'}
+        requests = metrics.request_duration.count(**request_labels)
+        stages = metrics.stage_duration.count(**stage_labels)
+        emails = metrics.email_send_duration.count(**email_labels)
+
+        url = "/v1/actions/ResetPassword"
+        data = {'email': "test@example.com"}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(
+            metrics.request_duration.count(**request_labels), requests + 1)
+        self.assertEqual(
+            metrics.stage_duration.count(**stage_labels), stages + 1)
+        self.assertEqual(
+            metrics.email_send_duration.count(**email_labels), emails + 1)
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response['Content-Type'], 'text/plain; version=0.0.4')
+        content = response.content.decode('utf-8')
+        self.assertIn(
+            '# TYPE adjutant_request_duration_seconds histogram', content)
+        self.assertIn(
+            'adjutant_request_duration_seconds_count{view="ResetPassword",'
+            'method="POST",status="200"} %s' % repr(float(requests + 1)),
+            content)
+        self.assertIn('adjutant_tasks{state="approved"} 1.0', content)
+        self.assertIn(
+            'adjutant_cache_requests{cache="templates",outcome="misses"}',
+            content)
+
+
+class MetricTests(SimpleTestCase):
+
+    def setUp(self):
+        self.histogram = metrics.Histogram(
+            'test_duration_seconds', "Test.", ['name'], buckets=[0.1, 1])
+        self.addCleanup(metrics.registry.remove, self.histogram)
+
+    def test_histogram(self):
+        """
+        Histograms have cumulative buckets, a sum and a count.
+        """
+        self.histogram.observe(0.05, name='a')
+        self.histogram.observe(0.5, name='a')
+        self.histogram.observe(5, name='a')
+
+        self.assertEqual(self.histogram.render().split('\n'), [
+            '# HELP test_duration_seconds Test.',
+            '# TYPE test_duration_seconds histogram',
+            'test_duration_seconds_bucket{name="a",le="0.1"} 1.0',
+            'test_duration_seconds_bucket{name="a",le="1.0"} 2.0',
+            'test_duration_seconds_bucket{name="a",le="+Inf"} 3.0',
+            'test_duration_seconds_sum{name="a"} 5.55',
+            'test_duration_seconds_count{name="a"} 3.0',
+        ])
+
+    def test_instrumented_session(self):
+        """
+        OpenStack calls are timed by service, method and result.
+        """
+        ok = metrics.openstack_call_duration.count(
+            service='compute', method='GET', result='ok')
+        errors = metrics.openstack_call_duration.count(
+            service='compute', method='GET', result='error')
+
+        with mock.patch.object(session.Session, 'request') as request:
+            request.return_value.status_code = 200
+            InstrumentedSession().request(
+                '/servers', 'GET', endpoint_filter={'service_type': 'compute'})
+            request.return_value.status_code = 404
+            InstrumentedSession().request(
+                '/servers', 'GET', endpoint_filter={'service_type': 'compute'})
+
+        self.assertEqual(metrics.openstack_call_duration.count(
+            service='compute', method='GET', result='ok'), ok + 1)
+        self.assertEqual(metrics.openstack_call_duration.count(
+            service='compute', method='GET', result='error'), errors + 1)
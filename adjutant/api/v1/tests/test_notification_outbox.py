@@ -0,0 +1,207 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from datetime import timedelta
+from threading import Lock
+
+import mock
+
+from django.conf import settings
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from rest_framework import status
+
+from adjutant.api.models import Notification, NotificationDelivery, Task
+from adjutant.api.v1.tests import AdjutantAPITestCase, modify_dict_settings
+from adjutant.api.v1.utils import create_notification
+from adjutant.notifications import outbox
+from adjutant.notifications.models import NotificationEngine
+
+
+class FakeDeliveryError(Exception):
+    pass
+
+
+class FakeEngine(NotificationEngine):
+    """ Engine which records what it sends, and can be made to fail. """
+
+    delivery_errors = (FakeDeliveryError, )
+
+    lock = Lock()
+    sent = []
+    failures = 0
+
+    def _notify(self, task, notification):
+        with self.lock:
+            if FakeEngine.failures:
+                FakeEngine.failures -= 1
+                raise FakeDeliveryError("Unreachable")
+            FakeEngine.sent.append((self.conf['queue'], notification.uuid))
+
+
+@override_settings(NOTIFICATION_OUTBOX=True)
+@modify_dict_settings(TASK_SETTINGS=[
+    {'key_list': ['invite_user'],
+     'operation': 'update',
+     'value': {'notifications': {
+         'FakeEngine': {
+             'standard': {'queue': 'standard'},
+             'error': {'queue': 'errors'},
+         }}}},
+])
+class NotificationOutboxTests(AdjutantAPITestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(
+            settings.NOTIFICATION_ENGINES, {'FakeEngine': FakeEngine})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        FakeEngine.sent = []
+        FakeEngine.failures = 0
+        self.task = Task.objects.create(
+            ip_address="0.0.0.0", keystone_user={},
+            task_type='invite_user')
+
+    def test_delivered_by_dispatcher(self):
+        """
+        Engines aren't run when the notification is created, only
+        when the dispatcher delivers it.
+        """
+        notification = create_notification(self.task, {'notes': ['test']})
+        self.assertEqual(FakeEngine.sent, [])
+        delivery = NotificationDelivery.objects.get(
+            notification=notification)
+        self.assertEqual(delivery.engine, 'FakeEngine')
+        self.assertEqual(delivery.state, 'pending')
+
+        self.assertEqual(outbox.dispatch('test'), (1, 0))
+        self.assertEqual(FakeEngine.sent, [('standard', notification.uuid)])
+        delivery = NotificationDelivery.objects.get(uuid=delivery.uuid)
+        self.assertEqual(delivery.state, 'delivered')
+        self.assertEqual(delivery.attempts, 1)
+
+        # nothing left to deliver
+        self.assertEqual(outbox.dispatch('test'), (0, 0))
+
+    def test_rolled_back_with_notification(self):
+        """
+        Deliveries are written in the same transaction as their
+        notification.
+        """
+        with mock.patch.object(
+                NotificationDelivery.objects, 'create',
+                side_effect=Exception("Boom")):
+            with self.assertRaises(Exception):
+                create_notification(self.task, {'notes': ['test']})
+        self.assertEqual(Notification.objects.count(), 0)
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=3,
+                       NOTIFICATION_RETRY_DELAY=10)
+    def test_retry_with_backoff(self):
+        """
+        Failed deliveries are retried later, with the delay doubling,
+        and an error notification is raised when they are given up on.
+        """
+        FakeEngine.failures = 3
+        notification = create_notification(self.task, {'notes': ['test']})
+        delivery = NotificationDelivery.objects.get(
+            notification=notification)
+
+        delays = []
+        for attempt in range(3):
+            start = timezone.now()
+            self.assertEqual(outbox.dispatch('test'), (0, 1))
+            delivery = NotificationDelivery.objects.get(uuid=delivery.uuid)
+            delays.append(
+                int(round((delivery.next_attempt_on - start).total_seconds())))
+            # not due again yet
+            self.assertEqual(outbox.dispatch('test'), (0, 0))
+            NotificationDelivery.objects.filter(uuid=delivery.uuid).update(
+                next_attempt_on=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(delays[:2], [10, 20])
+        self.assertEqual(delivery.state, 'failed')
+        self.assertEqual(delivery.last_error, "Unreachable")
+        self.assertEqual(FakeEngine.sent, [])
+
+        error = Notification.objects.get(error=True)
+        self.assertEqual(
+            error.notes,
+            {'errors': ["Error: 'Unreachable' while sending notification"]})
+
+    def test_concurrent_delivery(self):
+        notifications = [
+            create_notification(self.task, {'notes': ['test %s' % i]})
+            for i in range(5)]
+        create_notification(self.task, {'notes': ['error']}, error=True)
+
+        self.assertEqual(outbox.dispatch('test', concurrency=3), (6, 0))
+        self.assertEqual(len(FakeEngine.sent), 6)
+        self.assertEqual(
+            set(uuid for queue, uuid in FakeEngine.sent
+                if queue == 'standard'),
+            set(notification.uuid for notification in notifications))
+
+    def test_claimed_once(self):
+        create_notification(self.task, {'notes': ['test']})
+        self.assertEqual(len(outbox.claim_deliveries('first', 10)), 1)
+        self.assertEqual(outbox.claim_deliveries('second', 10), [])
+
+    def test_lost_delivery_claimed_once(self):
+        """
+        Of two dispatchers which found the same lost delivery, only
+        one claims it.
+        """
+        create_notification(self.task, {'notes': ['test']})
+        outbox.claim_deliveries('lost', 10)
+        NotificationDelivery.objects.update(
+            claimed_on=timezone.now() - timedelta(hours=1))
+
+        now = timezone.now()
+        found = [list(outbox.outbox.due(now)), list(outbox.outbox.due(now))]
+        with mock.patch.object(outbox.outbox, 'due', side_effect=found):
+            self.assertEqual(len(outbox.claim_deliveries('first', 10)), 1)
+            self.assertEqual(outbox.claim_deliveries('second', 10), [])
+        self.assertEqual(
+            NotificationDelivery.objects.get().dispatcher, 'first')
+
+    def test_metrics(self):
+        for i in range(3):
+            create_notification(self.task, {'notes': ['test']})
+        NotificationDelivery.objects.update(
+            created_on=timezone.now() - timedelta(seconds=60))
+
+        metrics = outbox.outbox_metrics()
+        self.assertEqual(metrics['queue_depth'], 3)
+        self.assertEqual(metrics['pending'], 3)
+        self.assertGreaterEqual(metrics['delivery_lag'], 60)
+
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "admin,_member_",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+        response = self.client.get('/v1/status', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data['notification_outbox']['queue_depth'], 3)
+
+        outbox.dispatch('test')
+        metrics = outbox.outbox_metrics()
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertEqual(metrics['delivery_lag'], 0)
@@ -0,0 +1,120 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from adjutant.api.models import Notification, Task
+from adjutant.api.v1 import utils
+from adjutant.api.v1.tests import AdjutantTestCase, modify_dict_settings
+from adjutant.notifications.request_tracker import models as rt_models
+
+
+RT_CONF = {
+    'url': 'http://localhost/rt/REST/1.0/',
+    'queue': 'helpdesk',
+    'username': 'example@example.com',
+    'password': 'password',
+    'template': 'notification.txt',
+}
+
+
+def rt_response(status_int):
+    response = mock.Mock()
+    response.status_int = status_int
+    response.status = "%s Status" % status_int
+    return response
+
+
+@modify_dict_settings(TASK_SETTINGS=[
+    {'key_list': ['invite_user'],
+     'operation': 'update',
+     'value': {'notifications': {
+         'RTNotification': {
+             'standard': RT_CONF,
+             'error': RT_CONF,
+         }}}},
+])
+class RTNotificationTests(AdjutantTestCase):
+
+    def setUp(self):
+        utils.engine_cache.clear()
+        self.addCleanup(utils.engine_cache.clear)
+        patcher = mock.patch.object(rt_models, 'RTResource')
+        self.RTResource = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tracker = self.RTResource.return_value
+        self.task = Task.objects.create(
+            ip_address="0.0.0.0", keystone_user={},
+            task_type='invite_user')
+
+    def test_engine_reused(self):
+        """
+        One RT session is created and reused for every notification
+        with the same conf.
+        """
+        self.tracker.post.return_value = rt_response(200)
+
+        for i in range(3):
+            utils.create_notification(self.task, {'notes': ["Note"]})
+
+        self.assertEqual(self.RTResource.call_count, 1)
+        self.assertEqual(self.tracker.post.call_count, 3)
+        self.assertEqual(
+            Notification.objects.filter(acknowledged=True).count(), 3)
+
+    def test_expired_session(self):
+        """
+        An expired session logs in again with a new tracker, and the
+        ticket is retried.
+        """
+        expired = mock.Mock()
+        expired.post.return_value = rt_response(401)
+        self.tracker.post.return_value = rt_response(200)
+        self.RTResource.side_effect = [expired, self.tracker]
+
+        utils.create_notification(self.task, {'notes': ["Note"]})
+
+        self.assertEqual(self.RTResource.call_count, 2)
+        self.assertEqual(expired.post.call_count, 1)
+        self.assertEqual(self.tracker.post.call_count, 1)
+        self.assertEqual(Notification.objects.filter(error=True).count(), 0)
+
+    def test_expired_session_renewed_once(self):
+        """
+        A tracker already replaced by another thread isn't replaced
+        again.
+        """
+        expired = mock.Mock()
+        self.RTResource.side_effect = [expired, self.tracker]
+        engine = utils.get_engine('RTNotification', RT_CONF)
+
+        self.assertIs(engine._renew_tracker(expired), self.tracker)
+        self.assertIs(engine._renew_tracker(expired), self.tracker)
+        self.assertEqual(self.RTResource.call_count, 2)
+
+    def test_ticket_failed(self):
+        """
+        A ticket RT refuses to create is recorded as an error.
+        """
+        self.tracker.post.return_value = rt_response(500)
+
+        notification = utils.create_notification(
+            self.task, {'notes': ["Note"]})
+
+        self.assertFalse(Notification.objects.get(
+            uuid=notification.uuid).acknowledged)
+        error = Notification.objects.get(error=True)
+        self.assertEqual(
+            error.notes['errors'],
+            ["Error: '500 Status' while sending notification to RT."])
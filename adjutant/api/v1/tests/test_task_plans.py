@@ -0,0 +1,123 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from django.conf import settings
+
+from rest_framework import status
+
+from adjutant.api.v1.tests import AdjutantAPITestCase
+from adjutant.exceptions import ActionNotFound
+from adjutant.startup import plans
+
+
+class TaskPlanTests(AdjutantAPITestCase):
+
+    def test_plans_built_at_startup(self):
+        """
+        Plans for the active TaskViews are built once and reused.
+        """
+        plans.build_plans()
+        plan = plans.plans[('create_project', ('NewProjectWithUserAction', ))]
+
+        self.assertIs(
+            plans.get_plan('create_project', ['NewProjectWithUserAction']),
+            plan)
+        self.assertEqual(
+            plan.action_names,
+            ('NewProjectWithUserAction', 'AddDefaultUsersToProjectAction',
+             'NewProjectDefaultNetworkAction'))
+        self.assertEqual(
+            plan.actions[0],
+            ('NewProjectWithUserAction', ) +
+            tuple(settings.ACTION_CLASSES['NewProjectWithUserAction']))
+        self.assertEqual(
+            plan.emails['token']['template'], 'signup_token.txt')
+        self.assertEqual(
+            plan.action_settings,
+            settings.TASK_SETTINGS['create_project']['action_settings'])
+        for field in ['project_name', 'email', 'setup_network', 'region']:
+            self.assertTrue(field in plan.required_fields)
+
+    def test_default_settings(self):
+        """
+        Task types without settings get the defaults.
+        """
+        plan = plans.get_plan('not_a_task_type', ['NewUserAction'])
+        self.assertEqual(plan.action_names, ('NewUserAction', ))
+        self.assertEqual(
+            plan.emails, settings.DEFAULT_TASK_SETTINGS['emails'])
+        self.assertEqual(
+            plan.action_settings, settings.DEFAULT_ACTION_SETTINGS)
+
+    def test_settings_changed(self):
+        """
+        Plans are rebuilt when the settings they come from change.
+        """
+        plan = plans.get_plan('invite_user', ['NewUserAction'])
+        self.assertEqual(plan.action_names, ('NewUserAction', ))
+
+        with self.modify_dict_settings(TASK_SETTINGS=[
+                {'key_list': ['invite_user', 'additional_actions'],
+                 'operation': 'override',
+                 'value': ['SendAdditionalEmailAction']}]):
+            plan = plans.get_plan('invite_user', ['NewUserAction'])
+            self.assertEqual(
+                plan.action_names,
+                ('NewUserAction', 'SendAdditionalEmailAction'))
+
+            headers = {
+                'project_name': "test_project",
+                'project_id': "test_project_id",
+                'roles': "project_admin,_member_,project_mod",
+                'username': "test@example.com",
+                'user_id': "test_user_id",
+                'authenticated': True
+            }
+            url = "/v1/actions/InviteUser"
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                response.data['actions'],
+                ['NewUserAction', 'SendAdditionalEmailAction'])
+
+        plan = plans.get_plan('invite_user', ['NewUserAction'])
+        self.assertEqual(plan.action_names, ('NewUserAction', ))
+
+    def test_missing_action(self):
+        """
+        A plan can't be built with actions that aren't registered.
+        """
+        self.assertRaises(
+            ActionNotFound, plans.get_plan, 'invite_user', ['NotAnAction'])
+
+    def test_plan_read_only(self):
+        """
+        The settings in plans are shared, so can't be modified.
+        """
+        plan = plans.get_plan('create_project', ['NewProjectWithUserAction'])
+
+        with self.assertRaises(TypeError):
+            plan.conf['default_region'] = 'RegionTwo'
+        with self.assertRaises(TypeError):
+            plan.emails['token'].update(template='other.txt')
+        with self.assertRaises(TypeError):
+            plan.action_settings['NewUserAction'][
+                'allowed_roles'].append('admin')
+        with self.assertRaises(AttributeError):
+            plan.action_settings['NewProjectWithUserAction'][
+                'default_roles'].add('admin')
+
+        conf = plan.conf.copy()
+        conf['default_region'] = 'RegionTwo'
+        self.assertNotEqual(plan.conf['default_region'], 'RegionTwo')
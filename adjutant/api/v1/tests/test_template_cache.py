@@ -0,0 +1,79 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from adjutant.template_cache import get_template, template_cache
+
+
+class TemplateCacheTests(TestCase):
+
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.template_dir)
+        override = override_settings(TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'DIRS': [self.template_dir],
+            'NAME': 'include_etc_templates',
+        }])
+        override.enable()
+        self.addCleanup(override.disable)
+        template_cache.clear()
+        self.addCleanup(template_cache.clear)
+
+    def write_template(self, name, content, mtime):
+        path = os.path.join(self.template_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        os.utime(path, (mtime, mtime))
+
+    def render(self, name):
+        return get_template(
+            name, using='include_etc_templates').render({'name': "test"})
+
+    def test_templates_cached(self):
+        """
+        Templates are compiled once, and reused while unchanged.
+        """
+        self.write_template('email.txt', "Hello {{ name }}", 1000)
+
+        template = get_template('email.txt', using='include_etc_templates')
+        self.assertIs(
+            get_template('email.txt', using='include_etc_templates'),
+            template)
+        self.assertEqual(self.render('email.txt'), "Hello test")
+
+        self.assertEqual(
+            template_cache.stats(),
+            {'size': 1, 'hits': 2, 'misses': 1, 'reloads': 0})
+
+    def test_changed_template_reloaded(self):
+        """
+        A template is compiled again once its file has been modified.
+        """
+        self.write_template('email.txt', "Hello {{ name }}", 1000)
+        self.assertEqual(self.render('email.txt'), "Hello test")
+
+        self.write_template('email.txt', "Goodbye {{ name }}", 2000)
+        self.assertEqual(self.render('email.txt'), "Goodbye test")
+        self.assertEqual(self.render('email.txt'), "Goodbye test")
+
+        self.assertEqual(
+            template_cache.stats(),
+            {'size': 1, 'hits': 1, 'misses': 2, 'reloads': 1})
@@ -0,0 +1,99 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from contextlib import contextmanager
+from datetime import timedelta
+from StringIO import StringIO
+from uuid import uuid4
+
+import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from adjutant.api.models import Job, Task, Token
+from adjutant.api.v1 import jobs
+from adjutant.api.v1.token_reaper import (
+    delete_expired_tokens, reap_expired_tokens)
+from adjutant.api.v1.tests import AdjutantTestCase
+
+
+class TokenReaperTests(AdjutantTestCase):
+
+    def setUp(self):
+        self.task = Task.objects.create(ip_address="0.0.0.0", keystone_user={})
+
+    def create_tokens(self, count, expires):
+        for i in range(count):
+            Token.objects.create(
+                task=self.task, token=uuid4().hex, expires=expires)
+
+    def test_delete_expired_tokens(self):
+        """
+        Expired tokens are deleted in batches, and those still valid
+        are kept.
+        """
+        now = timezone.now()
+        self.create_tokens(7, now - timedelta(hours=2))
+        self.create_tokens(3, now + timedelta(hours=2))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(delete_expired_tokens(batch_size=3), 7)
+        self.assertEqual(
+            len([query for query in queries
+                 if query['sql'].startswith('DELETE')]), 3)
+        self.assertEqual(Token.objects.count(), 3)
+        self.assertFalse(any(token.expired for token in Token.objects.all()))
+
+        self.assertEqual(delete_expired_tokens(batch_size=3), 0)
+
+    def test_delete_expired_tokens_keeps_jobs(self):
+        """
+        Jobs for a deleted token are kept, without their token.
+        """
+        self.create_tokens(1, timezone.now() - timedelta(hours=2))
+        job = jobs.enqueue(self.task, 'submit', token=Token.objects.get())
+
+        self.assertEqual(delete_expired_tokens(), 1)
+        self.assertIsNone(Job.objects.get(uuid=job.uuid).token)
+
+    def test_reap_tokens_command(self):
+        self.create_tokens(4, timezone.now() - timedelta(hours=2))
+
+        out = StringIO()
+        call_command('reap_tokens', once=True, batch_size=2, stdout=out)
+        self.assertIn("Deleted 4 expired tokens in", out.getvalue())
+        self.assertEqual(Token.objects.count(), 0)
+
+    def test_reap_tokens_locked(self):
+        """
+        Nothing is deleted while another reaper holds the lock.
+        """
+        self.create_tokens(2, timezone.now() - timedelta(hours=2))
+
+        @contextmanager
+        def held_lock(name):
+            yield False
+
+        with mock.patch('adjutant.api.v1.token_reaper.advisory_lock',
+                        held_lock):
+            self.assertIsNone(reap_expired_tokens())
+
+            out = StringIO()
+            call_command('reap_tokens', once=True, stdout=out)
+        self.assertIn("Another reaper is deleting expired tokens.",
+                      out.getvalue())
+        self.assertEqual(Token.objects.count(), 2)
@@ -0,0 +1,107 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import zlib
+from contextlib import contextmanager
+from logging import getLogger
+
+from django.db import connection
+from django.utils import timezone
+
+from adjutant.api.models import Token
+
+
+logger = getLogger('adjutant')
+
+REAPER_LOCK = 'adjutant_token_reaper'
+
+
+@contextmanager
+def advisory_lock(name):
+    """
+    Tries to take the named database advisory lock without waiting,
+    yielding whether it was taken, and releases it after.
+
+    MySQL and PostgreSQL locks are held by the connection, so only
+    one process on any node holds the lock at once. SQLite has no
+    advisory locks, and as it can't be shared between nodes the lock
+    is always taken.
+    """
+    cursor = connection.cursor()
+    if connection.vendor == 'mysql':
+        cursor.execute("SELECT GET_LOCK(%s, 0)", [name])
+        release = ("SELECT RELEASE_LOCK(%s)", [name])
+    elif connection.vendor == 'postgresql':
+        key = zlib.crc32(name) & 0x7fffffff
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [key])
+        release = ("SELECT pg_advisory_unlock(%s)", [key])
+    else:
+        cursor.close()
+        yield True
+        return
+
+    try:
+        acquired = bool(cursor.fetchone()[0])
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                cursor.execute(*release)
+    finally:
+        cursor.close()
+
+
+def delete_expired_tokens(batch_size=500, pause=0):
+    """
+    Deletes the tokens which have expired, 'batch_size' at a time,
+    waiting 'pause' seconds between batches. Returns how many were
+    deleted.
+
+    Each batch is picked oldest first by the expires index and deleted
+    by primary key, so every delete is short and touches few rows, and
+    the expiry is checked again as it is deleted.
+    """
+    now = timezone.now()
+    expired = Token.objects.filter(expires__lt=now).order_by('expires')
+
+    deleted = 0
+    while True:
+        batch = list(expired.values_list('token', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += Token.objects.filter(
+            token__in=batch, expires__lt=now).delete()[1].get('api.Token', 0)
+        if len(batch) < batch_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
+
+
+def reap_expired_tokens(batch_size=500, pause=0):
+    """
+    Deletes the expired tokens, unless another reaper is already doing
+    so. Returns how many tokens were deleted and the seconds it took,
+    or None if another reaper holds the lock.
+    """
+    with advisory_lock(REAPER_LOCK) as acquired:
+        if not acquired:
+            return None
+        started = time.time()
+        deleted = delete_expired_tokens(batch_size, pause)
+        elapsed = time.time() - started
+
+    logger.info("(%s) - Deleted %s expired tokens in %.2fs." % (
+        timezone.now(), deleted, elapsed))
+    return deleted, elapsed
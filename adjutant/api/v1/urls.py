@@ -19,6 +19,7 @@ from django.conf import settings
 
 urlpatterns = [
     url(r'^status/?$', views.StatusView.as_view()),
+    url(r'^tasks/bulk-approve/?$', views.TaskBulkApprove.as_view()),
     url(r'^tasks/(?P<uuid>\w+)/?$', views.TaskDetail.as_view()),
     url(r'^tasks/?$', views.TaskList.as_view()),
     url(r'^tokens/(?P<id>\w+)', views.TokenDetail.as_view()),
@@ -26,6 +27,7 @@ urlpatterns = [
     url(r'^notifications/(?P<uuid>\w+)/?$',
         views.NotificationDetail.as_view()),
     url(r'^notifications/?$', views.NotificationList.as_view()),
+    url(r'^jobs/(?P<uuid>\w+)/?$', views.JobDetail.as_view()),
 ]
 
 for active_view in settings.ACTIVE_TASKVIEWS:
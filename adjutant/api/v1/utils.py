@@ -12,23 +12,32 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
 import hashlib
 import json
+import socket
 from datetime import timedelta
 from smtplib import SMTPException
+from threading import Lock
 from uuid import uuid4
 
 from decorator import decorator
 
 from django.conf import settings
 from django.core.exceptions import FieldError
-from django.core.mail import EmailMultiAlternatives
-from django.template import loader
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from rest_framework.response import Response
 
-from adjutant.api.models import Notification, Token
+from adjutant import metrics
+from adjutant.api.models import (
+    Notification, NotificationDelivery, QueuedEmail, Token)
+from adjutant.startup.plans import get_plan
+from adjutant.template_cache import get_template
 
 
 def create_token(task):
@@ -44,16 +53,29 @@ def create_token(task):
     return token
 
 
-def send_stage_email(task, email_conf, token=None):
+def send_stage_email(task, email_conf, token=None, connection=None,
+                     stage=None):
+    """
+    Sends the task's email for a stage, if it has one configured.
+
+    'stage' names the email, such as 'initial', 'token' or 'completed',
+    in the task notes and any error notification about it.
+
+    'connection' is an open email connection to send it with, so many
+    emails can be sent over one. By default a connection is opened for
+    the email.
+    """
     if not email_conf:
         return
 
-    text_template = loader.get_template(
+    description = "%s email" % stage if stage else "email"
+
+    text_template = get_template(
         email_conf['template'],
         using='include_etc_templates')
     html_template = email_conf.get('html_template', None)
     if html_template:
-        html_template = loader.get_template(
+        html_template = get_template(
             html_template,
             using='include_etc_templates')
 
@@ -115,59 +137,144 @@ def send_stage_email(task, email_conf, token=None):
             from_email,
             [emails.pop()],
             headers=headers,
+            connection=connection,
         )
 
         if html_template:
             email.attach_alternative(
                 html_template.render(context), "text/html")
 
-        email.send(fail_silently=False)
+        if settings.EMAIL_QUEUE:
+            queue_email(task, email, description)
+        else:
+            with metrics.email_send_duration.time(
+                    mode='inline', result='ok'):
+                email.send(fail_silently=False)
 
     except SMTPException as e:
         notes = {
             'errors':
-                ("Error: '%s' while emailing token for task: %s" %
-                    (e, task.uuid))
+                ("Error: '%s' while sending %s for task: %s" %
+                    (e, description, task.uuid))
         }
+        create_email_error_notification(task, notes)
 
-        errors_conf = settings.TASK_SETTINGS.get(
-            task.task_type, settings.DEFAULT_TASK_SETTINGS).get(
-                'errors', {}).get("SMTPException", {})
 
-        if errors_conf:
-            notification = create_notification(
-                task, notes, error=True,
-                engines=errors_conf.get('engines', True))
+def open_email_connection():
+    """
+    Opens an email connection to send many stage emails over.
 
-            if errors_conf.get('notification') == "acknowledge":
-                notification.acknowledged = True
-                notification.save()
-        else:
-            create_notification(task, notes, error=True)
+    Returns None when emails are queued, or if the connection can't be
+    opened, in which case each email is sent, or fails, on its own.
+    """
+    if settings.EMAIL_QUEUE:
+        return None
+    connection = get_connection()
+    try:
+        connection.open()
+    except (SMTPException, socket.error):
+        return None
+    return connection
 
 
-def create_notification(task, notes, error=False, engines=True):
-    notification = Notification.objects.create(
+def queue_email(task, email, description):
+    """
+    Stores a built email for the email sender to send later.
+
+    'description' says what the email is, such as "token email", and
+    is used in the task notes and any error notification about it.
+    """
+    html_body = ''
+    for content, mimetype in email.alternatives:
+        if mimetype == "text/html":
+            html_body = content
+    return QueuedEmail.objects.create(
         task=task,
-        notes=notes,
-        error=error
+        description=description,
+        subject=email.subject,
+        body=email.body,
+        html_body=html_body,
+        from_email=email.from_email,
+        to=email.to,
+        headers=email.extra_headers,
     )
-    notification.save()
 
-    if not engines:
-        return notification
 
-    class_conf = settings.TASK_SETTINGS.get(
-        task.task_type, settings.DEFAULT_TASK_SETTINGS)
+def create_email_error_notification(task, notes):
+    """
+    Raises the notification for an email which couldn't be sent,
+    as configured by the task's SMTPException error settings.
+    """
+    errors_conf = get_plan(task.task_type).errors.get("SMTPException", {})
 
-    for note_engine, conf in class_conf.get('notifications', {}).iteritems():
-        if error:
-            conf = conf.get('error', {})
-        else:
-            conf = conf.get('standard', {})
-        if not conf:
-            continue
-        engine = settings.NOTIFICATION_ENGINES[note_engine](conf)
+    if errors_conf:
+        notification = create_notification(
+            task, notes, error=True,
+            engines=errors_conf.get('engines', True))
+
+        if errors_conf.get('notification') == "acknowledge":
+            notification.acknowledged = True
+            notification.save()
+    else:
+        create_notification(task, notes, error=True)
+
+
+def get_engine_confs(task_type, error=False):
+    """
+    Returns a dict of notification engine name to its conf for
+    the given task type and kind of notification.
+    """
+    plan = get_plan(task_type)
+    if error:
+        return plan.error_notifications
+    return plan.notifications
+
+
+# Engine instances shared by every notification with the same conf
+engine_cache = {}
+engine_cache_lock = Lock()
+
+
+def get_engine(note_engine, conf):
+    """
+    Returns the notification engine for the given name and conf.
+
+    Engines are built once per conf and reused, so any session an
+    engine holds, such as an RT login, is kept between notifications.
+    """
+    engine_class = settings.NOTIFICATION_ENGINES[note_engine]
+    key = (engine_class, json.dumps(conf, sort_keys=True))
+    with engine_cache_lock:
+        engine = engine_cache.get(key)
+        if engine is None:
+            engine = engine_class(conf)
+            engine_cache[key] = engine
+    return engine
+
+
+def create_notification(task, notes, error=False, engines=True):
+    engine_confs = {}
+    if engines:
+        engine_confs = get_engine_confs(task.task_type, error)
+
+    # With the outbox the deliveries are only recorded here, and are
+    # committed along with the notification for the dispatcher to send.
+    with transaction.atomic():
+        notification = Notification.objects.create(
+            task=task,
+            notes=notes,
+            error=error
+        )
+        notification.save()
+
+        if settings.NOTIFICATION_OUTBOX:
+            for note_engine in engine_confs:
+                NotificationDelivery.objects.create(
+                    notification=notification, engine=note_engine)
+            return notification
+
+    for note_engine, conf in engine_confs.iteritems():
+        engine = get_engine(note_engine, conf)
         engine.notify(task, notification)
 
     return notification
@@ -195,6 +302,25 @@ def create_task_hash(task_type, action_list):
     return hashlib.sha256(str(hashable_list)).hexdigest()
 
 
+def clean_filters(filters):
+    """
+    Converts filters, as a dict or its json, from the format below to
+    Django lookups. Raises ValueError if they are incorrectly formatted.
+    """
+    cleaned_filters = {}
+    try:
+        if isinstance(filters, basestring):
+            filters = json.loads(filters)
+        for field, operations in filters.iteritems():
+            for operation, value in operations.iteritems():
+                cleaned_filters['%s__%s' % (field, operation)] = value
+    except (ValueError, AttributeError):
+        raise ValueError(
+            "Filters incorrectly formatted. Required format: " +
+            "{'filters': {'fieldname': { 'operation': 'value'}}")
+    return cleaned_filters
+
+
 # "{'filters': {'fieldname': { 'operation': 'value'}}
 @decorator
 def parse_filters(func, *args, **kwargs):
@@ -209,20 +335,10 @@ def parse_filters(func, *args, **kwargs):
 
     if not filters:
         return func(*args, **kwargs)
-    cleaned_filters = {}
     try:
-        filters = json.loads(filters)
-        for field, operations in filters.iteritems():
-            for operation, value in operations.iteritems():
-                cleaned_filters['%s__%s' % (field, operation)] = value
-    except (ValueError, AttributeError):
-        return Response(
-            {'errors': [
-                ("Filters incorrectly formatted. Required format: " +
-                 "{'filters': {'fieldname': { 'operation': 'value'}}")
-            ]},
-            status=400
-        )
+        cleaned_filters = clean_filters(filters)
+    except ValueError as e:
+        return Response({'errors': [str(e)]}, status=400)
 
     try:
         # NOTE(adriant): This feels dirty and unclear, but it works.
@@ -242,3 +358,92 @@ def add_task_id_for_roles(request, processed, response_dict, req_roles):
 
         if roles & req_roles:
             response_dict['task'] = processed['task'].uuid
+            if 'job' in processed:
+                response_dict['job'] = processed['job']
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(obj, direction, key='pk'):
+    cursor = json.dumps(
+        [direction, obj.created_on.isoformat(), getattr(obj, key)])
+    return base64.urlsafe_b64encode(cursor)
+
+
+def decode_cursor(cursor):
+    try:
+        direction, created_on, key_value = json.loads(
+            base64.urlsafe_b64decode(str(cursor)))
+        created_on = parse_datetime(created_on)
+    except (TypeError, ValueError):
+        raise CursorError("Invalid cursor.")
+    if direction not in ('next', 'prev') or created_on is None:
+        raise CursorError("Invalid cursor.")
+    return direction, created_on, key_value
+
+
+def wants_cursor_pagination(request):
+    return ('limit' in request.query_params or
+            'cursor' in request.query_params)
+
+
+def cursor_paginate(request, queryset, key='pk'):
+    """
+    Keyset pagination on (created_on, key), newest first.
+
+    Rather than counting and offsetting into the whole queryset, each
+    page starts from the position in the cursor, so deep pages are as
+    cheap as the first. Uses the 'limit', 'cursor' and 'with_count'
+    query parameters, and returns the page of objects and a dict
+    with the 'next' and 'previous' cursors, and 'count' if asked for.
+
+    The cursors are only encoded, and end up in urls and logs, so
+    'key' must not be secret. It defaults to the primary key, and
+    should make (created_on, key) unique.
+
+    Raises CursorError if the parameters are invalid.
+    """
+    try:
+        limit = int(request.query_params.get(
+            'limit', settings.DEFAULT_PAGE_LIMIT))
+    except ValueError:
+        raise CursorError("Limit must be an integer.")
+    if limit < 1:
+        raise CursorError("Limit must be a positive integer.")
+
+    meta = {'next': None, 'previous': None}
+    if request.query_params.get('with_count', '').lower() == 'true':
+        meta['count'] = queryset.count()
+
+    cursor = request.query_params.get('cursor', None)
+    if cursor:
+        direction, created_on, key_value = decode_cursor(cursor)
+    else:
+        direction, created_on, key_value = 'next', None, None
+
+    if direction == 'next':
+        if cursor:
+            queryset = queryset.filter(
+                Q(created_on__lt=created_on) |
+                Q(created_on=created_on, **{key + '__lt': key_value}))
+        queryset = queryset.order_by('-created_on', '-' + key)
+    else:
+        queryset = queryset.filter(
+            Q(created_on__gt=created_on) |
+            Q(created_on=created_on, **{key + '__gt': key_value}))
+        queryset = queryset.order_by('created_on', key)
+
+    page = list(queryset[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    if direction == 'prev':
+        page.reverse()
+
+    if page:
+        if has_more or direction == 'prev':
+            meta['next'] = encode_cursor(page[-1], 'next', key)
+        if cursor and (has_more or direction == 'next'):
+            meta['previous'] = encode_cursor(page[0], 'prev', key)
+    return page, meta
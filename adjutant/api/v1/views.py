@@ -15,6 +15,7 @@
 from logging import getLogger
 
 from django.conf import settings
+from django.core.exceptions import FieldError, ValidationError
 from django.utils import timezone
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
@@ -23,9 +24,14 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from adjutant.api import utils
-from adjutant.api.models import Notification, Task, Token
+from adjutant.api.models import Job, Notification, Task, Token
+from adjutant.api.v1 import approvals, jobs
+from adjutant.api.v1.token_reaper import delete_expired_tokens
 from adjutant.api.v1.utils import (
-    create_notification, create_token, parse_filters, send_stage_email)
+    clean_filters, create_notification, create_token, cursor_paginate,
+    CursorError, parse_filters, send_stage_email, wants_cursor_pagination)
+from adjutant.notifications.outbox import outbox_metrics
+from adjutant.startup.plans import get_plan
 
 
 class APIViewWithLogger(APIView):
@@ -46,6 +52,8 @@ class StatusView(APIViewWithLogger):
 
         Returns a list of unacknowledged error notifications,
         and both the last created and last completed tasks.
+        With the notification outbox, also returns its queue depth
+        and delivery lag.
 
         Can returns None, if there are no tasks.
         """
@@ -70,6 +78,8 @@ class StatusView(APIViewWithLogger):
             "last_created_task": last_created_task,
             "last_completed_task": last_completed_task
         }
+        if settings.NOTIFICATION_OUTBOX:
+            status["notification_outbox"] = outbox_metrics()
 
         return Response(status, status=200)
 
@@ -87,22 +97,62 @@ class NotificationList(APIViewWithLogger):
                 **filters).order_by("-created_on")
         else:
             notifications = Notification.objects.all().order_by("-created_on")
+
+        page = None
+        if wants_cursor_pagination(request):
+            try:
+                notifications, page = cursor_paginate(
+                    request, notifications)
+            except CursorError as e:
+                return Response({'errors': [str(e)]}, status=400)
+
         note_list = []
         for notification in notifications:
             note_list.append(notification.to_dict())
-        return Response({"notifications": note_list}, status=200)
+        response = {"notifications": note_list}
+        if page:
+            response.update(page)
+        return Response(response, status=200)
 
     @utils.admin
     def post(self, request, format=None):
         """
         Acknowledge notifications.
+
+        Takes either 'notifications', a list of notification uuids, or
+        'filters', in the same format as the list filters, to acknowledge
+        every matching notification. Either is done as one update, so
+        clearing even a large number of notifications is quick.
         """
+        filters = request.data.get('filters', None)
+        if filters is not None:
+            try:
+                cleaned_filters = clean_filters(filters)
+            except ValueError as e:
+                return Response({'errors': [str(e)]}, status=400)
+            if not cleaned_filters:
+                return Response(
+                    {'filters': ["at least one filter is required."]},
+                    status=400)
+            try:
+                count = Notification.objects.filter(
+                    **cleaned_filters).filter(acknowledged=False).update(
+                        acknowledged=True)
+            except FieldError as e:
+                return Response({'errors': [str(e)]}, status=400)
+            except ValidationError as e:
+                return Response({'errors': e.messages}, status=400)
+            self.logger.info("(%s) - Acknowledged %s notifications." % (
+                timezone.now(), count))
+            return Response(
+                {'notes': ['%s notifications acknowledged.' % count]},
+                status=200)
+
         note_list = request.data.get('notifications', None)
         if note_list and isinstance(note_list, list):
-            notifications = Notification.objects.filter(uuid__in=note_list)
-            for notification in notifications:
-                notification.acknowledged = True
-                notification.save()
+            Notification.objects.filter(
+                uuid__in=note_list, acknowledged=False).update(
+                    acknowledged=True)
             return Response({'notes': ['Notifications acknowledged.']},
                             status=200)
         else:
@@ -170,6 +220,18 @@ class TaskList(APIViewWithLogger):
                 tasks = Task.objects.filter(**filters).order_by("-created_on")
             else:
                 tasks = Task.objects.all().order_by("-created_on")
+            tasks = tasks.prefetch_related('action_set', 'actionnote_set')
+
+            # NOTE: Page numbers are kept for horizon, but cursors are
+            # much cheaper for deep pages of large task tables.
+            if not tasks_per_page and wants_cursor_pagination(request):
+                try:
+                    tasks, page = cursor_paginate(request, tasks)
+                except CursorError as e:
+                    return Response({'errors': [str(e)]}, status=400)
+                task_list = [task._to_dict() for task in tasks]
+                page['tasks'] = task_list
+                return Response(page, status=200)
 
             if tasks_per_page:
                 paginator = Paginator(tasks, tasks_per_page)
@@ -210,6 +272,16 @@ class TaskList(APIViewWithLogger):
                 tasks = Task.objects.filter(
                     project_id__exact=request.keystone_user['project_id']
                 ).order_by("-created_on")
+            tasks = tasks.prefetch_related('action_set', 'actionnote_set')
+
+            if not tasks_per_page and wants_cursor_pagination(request):
+                try:
+                    tasks, page = cursor_paginate(request, tasks)
+                except CursorError as e:
+                    return Response({'errors': [str(e)]}, status=400)
+                task_list = [task.to_dict() for task in tasks]
+                page['tasks'] = task_list
+                return Response(page, status=200)
 
             paginator = Paginator(tasks, tasks_per_page)
             tasks = paginator.page(page)
@@ -221,6 +293,70 @@ class TaskList(APIViewWithLogger):
                              'pages': paginator.num_pages}, status=200)
 
 
+class TaskBulkApprove(APIViewWithLogger):
+
+    @utils.admin
+    def post(self, request, format=None):
+        """
+        Approves many tasks at once, each as TaskDetail.post would.
+
+        Takes 'approved' as True, and either 'tasks', a list of task
+        uuids, or 'filters', in the format the list endpoints take, to
+        approve every matching task still waiting for approval. At most
+        BULK_APPROVE_MAX_TASKS are approved a request, on a pool of
+        BULK_APPROVE_CONCURRENCY threads paced to BULK_APPROVE_RATE
+        tasks a second, and the result for each is returned in order.
+
+        Without ASYNC_STAGES every post_approve is run in the request,
+        so it takes no more than BULK_APPROVE_MAX_SYNC_TASKS. Larger
+        backlogs can be approved with the approve_tasks command.
+        """
+        try:
+            if request.data.get('approved') is not True:
+                return Response(
+                    {'approved': ["this is a required boolean field."]},
+                    status=400)
+        except ParseError:
+            return Response(
+                {'approved': ["this is a required boolean field."]},
+                status=400)
+
+        task_uuids = request.data.get('tasks', None)
+        filters = request.data.get('filters', None)
+        if (task_uuids is None) == (filters is None):
+            return Response(
+                {'errors': ["One of 'tasks' or 'filters' is required."]},
+                status=400)
+
+        max_tasks = settings.BULK_APPROVE_MAX_TASKS
+        if not settings.ASYNC_STAGES:
+            max_tasks = min(max_tasks, settings.BULK_APPROVE_MAX_SYNC_TASKS)
+        if filters is not None:
+            try:
+                task_uuids = list(approvals.pending_tasks(
+                    clean_filters(filters))[:max_tasks + 1])
+            except (ValueError, FieldError) as e:
+                return Response({'errors': [str(e)]}, status=400)
+            except ValidationError as e:
+                return Response({'errors': e.messages}, status=400)
+        elif (not isinstance(task_uuids, list) or
+                not all(isinstance(uuid, basestring) for uuid in task_uuids)):
+            return Response(
+                {'errors': ["'tasks' must be a list of task ids."]},
+                status=400)
+
+        if len(task_uuids) > max_tasks:
+            return Response(
+                {'errors': ["At most %s tasks can be approved at once." %
+                            max_tasks]},
+                status=400)
+
+        self.logger.info("(%s) - Bulk approving %s tasks." % (
+            timezone.now(), len(task_uuids)))
+        results = approvals.approve_tasks(task_uuids, request.keystone_user)
+        return Response({'tasks': results}, status=200)
+
+
 class TaskDetail(APIViewWithLogger):
 
     @utils.mod_or_admin
@@ -395,110 +531,13 @@ class TaskDetail(APIViewWithLogger):
         task.approved_on = timezone.now()
         task.save()
 
-        need_token = False
-        valid = True
-
-        actions = []
-
-        for action in task.actions:
-            act_model = action.get_action()
-            actions.append(act_model)
-            try:
-                act_model.post_approve()
-            except Exception as e:
-                notes = {
-                    'errors':
-                        [("Error: '%s' while approving task. " +
-                          "See task itself for details.") % e],
-                    'task': task.uuid
-                }
-                create_notification(task, notes)
-
-                import traceback
-                trace = traceback.format_exc()
-                self.logger.critical(("(%s) - Exception escaped! %s\n" +
-                                      "Trace: \n%s") %
-                                     (timezone.now(), e, trace))
-
-                return Response(notes, status=500)
-
-            if not action.valid:
-                valid = False
-            if action.need_token:
-                need_token = True
-
-        if valid:
-            if need_token:
-                token = create_token(task)
-                try:
-                    class_conf = settings.TASK_SETTINGS.get(
-                        task.task_type, settings.DEFAULT_TASK_SETTINGS)
-
-                    # will throw a key error if the token template has not
-                    # been specified
-                    email_conf = class_conf['emails']['token']
-                    send_stage_email(task, email_conf, token)
-                    return Response({'notes': ['created token']},
-                                    status=200)
-                except KeyError as e:
-                    notes = {
-                        'errors':
-                            [("Error: '%s' while sending " +
-                              "token. See task " +
-                              "itself for details.") % e],
-                        'task': task.uuid
-                    }
-                    create_notification(task, notes)
-
-                    import traceback
-                    trace = traceback.format_exc()
-                    self.logger.critical(("(%s) - Exception escaped!" +
-                                          " %s\n Trace: \n%s") %
-                                         (timezone.now(), e, trace))
-
-                    response_dict = {
-                        'errors':
-                            ["Error: Something went wrong on the " +
-                             "server. It will be looked into shortly."]
-                    }
-                    return Response(response_dict, status=500)
-            else:
-                for action in actions:
-                    try:
-                        action.submit({})
-                    except Exception as e:
-                        notes = {
-                            'errors':
-                                [("Error: '%s' while submitting " +
-                                  "task. See task " +
-                                  "itself for details.") % e],
-                            'task': task.uuid
-                        }
-                        create_notification(task, notes)
-
-                        import traceback
-                        trace = traceback.format_exc()
-                        self.logger.critical(("(%s) - Exception escaped!" +
-                                              " %s\n Trace: \n%s") %
-                                             (timezone.now(), e, trace))
-
-                        return Response(notes, status=500)
-
-                task.completed = True
-                task.completed_on = timezone.now()
-                task.save()
-
-                # Sending confirmation email:
-                class_conf = settings.TASK_SETTINGS.get(
-                    task.task_type, settings.DEFAULT_TASK_SETTINGS)
-                email_conf = class_conf.get(
-                    'emails', {}).get('completed', None)
-                send_stage_email(task, email_conf)
+        if settings.ASYNC_STAGES:
+            job = jobs.active_job(task) or jobs.enqueue(task, 'post_approve')
+            response_dict, status = jobs.queued_response(job)
+            return Response(response_dict, status=status)
 
-                return Response(
-                    {'notes': ["Task completed successfully."]},
-                    status=200)
-        return Response({'errors': ['actions invalid']}, status=400)
+        response_dict, status = jobs.post_approve_task(task)
+        return Response(response_dict, status=status)
 
     @utils.mod_or_admin
     def delete(self, request, uuid, format=None):
@@ -554,10 +593,23 @@ class TokenList(APIViewWithLogger):
             tokens = Token.objects.filter(**filters).order_by("-created_on")
         else:
             tokens = Token.objects.all().order_by("-created_on")
+
+        page = None
+        if wants_cursor_pagination(request):
+            try:
+                # keyed on the task, as the token itself is a secret
+                # and the cursors end up in urls and logs.
+                tokens, page = cursor_paginate(request, tokens, 'task_id')
+            except CursorError as e:
+                return Response({'errors': [str(e)]}, status=400)
+
         token_list = []
         for token in tokens:
             token_list.append(token.to_dict())
-        return Response({"tokens": token_list})
+        response = {"tokens": token_list}
+        if page:
+            response.update(page)
+        return Response(response)
 
     @utils.mod_or_admin
     def post(self, request, format=None):
@@ -604,13 +656,10 @@ class TokenList(APIViewWithLogger):
 
         token = create_token(task)
         try:
-            class_conf = settings.TASK_SETTINGS.get(
-                task.task_type, settings.DEFAULT_TASK_SETTINGS)
-
             # will throw a key error if the token template has not
             # been specified
-            email_conf = class_conf['emails']['token']
-            send_stage_email(task, email_conf, token)
+            email_conf = get_plan(task.task_type).emails['token']
+            send_stage_email(task, email_conf, token, stage='token')
         except KeyError as e:
             notes = {
                 'errors': [
@@ -641,8 +690,7 @@ class TokenList(APIViewWithLogger):
         """
         Delete all expired tokens.
         """
-        now = timezone.now()
-        Token.objects.filter(expires__lt=now).delete()
+        delete_expired_tokens()
         return Response(
             {'notes': ['Deleted all expired tokens.']}, status=200)
 
@@ -751,43 +799,43 @@ class TokenDetail(APIViewWithLogger):
         if errors:
             return Response({"errors": errors}, status=400)
 
-        for action in actions:
-            try:
-                action.submit(data)
-            except Exception as e:
-                notes = {
-                    'errors':
-                        [("Error: '%s' while submitting task. " +
-                          "See task itself for details.") % e],
-                    'task': token.task.uuid
-                }
-                create_notification(token.task, notes)
-
-                import traceback
-                trace = traceback.format_exc()
-                self.logger.critical(("(%s) - Exception escaped! %s\n" +
-                                      "Trace: \n%s") %
-                                     (timezone.now(), e, trace))
-
-                response_dict = {
-                    'errors':
-                        ["Error: Something went wrong on the server. " +
-                         "It will be looked into shortly."]
-                }
-                return Response(response_dict, status=500)
-
-        token.task.completed = True
-        token.task.completed_on = timezone.now()
-        token.task.save()
-        token.delete()
-
-        # Sending confirmation email:
-        class_conf = settings.TASK_SETTINGS.get(
-            token.task.task_type, settings.DEFAULT_TASK_SETTINGS)
-        email_conf = class_conf.get(
-            'emails', {}).get('completed', None)
-        send_stage_email(token.task, email_conf)
+        if settings.ASYNC_STAGES:
+            if jobs.active_job(token.task):
+                return Response(
+                    {'errors': ['This task is already being processed.']},
+                    status=400)
+            job = jobs.enqueue(token.task, 'submit', data, token)
+            response_dict, status = jobs.queued_response(job)
+            return Response(response_dict, status=status)
 
-        return Response(
-            {'notes': ["Token submitted successfully."]},
-            status=200)
+        response_dict, status = jobs.submit_token(
+            token.task, token, data, actions)
+        return Response(response_dict, status=status)
+
+
+class JobDetail(APIViewWithLogger):
+    """
+    Status of a queued task stage.
+    """
+
+    @utils.mod_or_admin
+    def get(self, request, uuid, format=None):
+        """
+        Dict of the job, which can be polled until its state is
+        'completed' or 'failed', at which point 'result' holds what
+        the api would have returned had the stage run in the request.
+
+        Non admins can only see the jobs of their project's tasks.
+        """
+        try:
+            if 'admin' in request.keystone_user['roles']:
+                job = Job.objects.get(uuid=uuid)
+            else:
+                job = Job.objects.get(
+                    uuid=uuid,
+                    task__project_id=request.keystone_user['project_id'])
+        except Job.DoesNotExist:
+            return Response(
+                {'errors': ['No job with this id.']},
+                status=404)
+        return Response(job.to_dict())
@@ -0,0 +1,107 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from threading import Lock
+from time import time
+
+from django.conf import settings
+from django.db.models import Count
+from django.http import Http404, HttpResponse
+
+from adjutant import metrics
+from adjutant.actions.openstack_clients import client_pool
+from adjutant.api.models import Task
+from adjutant.api.v1.email_queue import email_queue_metrics
+from adjutant.api.v1.jobs import job_queue
+from adjutant.notifications.outbox import outbox_metrics
+from adjutant.template_cache import template_cache
+
+
+refresh_lock = Lock()
+last_refresh = {'time': None}
+
+
+def task_state(cancelled, approved, completed):
+    if cancelled:
+        return 'cancelled'
+    if completed:
+        return 'completed'
+    if approved:
+        return 'approved'
+    return 'pending'
+
+
+def refresh_database_metrics():
+    """
+    Updates the task and queue counts, which each take a query.
+
+    These are only refreshed every METRICS_REFRESH_INTERVAL seconds,
+    however often the metrics are scraped.
+    """
+    with refresh_lock:
+        now = time()
+        last = last_refresh['time']
+        if last is not None and now - last < settings.METRICS_REFRESH_INTERVAL:
+            return
+        last_refresh['time'] = now
+
+    task_counts = {}
+    counts = Task.objects.values(
+        'cancelled', 'approved', 'completed').annotate(count=Count('uuid'))
+    for count in counts:
+        state = task_state(
+            count['cancelled'], count['approved'], count['completed'])
+        task_counts[state] = task_counts.get(state, 0) + count['count']
+    metrics.tasks.set_all(
+        ({'state': state}, count) for state, count in task_counts.items())
+
+    queues = []
+    job_metrics = job_queue.metrics()
+    for state in ['queued', 'running']:
+        queues.append(({'queue': 'jobs', 'state': state}, job_metrics[state]))
+    if settings.EMAIL_QUEUE:
+        email_metrics = email_queue_metrics()
+        for state in ['queued', 'sending', 'failed']:
+            queues.append(
+                ({'queue': 'emails', 'state': state}, email_metrics[state]))
+    if settings.NOTIFICATION_OUTBOX:
+        outbox = outbox_metrics()
+        for state in ['pending', 'sending', 'failed']:
+            queues.append(
+                ({'queue': 'notifications', 'state': state}, outbox[state]))
+    metrics.queue_depth.set_all(queues)
+
+
+def refresh_cache_metrics():
+    cache_requests = []
+    for cache, stats in [('openstack_clients', client_pool.stats()),
+                         ('templates', template_cache.stats())]:
+        for outcome in ['hits', 'misses', 'expired', 'reloads']:
+            if outcome in stats:
+                cache_requests.append((
+                    {'cache': cache, 'outcome': outcome}, stats[outcome]))
+    metrics.cache_requests.set_all(cache_requests)
+
+
+def metrics_view(request):
+    """
+    Prometheus metrics for this process, if METRICS_ENABLED.
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404()
+
+    refresh_database_metrics()
+    refresh_cache_metrics()
+    return HttpResponse(
+        metrics.render(), content_type='text/plain; version=0.0.4')
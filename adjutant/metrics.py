@@ -0,0 +1,229 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In process metrics, exposed in the Prometheus text format.
+
+Recording a value is a dict update under a lock, so metrics can be kept
+on every request. Each process keeps its own metrics, so with several
+API processes each is scraped separately, or the scrapes summed.
+"""
+
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+registry = []
+
+
+def _escape(value):
+    return str(value).replace(
+        '\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        self._values = {}
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def samples(self):
+        """Returns (suffix, labels, value) for each sample."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.metric_type),
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append('%s%s%s %s' % (
+                self.name, suffix, _format_labels(labels),
+                _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield '_total', zip(self.labelnames, key), value
+
+
+class Gauge(Metric):
+    """
+    A gauge whose values are all set together, by 'collect'
+    at scrape time.
+    """
+    metric_type = 'gauge'
+
+    def set_all(self, values):
+        with self._lock:
+            self._values = dict(
+                (self._key(labels), value) for labels, value in values)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield '', zip(self.labelnames, key), value
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'), )
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, total = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Times the block. A 'result' label, if there is one, is set
+        to 'error' if the block raises.
+        """
+        start = time()
+        try:
+            yield
+        except Exception:
+            if 'result' in self.labelnames:
+                labels['result'] = 'error'
+            raise
+        finally:
+            self.observe(time() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            labels = zip(self.labelnames, key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield ('_bucket', labels + [('le', _format_value(bound))],
+                       cumulative)
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+
+def render():
+    """Returns all the metrics in the Prometheus text format."""
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+request_duration = Histogram(
+    'adjutant_request_duration_seconds',
+    "Time taken to handle API requests.",
+    ['view', 'method', 'status'])
+
+stage_duration = Histogram(
+    'adjutant_action_stage_duration_seconds',
+    "Time taken by each stage of an action.",
+    ['action', 'stage', 'result'])
+
+openstack_call_duration = Histogram(
+    'adjutant_openstack_call_duration_seconds',
+    "Time taken by HTTP requests to OpenStack services.",
+    ['service', 'method', 'result'])
+
+keystone_call_duration = Histogram(
+    'adjutant_keystone_call_duration_seconds',
+    "Time taken by each identity manager call to Keystone.",
+    ['call', 'result'])
+
+email_send_duration = Histogram(
+    'adjutant_email_send_duration_seconds',
+    "Time taken to send an email.",
+    ['mode', 'result'])
+
+notification_duration = Histogram(
+    'adjutant_notification_duration_seconds',
+    "Time taken to send a notification with an engine.",
+    ['engine', 'result'])
+
+tasks = Gauge(
+    'adjutant_tasks',
+    "Number of tasks by state.",
+    ['state'])
+
+queue_depth = Gauge(
+    'adjutant_queue_depth',
+    "Number of items waiting in each background queue, by state.",
+    ['queue', 'state'])
+
+cache_requests = Gauge(
+    'adjutant_cache_requests',
+    "Lookups in each in process cache by outcome, since it was cleared.",
+    ['cache', 'outcome'])
@@ -14,8 +14,12 @@
 
 from time import time
 from logging import getLogger
+from django.conf import settings
 from django.utils import timezone
 
+from adjutant import metrics
+from adjutant.actions.user_store import keystone_call_totals
+
 
 class KeystoneHeaderUnwrapper(object):
     """
@@ -69,7 +73,12 @@ class TestingHeaderUnwrapper(object):
 class RequestLoggingMiddleware(object):
     """
     Middleware to log the requests and responses.
-    Will time the duration of a request and log that.
+    Will time the duration of a request and log that, and
+    record it in the request metrics by view and status.
+
+    The Keystone calls made by the request are logged too, and
+    with DEBUG on are also returned in the X-Adjutant-Keystone-Calls
+    header, as the number of calls and the time spent in them.
     """
 
     def __init__(self):
@@ -84,17 +93,46 @@ class RequestLoggingMiddleware(object):
             request.get_full_path()
         )
         request.timer = time()
+        request.keystone_calls = keystone_call_totals()
 
     def process_response(self, request, response):
         if hasattr(request, 'timer'):
             time_delta = time() - request.timer
+            metrics.request_duration.observe(
+                time_delta,
+                view=self._view_name(request),
+                method=request.method,
+                status=response.status_code)
         else:
             time_delta = -1
+
+        if hasattr(request, 'keystone_calls'):
+            calls, seconds = keystone_call_totals()
+            calls -= request.keystone_calls[0]
+            milliseconds = (seconds - request.keystone_calls[1]) * 1000
+        else:
+            calls, milliseconds = 0, 0
+        if settings.DEBUG:
+            response['X-Adjutant-Keystone-Calls'] = '%d; %dms' % (
+                calls, milliseconds)
+
         self.logger.info(
-            '(%s) - <%s> [%s] - (%.1fs)',
+            '(%s) - <%s> [%s] - (%.1fs) - keystone: %d calls (%dms)',
             timezone.now(),
             response.status_code,
             request.get_full_path(),
-            time_delta
+            time_delta,
+            calls,
+            milliseconds
         )
         return response
+
+    def _view_name(self, request):
+        # labelled by view rather than path, as paths contain ids
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'none'
+        view_class = getattr(match.func, 'view_class', None)
+        if view_class is not None:
+            return view_class.__name__
+        return match.func.__name__
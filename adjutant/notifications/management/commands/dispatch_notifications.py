@@ -0,0 +1,68 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from adjutant.notifications import outbox
+
+
+class Command(BaseCommand):
+    help = "Delivers queued notifications with their notification engines."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once there are no more deliveries due.")
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help="Seconds to wait between checks when nothing is due.")
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help="Deliveries to claim at a time.")
+        parser.add_argument(
+            '--concurrency', type=int, default=4,
+            help="Deliveries to send at once.")
+        parser.add_argument(
+            '--dispatcher-name',
+            default="%s:%s" % (socket.gethostname(), os.getpid()),
+            help="Name recorded on the deliveries this dispatcher claims.")
+
+    def handle(self, *args, **options):
+        dispatcher = options['dispatcher_name']
+        delivered = failed = 0
+        try:
+            while True:
+                close_old_connections()
+                batch_delivered, batch_failed = outbox.dispatch(
+                    dispatcher, options['batch_size'],
+                    options['concurrency'])
+                delivered += batch_delivered
+                failed += batch_failed
+                if not (batch_delivered or batch_failed):
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+
+        metrics = outbox.outbox_metrics()
+        self.stdout.write(
+            "Delivered %s, failed %s. Queue depth %s, delivery lag %.1fs." % (
+                delivered, failed, metrics['queue_depth'],
+                metrics['delivery_lag']))
@@ -14,19 +14,53 @@
 
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
-from django.template import loader
 from smtplib import SMTPException
+from adjutant import metrics
 from adjutant.api.models import Notification
+from adjutant.template_cache import get_template
 
 
 class NotificationEngine(object):
-    """"""
+    """
+    Base class for notification engines.
+
+    '_notify' should raise one of 'delivery_errors' if the notification
+    could not be delivered. 'notify' records those failures as an error
+    notification, while 'deliver' raises them so the caller can retry.
+    """
+
+    delivery_errors = ()
 
     def __init__(self, conf):
         self.conf = conf
 
     def notify(self, task, notification):
-        return self._notify(task, notification)
+        try:
+            return self._timed_notify(task, notification)
+        except self.delivery_errors as e:
+            self.notify_failed(notification, e)
+
+    def deliver(self, task, notification):
+        return self._timed_notify(task, notification)
+
+    def _timed_notify(self, task, notification):
+        with metrics.notification_duration.time(
+                engine=self.__class__.__name__, result='ok'):
+            return self._notify(task, notification)
+
+    def notify_failed(self, notification, error):
+        """
+        Records that the notification could not be delivered.
+        """
+        error_notification = Notification.objects.create(
+            task=notification.task,
+            notes={'errors': [self._failure_message(error)]},
+            error=True
+        )
+        error_notification.save()
+
+    def _failure_message(self, error):
+        return "Error: '%s' while sending notification" % error
 
     def _notify(self, task, notification):
         raise NotImplementedError
@@ -57,13 +91,18 @@ class EmailNotification(NotificationEngine):
                     ...
     """
 
+    delivery_errors = (SMTPException, )
+
+    def _failure_message(self, error):
+        return "Error: '%s' while sending email notification" % error
+
     def _notify(self, task, notification):
-        template = loader.get_template(
+        template = get_template(
             self.conf['template'],
             using='include_etc_templates')
         html_template = self.conf.get('html_template', None)
         if html_template:
-            html_template = loader.get_template(
+            html_template = get_template(
                 html_template,
                 using='include_etc_templates')
 
@@ -74,53 +113,41 @@ class EmailNotification(NotificationEngine):
             subject = "Error - %s notification" % task.task_type
         else:
             subject = "%s notification" % task.task_type
-        try:
-            message = template.render(context)
-
-            # from_email is the return-path and is distinct from the
-            # message headers
-            from_email = self.conf.get('from')
-            if not from_email:
-                from_email = self.conf['reply']
-            elif "%(task_uuid)s" in from_email:
-                from_email = from_email % {'task_uuid': task.uuid}
-
-            # these are the message headers which will be visible to
-            # the email client.
-            headers = {
-                'X-Adjutant-Task-UUID': task.uuid,
-                # From needs to be set to be disctinct from return-path
-                'From': self.conf['reply'],
-                'Reply-To': self.conf['reply'],
-            }
-
-            email = EmailMultiAlternatives(
-                subject,
-                message,
-                from_email,
-                self.conf['emails'],
-                headers=headers,
-            )
-
-            if html_template:
-                email.attach_alternative(
-                    html_template.render(context), "text/html")
-
-            email.send(fail_silently=False)
-            if not notification.error:
-                notification.acknowledge = True
-                notification.save()
-        except SMTPException as e:
-            notes = {
-                'errors':
-                    [("Error: '%s' while sending email notification") % e]
-            }
-            error_notification = Notification.objects.create(
-                task=notification.task,
-                notes=notes,
-                error=True
-            )
-            error_notification.save()
+        message = template.render(context)
+
+        # from_email is the return-path and is distinct from the
+        # message headers
+        from_email = self.conf.get('from')
+        if not from_email:
+            from_email = self.conf['reply']
+        elif "%(task_uuid)s" in from_email:
+            from_email = from_email % {'task_uuid': task.uuid}
+
+        # these are the message headers which will be visible to
+        # the email client.
+        headers = {
+            'X-Adjutant-Task-UUID': task.uuid,
+            # From needs to be set to be disctinct from return-path
+            'From': self.conf['reply'],
+            'Reply-To': self.conf['reply'],
+        }
+
+        email = EmailMultiAlternatives(
+            subject,
+            message,
+            from_email,
+            self.conf['emails'],
+            headers=headers,
+        )
+
+        if html_template:
+            email.attach_alternative(
+                html_template.render(context), "text/html")
+
+        email.send(fail_silently=False)
+        if not notification.error:
+            notification.acknowledge = True
+            notification.save()
 
 
 notification_engines = {
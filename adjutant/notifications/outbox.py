@@ -0,0 +1,149 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from logging import getLogger
+from multiprocessing.pool import ThreadPool
+
+from django.db import connection
+from django.utils import timezone
+
+from adjutant.api.models import NotificationDelivery
+from adjutant.api.v1.utils import get_engine, get_engine_confs
+from adjutant.queues import ClaimQueue
+
+
+logger = getLogger('adjutant')
+
+outbox = ClaimQueue(
+    NotificationDelivery, 'pending', 'sending', 'delivered',
+    owner_field='dispatcher',
+    timeout='NOTIFICATION_DELIVERY_TIMEOUT',
+    max_attempts='NOTIFICATION_MAX_ATTEMPTS',
+    retry_delay='NOTIFICATION_RETRY_DELAY',
+    done_on_field='delivered_on',
+    select_related=('notification__task', ))
+
+
+def claim_deliveries(dispatcher, limit):
+    """
+    Claims up to 'limit' deliveries that are due, oldest first.
+
+    A delivery left 'sending' for longer than
+    NOTIFICATION_DELIVERY_TIMEOUT is assumed lost and claimed again.
+    """
+    return outbox.claim(dispatcher, limit)
+
+
+def _deliver(engine, delivery):
+    """Sends one delivery, returning the error if it failed."""
+    notification = delivery.notification
+    try:
+        engine.deliver(notification.task, notification)
+    except Exception as e:
+        return e
+
+
+def _pooled_deliver(engine_delivery):
+    # pool threads get their own database connection if the engine
+    # uses one, which would otherwise be left open
+    try:
+        return _deliver(*engine_delivery)
+    finally:
+        connection.close()
+
+
+def dispatch(dispatcher, limit=100, concurrency=4):
+    """
+    Claims and sends a batch of due deliveries, with at most
+    'concurrency' sent at once. Returns the number delivered and failed.
+
+    Failed deliveries are retried after NOTIFICATION_RETRY_DELAY,
+    doubling with each attempt, and are given up on after
+    NOTIFICATION_MAX_ATTEMPTS.
+    """
+    deliveries = claim_deliveries(dispatcher, limit)
+    if not deliveries:
+        return 0, 0
+
+    to_send = []
+    results = {}
+    for delivery in deliveries:
+        notification = delivery.notification
+        conf = get_engine_confs(
+            notification.task.task_type, notification.error).get(
+                delivery.engine)
+        if conf is None:
+            results[delivery.uuid] = (
+                None, ValueError("No conf for engine '%s'." % delivery.engine))
+            continue
+        try:
+            engine = get_engine(delivery.engine, conf)
+        except Exception as e:
+            results[delivery.uuid] = (None, e)
+            continue
+        to_send.append((engine, delivery))
+
+    if concurrency > 1 and len(to_send) > 1:
+        pool = ThreadPool(min(concurrency, len(to_send)))
+        try:
+            errors = pool.map(_pooled_deliver, to_send)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        errors = [_deliver(*engine_delivery) for engine_delivery in to_send]
+
+    for (engine, delivery), error in zip(to_send, errors):
+        results[delivery.uuid] = (engine, error)
+
+    delivered = failed = 0
+    for delivery in deliveries:
+        engine, error = results[delivery.uuid]
+        if _record(delivery, engine, error):
+            delivered += 1
+        else:
+            failed += 1
+    return delivered, failed
+
+
+def _record(delivery, engine, error):
+    now = timezone.now()
+    if error is None:
+        outbox.succeeded(delivery)
+        logger.info("(%s) - Delivered notification %s with %s, lag %ss." % (
+            now, delivery.notification_id, delivery.engine,
+            (now - delivery.created_on).total_seconds()))
+        return True
+
+    if outbox.failed(delivery, error):
+        logger.error("(%s) - Giving up on notification %s with %s: %s" % (
+            now, delivery.notification_id, delivery.engine, error))
+        if engine is not None:
+            engine.notify_failed(delivery.notification, error)
+    else:
+        logger.warning(
+            "(%s) - Notification %s with %s failed, attempt %s: %s" % (
+                now, delivery.notification_id, delivery.engine,
+                delivery.attempts, error))
+    return False
+
+
+def outbox_metrics():
+    """
+    Returns the size of the outbox by state, and the delivery lag
+    as the age in seconds of the oldest undelivered entry.
+    """
+    metrics = outbox.metrics()
+    metrics['delivery_lag'] = metrics.pop('lag')
+    return metrics
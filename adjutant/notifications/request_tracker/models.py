@@ -12,10 +12,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from threading import Lock
+
 from django.conf import settings
-from django.template import loader
 from adjutant.notifications.models import NotificationEngine
-from adjutant.api.models import Notification
+from adjutant.template_cache import get_template
 from rtkit.resource import RTResource
 from rtkit.authenticators import CookieAuthenticator
 from rtkit.errors import RTResourceError
@@ -47,15 +48,50 @@ class RTNotification(NotificationEngine):
                     ...
     """
 
+    delivery_errors = (RTResourceError, )
+
     def __init__(self, conf):
         super(RTNotification, self).__init__(conf)
-        tracker = RTResource(
+        # Engines are reused for every notification with this conf, so
+        # the tracker logs in once and then keeps its session cookie.
+        self.tracker = self._new_tracker()
+        self.tracker_lock = Lock()
+
+    def _new_tracker(self):
+        return RTResource(
             self.conf['url'], self.conf['username'], self.conf['password'],
             CookieAuthenticator)
-        self.tracker = tracker
+
+    def _renew_tracker(self, expired):
+        """
+        Replaces the tracker whose session has expired with one that
+        will log in again, and returns it.
+
+        Engines are shared by the outbox's delivery threads, so only
+        the first of them to find the session expired replaces it.
+        """
+        with self.tracker_lock:
+            if self.tracker is expired:
+                self.tracker = self._new_tracker()
+            return self.tracker
+
+    def _post(self, path, payload):
+        tracker = self.tracker
+        response = tracker.post(path=path, payload=payload)
+        if response.status_int == 401:
+            # the session has expired, so log in again and retry
+            response = self._renew_tracker(tracker).post(
+                path=path, payload=payload)
+        if response.status_int >= 400:
+            raise RTResourceError(
+                response.status, response.status_int, response)
+        return response
+
+    def _failure_message(self, error):
+        return "Error: '%s' while sending notification to RT." % error
 
     def _notify(self, task, notification):
-        template = loader.get_template(self.conf['template'])
+        template = get_template(self.conf['template'])
 
         context = {'task': task, 'notification': notification}
 
@@ -74,23 +110,10 @@ class RTNotification(NotificationEngine):
             }
         }
 
-        try:
-            self.tracker.post(path='ticket/new', payload=content)
-            if not notification.error:
-                notification.acknowledged = True
-                notification.save()
-        except RTResourceError as e:
-            notes = {
-                'errors':
-                    [("Error: '%s' while sending notification to " +
-                      "RT.") % e]
-            }
-            error_notification = Notification.objects.create(
-                task=notification.task,
-                notes=notes,
-                error=True
-            )
-            error_notification.save()
+        self._post('ticket/new', content)
+        if not notification.error:
+            notification.acknowledged = True
+            notification.save()
 
 
 notification_engines = {
@@ -0,0 +1,171 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+
+# extra candidates looked at beyond the claim limit, in case other
+# workers claim some of them first
+CLAIM_SLACK = 10
+
+
+class ClaimQueue(object):
+    """
+    A table of work items shared by polling workers.
+
+    Items are claimed with a conditional update on their state, attempts
+    and claim time, so any number of workers can share the table without
+    taking the same item twice. That includes an item left claimed for
+    longer than the timeout, which is assumed to have lost its worker and
+    is claimed again. Failed items are retried after the retry delay,
+    doubling with each attempt, until they run out of attempts.
+
+    The timeout, max attempts and retry delay are given as the names of
+    their settings, so they are read when used.
+    """
+
+    def __init__(self, model, waiting, claimed, done, owner_field,
+                 timeout, max_attempts, retry_delay=None,
+                 claimed_on_field='claimed_on', done_on_field=None,
+                 order_by='next_attempt_on', select_related=(),
+                 count_claims=False):
+        self.model = model
+        self.waiting = waiting
+        self.claimed = claimed
+        self.done = done
+        self.owner_field = owner_field
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.claimed_on_field = claimed_on_field
+        self.done_on_field = done_on_field
+        self.order_by = order_by
+        self.select_related = select_related
+        # whether attempts are counted when claimed, rather than
+        # when the outcome is recorded
+        self.count_claims = count_claims
+
+    def due(self, now):
+        lost_before = now - timedelta(
+            seconds=getattr(settings, self.timeout))
+        waiting = Q(state=self.waiting)
+        if self.retry_delay:
+            waiting &= Q(next_attempt_on__lte=now)
+        lost = Q(state=self.claimed,
+                 **{self.claimed_on_field + '__lt': lost_before})
+        return self.model.objects.filter(waiting | lost).select_related(
+            *self.select_related).order_by(self.order_by)
+
+    def claim(self, owner, limit, abandon=None):
+        """
+        Claims up to 'limit' due items for the owner, oldest first.
+
+        If given, 'abandon' is called with each lost item that has no
+        attempts left, and the current time, rather than claiming it.
+        """
+        now = timezone.now()
+        max_attempts = getattr(settings, self.max_attempts)
+        claimed = []
+        for item in self.due(now)[:limit + CLAIM_SLACK]:
+            if len(claimed) >= limit:
+                break
+            if (abandon is not None and item.state == self.claimed and
+                    item.attempts >= max_attempts):
+                abandon(item, now)
+                continue
+
+            # the claim time is part of the condition so only one of
+            # the workers that found the same lost item takes it
+            conditions = {
+                'pk': item.pk,
+                'state': item.state,
+                'attempts': item.attempts,
+                self.claimed_on_field: getattr(item, self.claimed_on_field),
+            }
+            updates = {
+                'state': self.claimed,
+                self.owner_field: owner,
+                self.claimed_on_field: now,
+            }
+            if self.count_claims:
+                updates['attempts'] = F('attempts') + 1
+            if self.model.objects.filter(**conditions).update(**updates):
+                item.state = self.claimed
+                setattr(item, self.owner_field, owner)
+                setattr(item, self.claimed_on_field, now)
+                if self.count_claims:
+                    item.attempts += 1
+                claimed.append(item)
+        return claimed
+
+    def succeeded(self, item):
+        """Records the item as done."""
+        if not self.count_claims:
+            item.attempts += 1
+        item.state = self.done
+        setattr(item, self.done_on_field, timezone.now())
+        item.last_error = ''
+        item.save()
+
+    def failed(self, item, error):
+        """
+        Records a failed attempt, queueing the item to be retried.
+        Returns True if it has run out of attempts and was failed
+        instead.
+        """
+        now = timezone.now()
+        if not self.count_claims:
+            item.attempts += 1
+        item.last_error = str(error)
+
+        if item.attempts >= getattr(settings, self.max_attempts):
+            item.state = 'failed'
+            item.save()
+            return True
+
+        item.state = self.waiting
+        item.next_attempt_on = now + timedelta(
+            seconds=getattr(settings, self.retry_delay) *
+            2 ** (item.attempts - 1))
+        item.save()
+        return False
+
+    def metrics(self):
+        """
+        Returns the number of items by state, other than done, the
+        queue depth of those waiting or claimed, and as 'lag' the age
+        in seconds of the oldest of those.
+        """
+        metrics = {
+            self.waiting: 0,
+            self.claimed: 0,
+            'failed': 0,
+        }
+        pk_name = self.model._meta.pk.name
+        counts = self.model.objects.exclude(state=self.done).values(
+            'state').annotate(count=Count(pk_name))
+        for count in counts:
+            metrics[count['state']] = count['count']
+
+        oldest = self.model.objects.filter(
+            state__in=[self.waiting, self.claimed]).aggregate(
+                oldest=Min('created_on'))['oldest']
+        metrics['queue_depth'] = metrics[self.waiting] + metrics[self.claimed]
+        metrics['lag'] = (
+            (timezone.now() - oldest).total_seconds() if oldest else 0)
+        return metrics
@@ -29,6 +29,11 @@ import yaml
 from adjutant.utils import setup_task_settings
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
+# The test configuration is used when running the tests, or when
+# ADJUTANT_TEST_CONFIG is set, such as by the benchmarks.
+TEST_CONFIG = (
+    'test' in sys.argv or bool(os.environ.get('ADJUTANT_TEST_CONFIG')))
+
 # Application definition
 
 INSTALLED_APPS = (
@@ -57,7 +62,7 @@ MIDDLEWARE_CLASSES = (
     'adjutant.middleware.RequestLoggingMiddleware'
 )
 
-if 'test' in sys.argv:
+if TEST_CONFIG:
     # modify MIDDLEWARE_CLASSES
     MIDDLEWARE_CLASSES = list(MIDDLEWARE_CLASSES)
     MIDDLEWARE_CLASSES.remove('adjutant.middleware.KeystoneHeaderUnwrapper')
@@ -94,7 +99,7 @@ TEMPLATES = [
 ]
 
 # Setup of local settings data
-if 'test' in sys.argv:
+if TEST_CONFIG:
     from adjutant import test_settings
     CONFIG = test_settings.conf_dict
 else:
@@ -155,6 +160,76 @@ USERNAME_IS_EMAIL = CONFIG['USERNAME_IS_EMAIL']
 # Keystone admin credentials:
 KEYSTONE = CONFIG['KEYSTONE']
 
+# time in seconds the Keystone role list is cached for:
+ROLE_CACHE_TTL = CONFIG.get('ROLE_CACHE_TTL', 300)
+
+# minimum time in seconds between role list refreshes for unknown role ids:
+ROLE_CACHE_MIN_REFRESH = CONFIG.get('ROLE_CACHE_MIN_REFRESH', 10)
+
+# number of a domain's users on a project above which listing the project's
+# users lists the whole domain rather than fetching each user:
+LIST_USERS_DOMAIN_THRESHOLD = CONFIG.get('LIST_USERS_DOMAIN_THRESHOLD', 20)
+
+# time in seconds a pooled OpenStack client is reused before being rebuilt:
+CLIENT_POOL_MAX_AGE = CONFIG.get('CLIENT_POOL_MAX_AGE', 600)
+
+# default page size for cursor paginated admin lists:
+DEFAULT_PAGE_LIMIT = CONFIG.get('DEFAULT_PAGE_LIMIT', 100)
+
+# run post_approve and submit in a job worker rather than the request:
+ASYNC_STAGES = CONFIG.get('ASYNC_STAGES', False)
+
+# time in seconds before a running job is assumed lost and run again:
+JOB_TIMEOUT = CONFIG.get('JOB_TIMEOUT', 600)
+
+# times a lost job is run again before being failed:
+JOB_MAX_ATTEMPTS = CONFIG.get('JOB_MAX_ATTEMPTS', 3)
+
+# queue notification engine deliveries for the notification dispatcher
+# rather than sending them in the request:
+NOTIFICATION_OUTBOX = CONFIG.get('NOTIFICATION_OUTBOX', False)
+
+# times a notification delivery is tried before being failed:
+NOTIFICATION_MAX_ATTEMPTS = CONFIG.get('NOTIFICATION_MAX_ATTEMPTS', 5)
+
+# seconds before retrying a failed delivery, doubled with each attempt:
+NOTIFICATION_RETRY_DELAY = CONFIG.get('NOTIFICATION_RETRY_DELAY', 30)
+
+# time in seconds before a delivery being sent is assumed lost:
+NOTIFICATION_DELIVERY_TIMEOUT = CONFIG.get(
+    'NOTIFICATION_DELIVERY_TIMEOUT', 300)
+
+# queue task emails for the email sender rather than sending them in
+# the request:
+EMAIL_QUEUE = CONFIG.get('EMAIL_QUEUE', False)
+
+# times a queued email is tried before being failed:
+EMAIL_MAX_ATTEMPTS = CONFIG.get('EMAIL_MAX_ATTEMPTS', 5)
+
+# seconds before retrying a failed email, doubled with each attempt:
+EMAIL_RETRY_DELAY = CONFIG.get('EMAIL_RETRY_DELAY', 30)
+
+# time in seconds before an email being sent is assumed lost:
+EMAIL_SEND_TIMEOUT = CONFIG.get('EMAIL_SEND_TIMEOUT', 300)
+
+# serve Prometheus metrics at /metrics, which is unauthenticated:
+METRICS_ENABLED = CONFIG.get('METRICS_ENABLED', False)
+# seconds the metrics read from the database are kept between scrapes:
+METRICS_REFRESH_INTERVAL = CONFIG.get('METRICS_REFRESH_INTERVAL', 30)
+
+# most users that can be invited in one bulk invite request:
+BULK_INVITE_MAX_USERS = CONFIG.get('BULK_INVITE_MAX_USERS', 500)
+
+# most tasks that can be approved in one bulk approve request:
+BULK_APPROVE_MAX_TASKS = CONFIG.get('BULK_APPROVE_MAX_TASKS', 500)
+# most tasks a bulk approve request approves without ASYNC_STAGES, when
+# each post_approve is run in the request:
+BULK_APPROVE_MAX_SYNC_TASKS = CONFIG.get('BULK_APPROVE_MAX_SYNC_TASKS', 20)
+# tasks a bulk approval approves at once:
+BULK_APPROVE_CONCURRENCY = CONFIG.get('BULK_APPROVE_CONCURRENCY', 4)
+# most tasks a bulk approval starts a second, 0 for no limit:
+BULK_APPROVE_RATE = CONFIG.get('BULK_APPROVE_RATE', 5)
+
 TOKEN_SUBMISSION_URL = CONFIG['TOKEN_SUBMISSION_URL']
 
 TOKEN_EXPIRE_TIME = CONFIG['TOKEN_EXPIRE_TIME']
@@ -2,6 +2,7 @@ from django.apps import AppConfig
 from django.conf import settings
 
 from adjutant.exceptions import ActionNotFound, TaskViewNotFound
+from adjutant.startup.plans import build_plans
 
 
 def check_expected_taskviews():
@@ -56,3 +57,6 @@ class StartUpConfig(AppConfig):
 
         # Now check if all the actions those views expecte are present.
         check_configured_actions()
+
+        # Resolve the settings for each task type once, up front.
+        build_plans()
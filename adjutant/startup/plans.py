@@ -0,0 +1,184 @@
+from collections import namedtuple
+from copy import deepcopy
+from threading import Lock
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from adjutant.exceptions import ActionNotFound
+
+
+class ReadOnlyDict(dict):
+    """
+    A dict that can't be modified, for the settings held in plans.
+
+    Still a dict, so it can be passed to anything expecting one and
+    serialised as one. Copies are ordinary dicts.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Task plans are read only.")
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def copy(self):
+        return dict(self)
+
+    def __reduce__(self):
+        return (dict, (dict(self), ))
+
+
+class ReadOnlyList(list):
+    """A list that can't be modified, for the settings held in plans."""
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Task plans are read only.")
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _read_only
+    __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return (list, (list(self), ))
+
+
+def read_only(value):
+    """Returns a read only version of the value and everything in it."""
+    if isinstance(value, dict):
+        return ReadOnlyDict(
+            (key, read_only(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return ReadOnlyList(read_only(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+# Plans are shared between requests and threads, so the settings in
+# them are read only, and modifying them raises a TypeError.
+TaskPlan = namedtuple('TaskPlan', [
+    'task_type',
+    # the task settings, or DEFAULT_TASK_SETTINGS if there are none:
+    'conf',
+    'action_names',
+    # (name, action class, serializer class) for each action, in order:
+    'actions',
+    'required_fields',
+    'emails',
+    # engine name to engine conf, for standard and error notifications:
+    'notifications',
+    'error_notifications',
+    'errors',
+    'action_settings',
+])
+
+PLAN_SETTINGS = (
+    'TASK_SETTINGS',
+    'DEFAULT_TASK_SETTINGS',
+    'DEFAULT_ACTION_SETTINGS',
+    'ACTION_CLASSES',
+    'TASKVIEW_CLASSES',
+    'ACTIVE_TASKVIEWS',
+)
+
+plans = {}
+plans_lock = Lock()
+
+
+def _engine_confs(conf, kind):
+    engine_confs = {}
+    for note_engine, engine_conf in conf.get('notifications', {}).items():
+        engine_conf = engine_conf.get(kind, {})
+        if engine_conf:
+            engine_confs[note_engine] = engine_conf
+    return engine_confs
+
+
+def build_plan(task_type, default_actions=()):
+    """
+    Resolves everything about a task type that comes from the settings.
+
+    'default_actions' are those of the TaskView, used when the task
+    settings don't give any.
+    """
+    task_conf = settings.TASK_SETTINGS.get(task_type)
+    conf = deepcopy(
+        task_conf if task_conf is not None
+        else settings.DEFAULT_TASK_SETTINGS)
+
+    action_names = tuple(
+        (conf.get('default_actions', []) or list(default_actions)) +
+        conf.get('additional_actions', []))
+
+    missing_actions = [
+        name for name in action_names if name not in settings.ACTION_CLASSES]
+    if missing_actions:
+        raise ActionNotFound(
+            "Configured actions are unregistered: %s" % missing_actions)
+
+    actions = tuple(
+        (name, ) + tuple(settings.ACTION_CLASSES[name])
+        for name in action_names)
+
+    required_fields = []
+    for name, action_class, serializer_class in actions:
+        for field in action_class.required:
+            if field not in required_fields:
+                required_fields.append(field)
+
+    if task_conf is not None and 'action_settings' in task_conf:
+        action_settings = conf['action_settings']
+    else:
+        action_settings = deepcopy(settings.DEFAULT_ACTION_SETTINGS)
+
+    conf = read_only(conf)
+    action_settings = read_only(action_settings)
+
+    return TaskPlan(
+        task_type=task_type,
+        conf=conf,
+        action_names=action_names,
+        actions=actions,
+        required_fields=tuple(required_fields),
+        emails=conf.get('emails', ReadOnlyDict()),
+        notifications=ReadOnlyDict(_engine_confs(conf, 'standard')),
+        error_notifications=ReadOnlyDict(_engine_confs(conf, 'error')),
+        errors=conf.get('errors', ReadOnlyDict()),
+        action_settings=action_settings,
+    )
+
+
+def get_plan(task_type, default_actions=()):
+    """
+    Returns the plan for the task type, building it on first use.
+
+    Plans are shared, so the settings in them are read only.
+    """
+    key = (task_type, tuple(default_actions))
+    plan = plans.get(key)
+    if plan is None:
+        plan = build_plan(task_type, default_actions)
+        with plans_lock:
+            plans[key] = plan
+    return plan
+
+
+def build_plans():
+    """Builds the plans for all the active TaskViews."""
+    with plans_lock:
+        plans.clear()
+    for taskview in settings.ACTIVE_TASKVIEWS:
+        task_class = settings.TASKVIEW_CLASSES[taskview]['class']
+        get_plan(task_class.task_type, task_class.default_actions)
+        # tasks are also looked up by type alone, such as for emails
+        get_plan(task_class.task_type)
+
+
+def _settings_changed(setting, **kwargs):
+    if setting in PLAN_SETTINGS:
+        with plans_lock:
+            plans.clear()
+
+
+setting_changed.connect(_settings_changed)
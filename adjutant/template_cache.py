@@ -0,0 +1,104 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+from threading import Lock
+
+from django.core.signals import setting_changed
+from django.template import loader
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
+
+
+def _reset_loaders(template):
+    for template_loader in template.backend.engine.template_loaders:
+        if hasattr(template_loader, 'reset'):
+            template_loader.reset()
+
+
+class TemplateCache(object):
+    """
+    Thread safe cache of compiled email and notification templates,
+    keyed by template engine and name.
+
+    Django only caches compiled templates when DEBUG is off, and then
+    never notices edits. Here a cached template is reloaded if the
+    modification time of its file has changed, so edits to templates
+    in /etc/adjutant/templates/ are picked up without a restart, and
+    templates are compiled once per process either way. Any cached
+    loader of the engine is reset before reloading.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._templates = {}
+            self._hits = 0
+            self._misses = 0
+            self._reloads = 0
+
+    def get(self, template_name, using=None):
+        key = (using, template_name)
+        with self._lock:
+            cached = self._templates.get(key)
+        if cached is not None:
+            template, mtime = cached
+            if _mtime(template.origin.name) == mtime:
+                with self._lock:
+                    self._hits += 1
+                return template
+            _reset_loaders(template)
+
+        template = loader.get_template(template_name, using=using)
+        mtime = _mtime(template.origin.name)
+        with self._lock:
+            if cached is not None:
+                self._reloads += 1
+            self._misses += 1
+            self._templates[key] = (template, mtime)
+        return template
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._templates),
+                'hits': self._hits,
+                'misses': self._misses,
+                'reloads': self._reloads,
+            }
+
+
+template_cache = TemplateCache()
+
+
+def get_template(template_name, using=None):
+    """ Cached equivalent of django.template.loader.get_template. """
+    return template_cache.get(template_name, using=using)
+
+
+def _templates_changed(setting, **kwargs):
+    # templates from the old engines can't be trusted
+    if setting == 'TEMPLATES':
+        template_cache.clear()
+
+
+setting_changed.connect(_templates_changed)
@@ -81,12 +81,14 @@ ACTIVE_TASKVIEWS = [
     'UserResetPassword',
     'UserSetPassword',
     'UserList',
+    'UserBulkInvite',
     'RoleList',
     'CreateProject',
     'InviteUser',
     'ResetPassword',
     'EditUser',
-    'UpdateEmail'
+    'UpdateEmail',
+    'SignUp',
 ]
 
 DEFAULT_TASK_SETTINGS = {
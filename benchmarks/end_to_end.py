@@ -0,0 +1,469 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+End to end throughput benchmark of the task workflows.
+
+Drives the Django WSGI application, with the test configuration, a
+scratch database, the fake Keystone of the API tests and the fake
+Neutron, Nova and Cinder clients of the action tests, through the
+sign up, invite, password reset and user list workflows at the given
+concurrency. Sign up runs as SignUp, admin approve then token submit,
+which sets up the network and quotas of the new project, invite as
+InviteUser then token submit, and reset as UserResetPassword then
+token submit.
+
+Reports requests per second for each workflow, and the latency
+percentiles, database queries and Keystone calls of each request type.
+Results can be saved as JSON, and compared with a saved run.
+
+Usage:
+    python benchmarks/end_to_end.py [--iterations 100] [--concurrency 8]
+        [--workflows signup,invite,reset,list] [--output run.json]
+        [--compare previous.json] [--database-config conf.yaml]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+from threading import RLock
+
+import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKFLOWS = ['signup', 'invite', 'reset', 'list']
+
+PASSWORD = 'bench_password'
+
+ADMIN_HEADERS = {
+    'project_name': 'admin_project',
+    'project_id': 'admin_project_id',
+    'roles': 'admin,_member_',
+    'username': 'admin',
+    'user_id': 'user_id_0',
+    'authenticated': True,
+}
+
+PROJECT_ADMIN_HEADERS = {
+    'project_name': 'bench_project',
+    'project_id': 'bench_project_id',
+    # admin as well, so the task id is returned
+    'roles': 'admin,project_admin,_member_',
+    'username': 'project_admin',
+    'user_id': 'user_id_0',
+    'authenticated': True,
+}
+
+
+def configure(database_config, tmp_dir):
+    """
+    Sets up Django with the benchmark settings, which use the test
+    configuration with a scratch database and log in 'tmp_dir'.
+    """
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    os.environ['ADJUTANT_BENCH_DIR'] = tmp_dir
+    if database_config:
+        os.environ['ADJUTANT_BENCH_DATABASE_CONFIG'] = database_config
+
+    import django
+    django.setup()
+
+
+def fake_cloud(iterations, project_users):
+    """
+    Sets up the fake Keystone of the test suite with the project that
+    users are invited to and listed from, and the users whose passwords
+    are reset, along with the fake Neutron, Nova and Cinder clients of
+    the action tests for the networks and quotas of signed up projects.
+
+    Returns the patches to apply. The fakes aren't thread safe, so
+    calls to them are serialised.
+    """
+    from adjutant.api.v1 import tests
+    from adjutant.actions.v1 import tests as action_tests
+
+    def resource(**kwargs):
+        res = mock.Mock()
+        for key, value in kwargs.items():
+            setattr(res, key, value)
+        return res
+
+    project = resource(
+        id='bench_project_id', name='bench_project', domain='default',
+        roles={})
+    users = {}
+    for i in range(project_users):
+        user = resource(
+            id='project_user_%s' % i, name='project_%s@example.com' % i,
+            email='project_%s@example.com' % i, domain='default')
+        users[user.id] = user
+        project.roles[user.id] = ['_member_']
+    for i in range(iterations):
+        user = resource(
+            id='reset_user_%s' % i, name='reset_%s@example.com' % i,
+            email='reset_%s@example.com' % i, domain='default')
+        users[user.id] = user
+    tests.setup_temp_cache({project.name: project}, users)
+
+    class BenchManager(tests.FakeManager):
+
+        def get_all_roles(self, user):
+            # the test version expects the user on every project
+            user = self._user_from_id(user)
+            projects = {}
+            for project in tests.temp_cache['projects'].values():
+                projects[project.id] = [
+                    resource(name=role)
+                    for role in project.roles.get(user.id, [])]
+            return projects
+
+    class BenchNeutronClient(action_tests.FakeNeutronClient):
+
+        def create_network(self, body):
+            # the test version expects the project to be set up first
+            region_cache = action_tests.neutron_cache.setdefault(
+                'RegionOne', {'i': 0})
+            region_cache.setdefault(body['network']['tenant_id'], {
+                'networks': {},
+                'subnets': {},
+                'routers': {},
+            })
+            return super(BenchNeutronClient, self).create_network(body)
+
+    lock = RLock()
+    manager = _locked_class(BenchManager, lock)
+    neutron = _locked_class(BenchNeutronClient, lock)
+    nova = _locked_class(action_tests.FakeNovaClient, lock)
+    cinder = _locked_class(action_tests.FakeCinderClient, lock)
+
+    clients = 'adjutant.actions.v1.resources.openstack_clients.'
+    return [
+        mock.patch('adjutant.actions.user_store.IdentityManager', manager),
+        mock.patch(clients + 'get_neutronclient', neutron),
+        mock.patch(clients + 'get_novaclient', nova),
+        mock.patch(clients + 'get_cinderclient', cinder),
+    ]
+
+
+def _locked_class(fake, lock):
+    """ Subclass of the fake whose methods all hold the lock. """
+    methods = {}
+    for name in dir(fake):
+        method = getattr(fake, name)
+        if (not name.startswith('_') and callable(method) and
+                not isinstance(method, type)):
+            methods[name] = _locked(method, lock)
+    return type(fake.__name__, (fake, ), methods)
+
+
+def _locked(method, lock):
+    def wrapper(*args, **kwargs):
+        with lock:
+            return method(*args, **kwargs)
+    return wrapper
+
+
+class Runner(object):
+    """
+    Sends requests to the WSGI application, recording the latency,
+    queries and Keystone calls of each by request type.
+    """
+
+    def __init__(self):
+        from django.core.handlers.wsgi import WSGIHandler
+        from django.test.client import RequestFactory
+
+        self.application = WSGIHandler()
+        self.factory = RequestFactory()
+        self.lock = RLock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def request(self, step, method, path, data=None, headers=None):
+        from django.db import connection
+        from adjutant.actions.stage_timing import (
+            install_query_counter, query_count)
+        from adjutant.actions.user_store import keystone_call_totals
+
+        if method == 'get':
+            request = self.factory.get(path, headers=headers or {})
+        else:
+            request = self.factory.post(
+                path, json.dumps(data), content_type='application/json',
+                headers=headers or {})
+        result = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            result['status'] = int(status.split(' ', 1)[0])
+
+        # requests are handled in this thread, on its connection
+        install_query_counter(connection)
+        queries = query_count()
+        calls = keystone_call_totals()[0]
+        start = time.time()
+        response = self.application(request.environ, start_response)
+        content = b''.join(response)
+        response.close()
+        latency = time.time() - start
+        queries = query_count() - queries
+        calls = keystone_call_totals()[0] - calls
+
+        with self.lock:
+            self.samples[step].append((latency, queries, calls))
+            if result['status'] >= 400:
+                self.errors[step] += 1
+        if result['status'] >= 400:
+            raise RequestFailed(step, result['status'], content)
+        return json.loads(content) if content else {}
+
+    def create_task(self, step, path, data, headers):
+        response = self.request(step, 'post', path, data, headers)
+        # errors after the task is created are only logged
+        if not isinstance(response, dict) or 'task' not in response:
+            raise RequestFailed(step, 200, json.dumps(response))
+        return response['task']
+
+    def token_for(self, task_id):
+        from adjutant.api.models import Token
+        return Token.objects.get(task_id=task_id).token
+
+    def submit_token(self, task_id):
+        self.request(
+            'token submit', 'post', '/v1/tokens/%s' % self.token_for(task_id),
+            {'password': PASSWORD})
+
+    def signup(self, i):
+        # admin headers only so that the task id is returned
+        task_id = self.create_task(
+            'SignUp', '/v1/openstack/sign-up',
+            {'project_name': 'signup_project_%s' % i,
+             'email': 'signup_%s@example.com' % i},
+            ADMIN_HEADERS)
+        self.request(
+            'admin approve', 'post', '/v1/tasks/%s' % task_id,
+            {'approved': True}, ADMIN_HEADERS)
+        self.submit_token(task_id)
+
+    def invite(self, i):
+        task_id = self.create_task(
+            'InviteUser', '/v1/openstack/users',
+            {'email': 'invite_%s@example.com' % i, 'roles': ['_member_']},
+            PROJECT_ADMIN_HEADERS)
+        self.submit_token(task_id)
+
+    def reset(self, i):
+        task_id = self.create_task(
+            'UserResetPassword', '/v1/openstack/users/password-reset',
+            {'email': 'reset_%s@example.com' % i}, ADMIN_HEADERS)
+        self.submit_token(task_id)
+
+    def list(self, i):
+        self.request(
+            'UserList', 'get', '/v1/openstack/users',
+            headers=PROJECT_ADMIN_HEADERS)
+
+    def run(self, workflow, iterations, concurrency):
+        """
+        Runs the workflow the given number of times, returning the
+        wall time taken and the number of failed iterations.
+        """
+        from django.db import connection
+
+        def iteration(i):
+            try:
+                getattr(self, workflow)(i)
+                return 0
+            except RequestFailed as e:
+                print("  %s" % e)
+                return 1
+            finally:
+                connection.close()
+
+        pool = ThreadPool(concurrency)
+        start = time.time()
+        try:
+            failed = sum(pool.map(iteration, range(iterations)))
+        finally:
+            pool.close()
+            pool.join()
+        return time.time() - start, failed
+
+
+class RequestFailed(Exception):
+
+    def __init__(self, step, status, content):
+        super(RequestFailed, self).__init__(
+            "%s returned %s: %s" % (step, status, content[:200]))
+
+
+def percentile(values, percent):
+    """ Nearest rank percentile of sorted values. """
+    if not values:
+        return None
+    rank = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+def summarise(samples, errors):
+    latencies = sorted(latency * 1000 for latency, __, __ in samples)
+    queries = [query_count for __, query_count, __ in samples]
+    calls = [call_count for __, __, call_count in samples]
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 2),
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'max': round(latencies[-1], 2),
+        },
+        'queries': {
+            'mean': round(float(sum(queries)) / len(queries), 2),
+            'max': max(queries),
+        },
+        'keystone_calls': {
+            'mean': round(float(sum(calls)) / len(calls), 2),
+            'max': max(calls),
+        },
+    }
+
+
+def print_results(results, previous=None):
+    print("%-12s | %9s | %8s | %6s" % (
+        'workflow', 'requests', 'rps', 'failed'))
+    for name in WORKFLOWS:
+        if name not in results['workflows']:
+            continue
+        workflow = results['workflows'][name]
+        line = "%-12s | %9d | %8.1f | %6d" % (
+            name, workflow['requests'], workflow['rps'], workflow['failed'])
+        if previous and name in previous['workflows']:
+            line += "  (%+.1f%% rps)" % change(
+                previous['workflows'][name]['rps'], workflow['rps'])
+        print(line)
+
+    print("\n%-18s | %8s | %8s | %8s | %7s | %8s" % (
+        'request', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'queries',
+        'keystone'))
+    for name, step in sorted(results['requests'].items()):
+        latency = step['latency_ms']
+        line = "%-18s | %8.1f | %8.1f | %8.1f | %7.1f | %8.1f" % (
+            name, latency['p50'], latency['p95'], latency['p99'],
+            step['queries']['mean'], step['keystone_calls']['mean'])
+        if previous and name in previous['requests']:
+            old = previous['requests'][name]
+            line += "  (%+.1f%% p95, %+.1f queries)" % (
+                change(old['latency_ms']['p95'], latency['p95']),
+                step['queries']['mean'] - old['queries']['mean'])
+        print(line)
+
+
+def change(old, new):
+    if not old:
+        return 0.0
+    return (new - old) * 100.0 / old
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--iterations', type=int, default=100,
+                        help="Times each workflow is run.")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workflows', default=','.join(WORKFLOWS))
+    parser.add_argument('--project-users', type=int, default=50,
+                        help="Users in the project that UserList lists.")
+    parser.add_argument('--database-config',
+                        help="A conf.yaml to take DATABASES from, rather "
+                             "than a scratch sqlite database.")
+    parser.add_argument('--label', help="Name of the run, such as a release.")
+    parser.add_argument('--output', help="File to save the results to.")
+    parser.add_argument('--compare', help="Saved results to compare with.")
+    args = parser.parse_args()
+
+    workflows = args.workflows.split(',')
+    for workflow in workflows:
+        if workflow not in WORKFLOWS:
+            parser.error("Unknown workflow: %s" % workflow)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        configure(args.database_config, tmp_dir)
+
+        from django.conf import settings
+        from django.core.management import call_command
+
+        call_command('migrate', verbosity=0)
+        patches = fake_cloud(args.iterations, args.project_users)
+
+        runner = Runner()
+        results = {
+            'label': args.label,
+            'started': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'iterations': args.iterations,
+            'concurrency': args.concurrency,
+            'workflows': {},
+            'requests': {},
+        }
+        for patch in patches:
+            patch.start()
+        try:
+            for workflow in workflows:
+                before = sum(len(samples)
+                             for samples in runner.samples.values())
+                duration, failed = runner.run(
+                    workflow, args.iterations, args.concurrency)
+                requests = sum(len(samples) for samples
+                               in runner.samples.values()) - before
+                results['workflows'][workflow] = {
+                    'duration': round(duration, 3),
+                    'requests': requests,
+                    'rps': round(requests / duration, 2),
+                    'failed': failed,
+                }
+        finally:
+            for patch in patches:
+                patch.stop()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    for step, samples in runner.samples.items():
+        results['requests'][step] = summarise(samples, runner.errors[step])
+
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("\nResults saved to %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
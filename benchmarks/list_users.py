@@ -0,0 +1,102 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of IdentityManager.list_users against a fake Keystone.
+
+Compares the bulk listing with the old approach of fetching every
+assigned user individually, for a range of project sizes. Each fake
+Keystone call sleeps for the given latency to emulate a real round-trip.
+
+Usage:
+    python benchmarks/list_users.py [--latency-ms 2] [--sizes 10,100,2000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mock  # noqa: E402
+
+from django.conf import settings  # noqa: E402
+
+from adjutant.actions import user_store  # noqa: E402
+from adjutant.actions.v1.tests import FakeKeystoneClient  # noqa: E402
+
+
+def per_user_list_users(ks_client, project):
+    """The previous list_users, which fetched each user singly."""
+    roles = ks_client.roles.list()
+    role_dict = {role.id: role for role in roles}
+
+    users = {}
+    for assignment in ks_client.role_assignments.list(project=project):
+        user = users.get(assignment.user['id'], None)
+        if user:
+            user.roles.append(role_dict[assignment.role['id']])
+        else:
+            user = ks_client.users.get(assignment.user['id'])
+            user.roles = [role_dict[assignment.role['id']], ]
+            users[user.id] = user
+    return users.values()
+
+
+def run(size, latency):
+    ks_client = FakeKeystoneClient(latency=latency)
+    ks_client.setup_project('bench_project', size)
+
+    start = time.time()
+    per_user_list_users(ks_client, 'bench_project')
+    per_user = (time.time() - start, ks_client.call_count)
+
+    ks_client.calls.clear()
+    user_store.role_catalog.clear()
+    with mock.patch.object(
+            user_store, 'get_keystoneclient', lambda: ks_client):
+        start = time.time()
+        user_store.IdentityManager().list_users('bench_project')
+        bulk = (time.time() - start, ks_client.call_count)
+
+    return per_user, bulk
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--latency-ms', type=float, default=1.0)
+    parser.add_argument('--sizes', default='10,100,500,2000')
+    args = parser.parse_args()
+
+    settings.configure(
+        ROLE_CACHE_TTL=300, ROLE_CACHE_MIN_REFRESH=10,
+        LIST_USERS_DOMAIN_THRESHOLD=20)
+
+    latency = args.latency_ms / 1000.0
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    print("%8s | %20s | %20s" % ('users', 'per-user', 'bulk'))
+    print("%8s | %8s %11s | %8s %11s" % (
+        '', 'calls', 'time (ms)', 'calls', 'time (ms)'))
+    for size in sizes:
+        (per_user_time, per_user_calls), (bulk_time, bulk_calls) = run(
+            size, latency)
+        print("%8d | %8d %11.1f | %8d %11.1f" % (
+            size, per_user_calls, per_user_time * 1000,
+            bulk_calls, bulk_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of the hot task, token and notification queries.
+
+Seeds a scratch sqlite database with the given number of tasks, then
+shows the query plan and best time of each query both before and after
+the composite index migration.
+
+Usage:
+    python benchmarks/query_indexes.py [--tasks 200000] [--repeat 20]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+BEFORE = '0005_actionnote'
+AFTER = '0006_composite_indexes'
+
+TASK_TYPES = ['invite_user', 'create_project', 'reset_password',
+              'update_quota', 'edit_user']
+
+
+def seed(count, batch_size=5000):
+    from django.utils import timezone
+    from adjutant.api.models import Notification, Task, Token
+
+    random.seed(0)
+    now = timezone.now()
+    hash_keys = [uuid4().hex for i in range(count // 10 or 1)]
+    projects = ['project_%s' % i for i in range(count // 100 or 1)]
+
+    for start in range(0, count, batch_size):
+        tasks = []
+        tokens = []
+        notifications = []
+        for i in range(start, min(start + batch_size, count)):
+            created_on = now - timedelta(seconds=count - i)
+            completed = random.random() > 0.1
+            task = Task(
+                hash_key=random.choice(hash_keys),
+                ip_address='0.0.0.0',
+                project_id=random.choice(projects),
+                task_type=random.choice(TASK_TYPES),
+                completed=completed,
+                cancelled=not completed and random.random() > 0.5,
+                created_on=created_on)
+            tasks.append(task)
+            if i % 2:
+                tokens.append(Token(
+                    task=task, token=uuid4().hex, created_on=created_on,
+                    expires=created_on + timedelta(hours=24)))
+            error = random.random() > 0.9
+            notifications.append(Notification(
+                task=task, error=error, created_on=created_on,
+                acknowledged=not error or random.random() > 0.05))
+        Task.objects.bulk_create(tasks)
+        Token.objects.bulk_create(tokens)
+        Notification.objects.bulk_create(notifications)
+
+
+def queries():
+    from adjutant.api.models import Notification, Task, Token
+
+    task = Task.objects.order_by('?').first()
+    middle = Task.objects.order_by('-created_on')[
+        Task.objects.count() // 2]
+    return [
+        ('duplicate check', Task.objects.filter(
+            hash_key=task.hash_key, completed=0, cancelled=0)),
+        ('pending invites', Task.objects.filter(
+            project_id=task.project_id, task_type='invite_user',
+            completed=0, cancelled=0)),
+        ('task list', Task.objects.order_by(
+            '-created_on', '-uuid')[:100]),
+        ('task list deep cursor', Task.objects.filter(
+            created_on__lt=middle.created_on).order_by(
+            '-created_on', '-uuid')[:100]),
+        ('token list', Token.objects.order_by(
+            '-created_on', '-token')[:100]),
+        ('notification list', Notification.objects.order_by(
+            '-created_on', '-uuid')[:100]),
+        ('status errors', Notification.objects.filter(
+            error=1, acknowledged=0)),
+    ]
+
+
+def measure(repeat):
+    from django.db import connection
+
+    results = []
+    for name, queryset in queries():
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = '; '.join(row[-1] for row in cursor.fetchall())
+        best = None
+        for i in range(repeat):
+            start = time.time()
+            list(queryset.all())
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append((name, best, plan))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--tasks', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    settings.configure(
+        INSTALLED_APPS=['adjutant.actions', 'adjutant.api'],
+        DATABASES={'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(tmp_dir, 'bench.sqlite3')}},
+        USE_TZ=True)
+    django.setup()
+
+    from django.core.management import call_command
+
+    try:
+        call_command('migrate', 'api', BEFORE, verbosity=0)
+        call_command('migrate', 'actions', verbosity=0)
+        start = time.time()
+        seed(args.tasks)
+        print("Seeded %d tasks in %.1fs\n" % (
+            args.tasks, time.time() - start))
+
+        before = measure(args.repeat)
+        call_command('migrate', 'api', AFTER, verbosity=0)
+        after = measure(args.repeat)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print("%-22s | %12s | %12s" % ('query', 'before (ms)', 'after (ms)'))
+    for (name, before_time, __), (__, after_time, __) in zip(before, after):
+        print("%-22s | %12.2f | %12.2f" % (
+            name, before_time * 1000, after_time * 1000))
+
+    print("\nQuery plans:")
+    for (name, __, before_plan), (__, __, after_plan) in zip(before, after):
+        print("%s\n  before: %s\n  after:  %s" % (
+            name, before_plan, after_plan))
+
+
+if __name__ == '__main__':
+    main()
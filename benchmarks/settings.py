@@ -0,0 +1,64 @@
+# Copyright (C) 2015 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Django settings for the end to end benchmark.
+
+The test configuration, with its header middleware so requests can give
+the Keystone token data directly, and a scratch database and log in
+ADJUTANT_BENCH_DIR unless ADJUTANT_BENCH_DATABASE_CONFIG names a
+conf.yaml to take DATABASES from.
+"""
+
+import os
+from copy import deepcopy
+
+import yaml
+
+os.environ['ADJUTANT_TEST_CONFIG'] = '1'
+
+from adjutant.settings import *  # noqa: E402,F401,F403
+from adjutant.utils import setup_task_settings  # noqa: E402
+
+BENCH_DIR = os.environ['ADJUTANT_BENCH_DIR']
+
+if os.environ.get('ADJUTANT_BENCH_DATABASE_CONFIG'):
+    with open(os.environ['ADJUTANT_BENCH_DATABASE_CONFIG']) as f:
+        DATABASES = yaml.load(f)['DATABASES']
+else:
+    DATABASES = {'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCH_DIR, 'bench.sqlite3'),
+        'OPTIONS': {'timeout': 60}}}
+
+LOGGING = deepcopy(LOGGING)  # noqa: F405
+LOGGING['handlers']['file']['filename'] = os.path.join(BENCH_DIR, 'bench.log')
+
+DEBUG = False
+ALLOWED_HOSTS = ['testserver']
+EMAIL_BACKEND = 'django.core.mail.backends.dummy.EmailBackend'
+
+# Sign ups set up the network and quotas of their project, as in the
+# example conf.yaml, against the fake clients of the action tests.
+TASK_SETTINGS = dict(TASK_SETTINGS)  # noqa: F405
+TASK_SETTINGS.update(setup_task_settings(
+    DEFAULT_TASK_SETTINGS, DEFAULT_ACTION_SETTINGS, {  # noqa: F405
+        'signup': {
+            'additional_actions': [
+                'NewProjectDefaultNetworkAction',
+                'SetProjectQuotaAction',
+            ],
+            'default_region': 'RegionOne',
+        },
+    }))